@@ -1,8 +1,11 @@
-import pickle
 import logging
+import pickle
 import secrets
+
 import pynetbox
+
 import netwalk
+
 from .. import import_to_netbox as nbimp
 
 logger = logging.getLogger(__name__)
@@ -21,13 +24,8 @@ nb = pynetbox.api(
     token=secrets.NB_API
 )
 
-def no_ap(nei: dict):
-    if "ap" in nei['hostname'][4:6].lower():
-        return False
-    elif "axis" in nei['hostname'].lower():
-        return False
-    else:
-        return True
+# No access points (site code, then "ap") nor Axis cameras
+in_scope = netwalk.ScopePolicy(deny_hostnames=[r"^.{4}ap", "axis"])
 
 
 
@@ -51,7 +49,7 @@ for site in sites:
 
     password = secrets.DATA[site.name]['password']
 
-    fabric.init_from_seed_device(devices, [(secrets.USERNAME, password)], [{'secret': password, "transport": "telnet"}, {"secret": password}], 10, no_ap, scan_options={'blacklist': ['lldp_neighbors']})
+    fabric.init_from_seed_device(devices, [(secrets.USERNAME, password)], [{'secret': password, "transport": "telnet"}, {"secret": password}], 10, scope=in_scope, scan_options={'blacklist': ['lldp_neighbors']})
 
     with open("bindata/"+site.slug+".bin", "wb") as outfile:
         pickle.dump(fabric, outfile)
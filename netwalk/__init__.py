@@ -1,11 +1,17 @@
 "Main file for library"
 
 #pylint: disable=wrong-import-order
+from .bastion import BastionPool
+from .cache import CapabilityCache, ConnectionProfileCache
 from .device import Device, Switch
 from .fabric import Fabric
 from .interface import Interface
+from .scheduler import PollScheduler
+from .scope import ScopePolicy
 
-__all__ = ["Interface", "Switch", "Fabric", "Device"]
+__all__ = ["Interface", "Switch", "Fabric", "Device",
+           "ConnectionProfileCache", "CapabilityCache", "BastionPool",
+           "PollScheduler", "ScopePolicy"]
 
 
 # Taken from requests library, check their documentation
@@ -0,0 +1,236 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+from typing import List, Optional
+
+import paramiko
+
+
+class _Connection():
+    """A connection to the bastion in a BastionPool"""
+
+    def __init__(self):
+        #: SSH client, None until connected
+        self.client: Optional[paramiko.SSHClient] = None
+        #: Open channels
+        self.channels: List[paramiko.Channel] = []
+        #: Channels being opened
+        self.reserved = 0
+        #: Held while connecting, so only one worker connects
+        self.lock = threading.Lock()
+
+    @property
+    def busy(self) -> int:
+        """Channels open or being opened"""
+        return len(self.channels) + self.reserved
+
+
+class BastionPool():
+    """
+    Keep a few SSH connections to a bastion host open and tunnel
+    device sessions through them as direct-tcpip channels,
+    instead of a new ProxyJump handshake for every device.
+
+    A new connection to the bastion is only opened when every open one
+    carries channels_per_connection channels, up to max_connections.
+    After that channels are spread over the least busy connection.
+    """
+
+    logger: logging.Logger
+    #: Bastion address
+    host: str
+    #: Bastion SSH port
+    port: int
+    #: Bastion username
+    username: str
+    #: Maximum connections to the bastion
+    max_connections: int
+    #: Channels on a connection before another one is opened
+    channels_per_connection: int
+    #: Seconds to wait for the bastion and for channels to open
+    timeout: float
+
+    def __init__(self,
+                 host: str,
+                 username: str,
+                 password: Optional[str] = None,
+                 port: int = 22,
+                 key_filename: Optional[str] = None,
+                 max_connections: int = 2,
+                 channels_per_connection: int = 10,
+                 timeout: float = 10,
+                 host_key_policy: Optional[paramiko.MissingHostKeyPolicy] = None):
+        """
+        :param host: Bastion address
+        :type host: str
+        :param username: Bastion username
+        :type username: str
+        :param password: Bastion password, defaults to None
+        :type password: str, optional
+        :param port: Bastion SSH port, defaults to 22
+        :type port: int, optional
+        :param key_filename: Private key file, defaults to None (SSH agent and default keys)
+        :type key_filename: str, optional
+        :param max_connections: Maximum connections to the bastion, defaults to 2
+        :type max_connections: int, optional
+        :param channels_per_connection: Channels on a connection before another one is opened, defaults to 10
+        :type channels_per_connection: int, optional
+        :param timeout: Seconds to wait for the bastion and for channels to open, defaults to 10
+        :type timeout: float, optional
+        :param host_key_policy: What to do with a bastion host key not in known_hosts, defaults to rejecting it
+        :type host_key_policy: paramiko.MissingHostKeyPolicy, optional
+        """
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.max_connections = max_connections
+        self.channels_per_connection = channels_per_connection
+        self.timeout = timeout
+        self._password = password
+        self._key_filename = key_filename
+        self._host_key_policy = host_key_policy
+        self._connections: List[_Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> paramiko.SSHClient:
+        """Open a new connection to the bastion"""
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(
+            self._host_key_policy if self._host_key_policy is not None else paramiko.RejectPolicy())
+
+        self.logger.info("Connecting to bastion %s", self.host)
+        client.connect(self.host,
+                       port=self.port,
+                       username=self.username,
+                       password=self._password,
+                       key_filename=self._key_filename,
+                       timeout=self.timeout,
+                       banner_timeout=self.timeout,
+                       auth_timeout=self.timeout)
+
+        # Keep idle connections from being dropped between discoveries
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def _pick_connection(self) -> _Connection:
+        """Return the connection to open the next channel on,
+        with a channel reserved on it. Call with the lock held"""
+        alive = []
+        for connection in self._connections:
+            if connection.client is None:
+                # Not connected yet, or connecting failed and nobody is waiting for it
+                if connection.reserved:
+                    alive.append(connection)
+                continue
+
+            transport = connection.client.get_transport()
+            if transport is None or not transport.is_active():
+                self.logger.info("Connection to bastion %s lost", self.host)
+                connection.client.close()
+                continue
+
+            connection.channels[:] = [x for x in connection.channels if not x.closed]
+            alive.append(connection)
+
+        self._connections = alive
+
+        least_busy = min(alive, key=lambda x: x.busy, default=None)
+        if least_busy is None or (least_busy.busy >= self.channels_per_connection
+                                  and len(alive) < self.max_connections):
+            least_busy = _Connection()
+            self._connections.append(least_busy)
+
+        least_busy.reserved += 1
+        return least_busy
+
+    def open_channel(self, address: str, port: int = 22) -> paramiko.Channel:
+        """
+        Open a channel to a device through the bastion.
+        It can be passed to Netmiko as sock.
+
+        :param address: Device address, as seen from the bastion
+        :type address: str
+        :param port: Device port, defaults to 22
+        :type port: int, optional
+        :return: Channel connected to the device
+        :rtype: paramiko.Channel
+        """
+        # Only the choice of connection is serialized, a slow bastion
+        # or an unreachable device must not hold up the other workers
+        with self._lock:
+            connection = self._pick_connection()
+
+        channel = None
+        try:
+            with connection.lock:
+                if connection.client is None:
+                    connection.client = self._connect()
+
+            channel = connection.client.get_transport().open_channel('direct-tcpip',
+                                                                     (str(address), port),
+                                                                     ('127.0.0.1', 0),
+                                                                     timeout=self.timeout)
+        finally:
+            with self._lock:
+                connection.reserved -= 1
+                if channel is not None:
+                    connection.channels.append(channel)
+
+        self.logger.debug("Opened channel to %s:%d through %s",
+                          address, port, self.host)
+        return channel
+
+    def set_password(self, password: str) -> None:
+        """Set the bastion password, e.g. after loading a snapshot
+
+        :param password: Bastion password
+        :type password: str
+        """
+        self._password = password
+
+    @property
+    def connections(self) -> int:
+        """Number of connections to the bastion currently open"""
+        with self._lock:
+            return len([x for x in self._connections if x.client is not None])
+
+    def close(self) -> None:
+        """Close every connection to the bastion"""
+        with self._lock:
+            for connection in self._connections:
+                if connection.client is not None:
+                    connection.client.close()
+
+            self._connections = []
+
+    def __getstate__(self):
+        # Connections cannot be pickled, they are opened again when needed.
+        # The password is not written to snapshots, set it again with set_password()
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        state['_connections'] = []
+        state['_password'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,409 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import abc
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+
+class FileCache(abc.ABC):
+    """
+    Base for thread safe caches that can be saved to a JSON file.
+    Subclasses implement _to_dict() and _from_dict().
+    """
+
+    logger: logging.Logger
+    #: File the cache is loaded from and saved to. None keeps it in memory only
+    path: Optional[Union[str, os.PathLike]]
+
+    def __init__(self, path: Optional[Union[str, os.PathLike]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load_if_exists(self) -> None:
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    def load(self) -> None:
+        """Load cache from self.path"""
+        with open(self.path, 'r', encoding='utf-8') as infile:
+            data = json.load(infile)
+
+        with self._lock:
+            self._from_dict(data)
+
+    def save(self) -> None:
+        """Write cache to self.path"""
+        if self.path is None:
+            return
+
+        with self._lock:
+            data = self._to_dict()
+
+        with open(self.path, 'w', encoding='utf-8') as outfile:
+            json.dump(data, outfile, indent=2)
+
+    @abc.abstractmethod
+    def _to_dict(self) -> dict:
+        """Contents of the cache as saved to JSON"""
+
+    @abc.abstractmethod
+    def _from_dict(self, data: dict) -> None:
+        """Replace the contents of the cache with what _to_dict() returned"""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class ConnectionProfileCache(FileCache):
+    """
+    Remember which NAPALM optional args and credentials worked for a device
+    so they can be tried first next time.
+
+    Profiles are stored per management address, per subnet and per site.
+    Credentials and optional args are only stored as salted hashes,
+    never in plain text.
+    """
+
+    #: Seconds after which a profile is ignored
+    ttl: int
+    #: Prefix length used to group addresses in the same subnet
+    subnet_prefix: int
+    #: Site name, used as last fallback
+    site: Optional[str]
+    #: Dictionary of {key: profile}, key is "host:<ip>", "subnet:<prefix>" or "site:<name>"
+    profiles: Dict[str, dict]
+
+    HASH_ITERATIONS = 100000
+
+    def __init__(self,
+                 path: Optional[Union[str, os.PathLike]] = None,
+                 ttl: int = 7*24*3600,
+                 subnet_prefix: int = 24,
+                 site: Optional[str] = None):
+        super().__init__(path)
+        self.ttl = ttl
+        self.subnet_prefix = subnet_prefix
+        self.site = site
+        self.profiles = {}
+        self._salt = secrets.token_hex(16)
+        self._fingerprints = {}
+        self._load_if_exists()
+
+    def _to_dict(self) -> dict:
+        return {'salt': self._salt,
+                'profiles': self.profiles}
+
+    def _from_dict(self, data: dict) -> None:
+        self._salt = data['salt']
+        self._fingerprints = {}
+        self.profiles = data['profiles']
+
+    def _fingerprint(self, value) -> str:
+        """Salted hash of a credential tuple or optional args dict"""
+        plain = json.dumps(value, sort_keys=True, default=str)
+        try:
+            return self._fingerprints[plain]
+        except KeyError:
+            digest = hashlib.pbkdf2_hmac('sha256', plain.encode(),
+                                         bytes.fromhex(self._salt),
+                                         self.HASH_ITERATIONS).hex()
+            self._fingerprints[plain] = digest
+            return digest
+
+    def _keys(self, address) -> List[str]:
+        """Cache keys for an address, most specific first"""
+        keys = []
+        if address is not None:
+            address = ipaddress.ip_address(address)
+            prefix = min(self.subnet_prefix, address.max_prefixlen)
+            subnet = ipaddress.ip_interface(f"{address}/{prefix}").network
+            keys.append(f"host:{address}")
+            keys.append(f"subnet:{subnet}")
+
+        if self.site is not None:
+            keys.append(f"site:{self.site}")
+
+        return keys
+
+    def get(self, address) -> Optional[dict]:
+        """
+        Return the most specific valid profile for an address
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :return: Profile dict or None
+        :rtype: dict
+        """
+        now = time.time()
+        with self._lock:
+            for key in self._keys(address):
+                profile = self.profiles.get(key)
+                if profile is None:
+                    continue
+
+                if now - profile['timestamp'] > self.ttl:
+                    self.logger.debug("Profile %s expired", key)
+                    continue
+
+                return profile
+
+        return None
+
+    def order(self, address, credentials: list, napalm_optional_args: list) -> List[Tuple[Optional[dict], tuple]]:
+        """
+        Return every (optional_args, credential) combination,
+        the one known to work for this address first
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :param credentials: List of (username, password) tuples
+        :type credentials: list(tuple(str,str))
+        :param napalm_optional_args: List of NAPALM optional args
+        :type napalm_optional_args: list(dict)
+        :return: List of (optional_args, credential)
+        :rtype: list(tuple(dict, tuple(str, str)))
+        """
+        attempts = [(optional_arg, cred)
+                    for optional_arg in napalm_optional_args
+                    for cred in credentials]
+
+        profile = self.get(address)
+        if profile is None:
+            return attempts
+
+        for i, (optional_arg, cred) in enumerate(attempts):
+            if self._fingerprint(optional_arg) == profile['optional_args'] and \
+                    self._fingerprint(list(cred)) == profile['credential']:
+                self.logger.debug("Trying cached %s login first for %s",
+                                  profile['transport'], address)
+                attempts.insert(0, attempts.pop(i))
+                break
+
+        return attempts
+
+    def record_success(self, address, optional_arg: Optional[dict], cred: tuple, login_time: float) -> None:
+        """
+        Store a working combination for an address, its subnet and site
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :param optional_arg: NAPALM optional args that worked
+        :type optional_arg: dict
+        :param cred: (username, password) that worked
+        :type cred: tuple(str, str)
+        :param login_time: Seconds it took to log in
+        :type login_time: float
+        """
+        profile = {'optional_args': self._fingerprint(optional_arg),
+                   'credential': self._fingerprint(list(cred)),
+                   'transport': (optional_arg or {}).get('transport', 'ssh'),
+                   'login_time': login_time,
+                   'timestamp': time.time()}
+
+        with self._lock:
+            for key in self._keys(address):
+                self.profiles[key] = profile
+
+    def invalidate(self, address) -> None:
+        """
+        Forget the profile of a single address
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        """
+        if address is None:
+            return
+
+        with self._lock:
+            self.profiles.pop(f"host:{ipaddress.ip_address(address)}", None)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_fingerprints')
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._fingerprints = {}
+
+
+class CapabilityCache(FileCache):
+    """
+    Remember which scan modules a device or platform does not support
+    so they can be skipped on later runs.
+
+    Only a real sign of a missing feature counts: "% Invalid input", an output
+    the template cannot parse or a NAPALM getter not implemented for the driver.
+    Empty results, failures and timeouts say nothing and are not recorded.
+    A module is skipped on a device after min_observations such results in a row.
+    It is skipped on every device of a platform once it was unsupported
+    platform_min_samples times on that platform and supported on no device.
+    Modules in NEVER_SKIPPED are always run, and the running config is always read.
+    Everything is tried again after reprobe_interval seconds.
+    """
+
+    #: Modules netwalk cannot do without, never skipped
+    NEVER_SKIPPED = frozenset({'interface_status', 'mac_address', 'cdp_neighbors'})
+
+    #: Seconds after which a module is tried again
+    reprobe_interval: int
+    #: Unsupported results in a row before a module is skipped on a device
+    min_observations: int
+    #: Devices of a platform that must agree before a module is skipped platform-wide
+    platform_min_samples: int
+    #: Dictionary of {mgmt address: {module: {'unsupported': results in a row, 'timestamp': epoch}}}
+    devices: Dict[str, Dict[str, dict]]
+    #: Dictionary of {platform: {module: {'unsupported': int, 'supported': int, 'timestamp': epoch}}}
+    platforms: Dict[str, Dict[str, dict]]
+    #: Dictionary of {mgmt address: {'platform': NAPALM driver, 'timestamp': epoch}}
+    device_platforms: Dict[str, dict]
+
+    def __init__(self,
+                 path: Optional[Union[str, os.PathLike]] = None,
+                 reprobe_interval: int = 7*24*3600,
+                 platform_min_samples: int = 3,
+                 min_observations: int = 3):
+        super().__init__(path)
+        self.reprobe_interval = reprobe_interval
+        self.platform_min_samples = platform_min_samples
+        self.min_observations = min_observations
+        self.devices = {}
+        self.platforms = {}
+        self.device_platforms = {}
+        self._load_if_exists()
+
+    def _to_dict(self) -> dict:
+        return {'devices': self.devices,
+                'platforms': self.platforms,
+                'device_platforms': self.device_platforms}
+
+    def _from_dict(self, data: dict) -> None:
+        # Older files counted empty results and failures too, they are dropped
+        self.devices = {address: {k: v for k, v in modules.items() if 'unsupported' in v}
+                        for address, modules in data['devices'].items()}
+        self.platforms = {platform: {k: v for k, v in modules.items() if 'unsupported' in v}
+                          for platform, modules in data['platforms'].items()}
+        self.device_platforms = data.get('device_platforms', {})
+
+    def get_platform(self, address) -> Optional[str]:
+        """
+        Return the NAPALM driver that last worked on a device
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :return: NAPALM driver name, None if unknown or older than reprobe_interval
+        :rtype: str
+        """
+        with self._lock:
+            data = self.device_platforms.get(str(address))
+
+        if data is None or time.time() - data['timestamp'] >= self.reprobe_interval:
+            return None
+
+        return data['platform']
+
+    def record_platform(self, address, platform: str) -> None:
+        """
+        Store the NAPALM driver that worked on a device
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :param platform: NAPALM driver name
+        :type platform: str
+        """
+        with self._lock:
+            self.device_platforms[str(address)] = {'platform': platform,
+                                                   'timestamp': time.time()}
+
+    def modules_to_skip(self, address, platform: Optional[str] = None) -> Set[str]:
+        """
+        Return modules known to be unsupported on a device
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :param platform: Platform identifier, e.g. "ios:WS-C2960X-48FPD-L", defaults to None
+        :type platform: str, optional
+        :return: Set of module names
+        :rtype: set(str)
+        """
+        now = time.time()
+        skip = set()
+        with self._lock:
+            for module, data in self.devices.get(str(address), {}).items():
+                if now - data['timestamp'] < self.reprobe_interval and \
+                        data['unsupported'] >= self.min_observations:
+                    skip.add(module)
+
+            if platform is not None:
+                for module, data in self.platforms.get(platform, {}).items():
+                    if now - data['timestamp'] >= self.reprobe_interval:
+                        continue
+                    if data['supported'] == 0 and data['unsupported'] >= self.platform_min_samples:
+                        skip.add(module)
+
+        return skip - self.NEVER_SKIPPED
+
+    def record(self, address, platform: Optional[str], module: str, supported: bool) -> None:
+        """
+        Store whether a device supports a module. Only call it on a clear answer,
+        not on empty results or errors. Modules in NEVER_SKIPPED are not stored.
+
+        :param address: Management address of the device
+        :type address: ipaddress.ip_address
+        :param platform: Platform identifier, defaults to None
+        :type platform: str, optional
+        :param module: Scan module name
+        :type module: str
+        :param supported: False if the device said it does not know the command
+        :type supported: bool
+        """
+        if module in self.NEVER_SKIPPED:
+            return
+
+        now = time.time()
+        with self._lock:
+            data = self.devices.setdefault(str(address), {}).get(module)
+            in_a_row = 0 if supported or data is None else data['unsupported']
+            self.devices[str(address)][module] = {
+                'unsupported': 0 if supported else in_a_row + 1, 'timestamp': now}
+
+            if platform is None:
+                return
+
+            data = self.platforms.setdefault(platform, {}).get(module)
+            if data is None or now - data['timestamp'] >= self.reprobe_interval:
+                data = {'unsupported': 0, 'supported': 0}
+                self.platforms[platform][module] = data
+
+            data['supported' if supported else 'unsupported'] += 1
+            data['timestamp'] = now
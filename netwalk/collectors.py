@@ -0,0 +1,884 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import abc
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import paramiko
+from lxml import etree
+from netaddr import EUI, mac_cisco
+
+from netwalk.interface import Interface
+from netwalk.libs import interface_name_expander
+
+try:
+    from pyasn1.type import univ
+    from pysnmp.hlapi.v3arch.asyncio import (CommunityData, ContextData,
+                                             ObjectIdentity, ObjectType,
+                                             SnmpEngine, UdpTransportTarget,
+                                             UsmUserData, bulk_walk_cmd,
+                                             usmAesCfb128Protocol,
+                                             usmHMACSHAAuthProtocol,
+                                             usmNoPrivProtocol)
+    from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchInstance, NoSuchObject
+except ImportError:
+    # SNMP collector is optional, pip install netwalk[snmp]
+    bulk_walk_cmd = None
+
+
+class CollectorUnavailable(Exception):
+    "The device cannot answer a structured collector"
+
+
+class StructuredCollector(abc.ABC):
+    """
+    Fill the data of some scan modules from structured output (JSON, XML)
+    instead of parsing screen-scraped text with TextFSM.
+
+    Subclasses list the NAPALM drivers and modules they handle and implement
+    collect(). Any exception they raise makes the Switch fall back to its
+    text parser for the rest of the scan, where the platform has one.
+    """
+
+    logger: logging.Logger
+    #: Name used in scan_options['collectors'] and scan_results
+    name: str = None
+    #: NAPALM drivers the collector works with
+    platforms: Tuple[str, ...] = ()
+    #: Scan modules the collector can fill
+    modules: Tuple[str, ...] = ()
+    #: False once the device failed to answer, the text parsers are used instead
+    available: bool
+
+    def __init__(self,
+                 credentials: Optional[Tuple[str, str]] = None,
+                 modules: Optional[Iterable[str]] = None):
+        """
+        :param credentials: (username, password) for collectors opening their own session, defaults to None
+        :type credentials: tuple(str, str), optional
+        :param modules: Use the collector for these of its modules only, defaults to all of them
+        :type modules: list(str), optional
+        """
+        self.logger = logging.getLogger(__name__)
+        self.credentials = credentials
+        self.available = True
+        if modules is not None:
+            self.modules = tuple(x for x in self.modules if x in modules)
+
+    def commands(self, module: str) -> List[str]:
+        """Show commands sent for a module over the CLI session, so they can be pipelined
+
+        :param module: Scan module
+        :type module: str
+        :return: List of commands, empty if the collector uses another transport
+        :rtype: list(str)
+        """
+        return []
+
+    @abc.abstractmethod
+    def collect(self, switch, module: str) -> int:
+        """Fill the data of a module on switch
+
+        :param switch: Switch being scanned, with an open session
+        :type switch: netwalk.Switch
+        :param module: One of self.modules
+        :type module: str
+        :return: Number of entries collected
+        :rtype: int
+        """
+
+    def close(self) -> None:
+        """Close whatever session the collector opened"""
+
+
+def _ip_or_none(address) -> Optional[ipaddress.ip_address]:
+    try:
+        return ipaddress.ip_address(address)
+    except ValueError:
+        return None
+
+
+class NxosJsonCollector(StructuredCollector):
+    """
+    Read interfaces and neighbors from NX-OS "| json" outputs.
+    The commands go through the same CLI session as everything else.
+    """
+
+    name = 'nxos_json'
+    platforms = ('nxos', 'nxos_ssh')
+    modules = ('interface_status', 'cdp_neighbors', 'lldp_neighbors')
+
+    COMMANDS = {'interface_status': "show interface | json",
+                'cdp_neighbors': "show cdp neighbors detail | json",
+                'lldp_neighbors': "show lldp neighbors detail | json"}
+
+    def commands(self, module: str) -> List[str]:
+        return [self.COMMANDS[module]]
+
+    @staticmethod
+    def rows(data: dict, table: str, row: str) -> List[dict]:
+        """Return the rows of an NX-OS JSON table, a single row comes as a dict
+
+        :param data: Decoded JSON output
+        :type data: dict
+        :param table: Table name, e.g. "TABLE_interface"
+        :type table: str
+        :param row: Row name, e.g. "ROW_interface"
+        :type row: str
+        :rtype: list(dict)
+        """
+        rows = data.get(table, {}).get(row, [])
+        return [rows] if isinstance(rows, dict) else rows
+
+    def _get_json(self, switch, module: str) -> dict:
+        output = switch._send_command(self.COMMANDS[module])
+        if not output.strip():
+            # No neighbors at all
+            return {}
+
+        try:
+            return json.loads(output)
+        except ValueError as e:
+            raise CollectorUnavailable(
+                f"{self.COMMANDS[module]} did not return JSON: {output[:80]!r}") from e
+
+    def collect(self, switch, module: str) -> int:
+        data = self._get_json(switch, module)
+        if module == 'interface_status':
+            return self.parse_interfaces(switch, data)
+        if module == 'cdp_neighbors':
+            return self.parse_cdp(switch, data)
+        return self.parse_lldp(switch, data)
+
+    def parse_interfaces(self, switch, data: dict) -> int:
+        """Set show interface fields on the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :param data: Decoded output of show interface | json
+        :type data: dict
+        :return: Number of interfaces
+        :rtype: int
+        """
+        rows = self.rows(data, 'TABLE_interface', 'ROW_interface')
+        for row in rows:
+            name = row['interface']
+            if name not in switch.interfaces:
+                # Sometimes multi-type interfaces appear in one command and not in another
+                switch.add_interface(Interface(name=name))
+                self.logger.info(
+                    "Creating new interface %s not found previously", name)
+
+            # SVIs use svi_ instead of eth_
+            def get(key, default=None):
+                return row.get('eth_' + key, row.get('svi_' + key, default))
+
+            state = row.get('state', row.get('svi_line_proto', ''))
+            admin_state = row.get('admin_state', row.get('svi_admin_state', ''))
+            fields = {'is_enabled': admin_state == 'up',
+                      'is_up': state == 'up',
+                      'protocol_status': state,
+                      'description': row.get('desc', row.get('svi_desc')),
+                      'hardware_type': row.get('eth_hw_desc'),
+                      'mac_address': get('hw_addr', row.get('svi_mac')),
+                      'bia': get('bia_addr'),
+                      'mtu': get('mtu'),
+                      'duplex': get('duplex'),
+                      'speed': get('speed'),
+                      'media_type': get('media'),
+                      'bandwidth': None if get('bw') is None else f"{get('bw')} Kbit",
+                      'delay': None if get('dly') is None else f"{get('dly')} usec",
+                      'input_packets': get('inpkts'),
+                      'output_packets': get('outpkts'),
+                      'input_errors': get('inerr'),
+                      'crc': get('crc'),
+                      'output_errors': get('outerr')}
+
+            interface = switch.interfaces[name]
+            for key, value in fields.items():
+                if value is not None:
+                    setattr(interface, key, value if isinstance(value, bool) else str(value))
+
+        return len(rows)
+
+    @staticmethod
+    def parse_cdp(switch, data: dict) -> int:
+        """Add CDP neighbors to the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :param data: Decoded output of show cdp neighbors detail | json
+        :type data: dict
+        :return: Number of neighbors
+        :rtype: int
+        """
+        rows = NxosJsonCollector.rows(data, 'TABLE_cdp_neighbor_detail_info',
+                                      'ROW_cdp_neighbor_detail_info')
+        for row in rows:
+            # NX-OS appends the serial number to its own device ID
+            hostname = re.sub(r"\(\w+\)$", "", row['device_id'])
+            address = row.get('v4mgmtaddr', row.get('v4addr', ''))
+            capabilities = row.get('capability', [])
+            switch._add_neighbor(row['intf_id'],
+                                 {'hostname': hostname,
+                                  'ip': _ip_or_none(address),
+                                  'platform': row.get('platform_id', ''),
+                                  'remote_int': row['port_id'],
+                                  # A single capability comes as a string
+                                  'capabilities': capabilities if isinstance(capabilities, str)
+                                  else " ".join(capabilities)})
+
+        return len(rows)
+
+    @staticmethod
+    def parse_lldp(switch, data: dict) -> int:
+        """Add LLDP neighbors to the interfaces of switch.
+        Like the text parser, neighbors without name or address are left out.
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :param data: Decoded output of show lldp neighbors detail | json
+        :type data: dict
+        :return: Number of neighbors
+        :rtype: int
+        """
+        rows = NxosJsonCollector.rows(data, 'TABLE_nbor_detail', 'ROW_nbor_detail')
+        for row in rows:
+            address = _ip_or_none(row.get('mgmt_addr', ''))
+            if address is None or not row.get('sys_name') or not row.get('l_port_id'):
+                continue
+
+            switch._add_neighbor(row['l_port_id'],
+                                 {'hostname': row['sys_name'],
+                                  'ip': address,
+                                  'platform': row.get('sys_desc', ''),
+                                  'remote_int': row['port_id'],
+                                  'capabilities': row.get('enabled_capability', '')})
+
+        return len(rows)
+
+
+class IosXeNetconfCollector(StructuredCollector):
+    """
+    Read interfaces and CDP neighbors from the IOS-XE operational YANG models
+    over NETCONF. Needs "netconf-yang" on the device; it opens its own session
+    on port 830, through Switch.bastion if there is one.
+    LLDP is left to the text parser.
+
+    The device host key has to be in ~/.ssh/known_hosts or in the known_hosts
+    file passed through scan_options['collector_options']['iosxe_netconf'].
+    Unknown keys fail the session, and the text parser is used instead.
+    """
+
+    name = 'iosxe_netconf'
+    platforms = ('ios',)
+    modules = ('interface_status', 'cdp_neighbors')
+
+    FILTERS = {'interface_status': '<interfaces xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-interfaces-oper"/>',
+               'cdp_neighbors': '<cdp-neighbor-details xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-cdp-oper"/>'}
+
+    #: NETCONF port
+    port: int = 830
+    #: Seconds to wait for the session and for each reply
+    timeout: float = 30
+
+    def __init__(self,
+                 credentials: Optional[Tuple[str, str]] = None,
+                 modules: Optional[Iterable[str]] = None,
+                 known_hosts: Optional[str] = None,
+                 verify_host_key: bool = True):
+        """
+        :param credentials: (username, password) for the NETCONF session, defaults to None
+        :type credentials: tuple(str, str), optional
+        :param modules: Use the collector for these of its modules only, defaults to all of them
+        :type modules: list(str), optional
+        :param known_hosts: OpenSSH known_hosts file with device keys, on top of ~/.ssh/known_hosts, defaults to None
+        :type known_hosts: str, optional
+        :param verify_host_key: Set to False to accept any host key, defaults to True
+        :type verify_host_key: bool, optional
+        """
+        super().__init__(credentials, modules)
+        self.known_hosts = known_hosts
+        self.verify_host_key = verify_host_key
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _known_host_cb(self):
+        """ncclient callback for keys not in ~/.ssh/known_hosts, checking self.known_hosts instead"""
+        if self.known_hosts is None:
+            return lambda host, fingerprint: False
+
+        host_keys = paramiko.HostKeys(os.path.expanduser(self.known_hosts))
+
+        def check(host, fingerprint):
+            # ncclient only passes the colon separated MD5 fingerprint
+            for lookup in (host, f"[{host}]:{self.port}"):
+                for key in (host_keys.lookup(lookup) or {}).values():
+                    if ":".join(f"{x:02x}" for x in key.get_fingerprint()) == fingerprint:
+                        return True
+            return False
+
+        return check
+
+    def _connect(self, switch):
+        """Return the NETCONF session to switch, opening it if needed"""
+        with self._lock:
+            if self._manager is not None and self._manager.connected:
+                return self._manager
+
+            if self.credentials is None:
+                raise CollectorUnavailable("No credentials for NETCONF")
+
+            from ncclient import manager
+
+            sock = None
+            if switch.bastion is not None:
+                sock = switch.bastion.open_channel(str(switch.mgmt_address), self.port)
+
+            if not self.verify_host_key:
+                self.logger.warning("Not verifying the NETCONF host key of %s", switch.mgmt_address)
+
+            self.logger.info("Opening NETCONF session to %s", switch.mgmt_address)
+            try:
+                self._manager = manager.connect(host=str(switch.mgmt_address),
+                                                port=self.port,
+                                                username=self.credentials[0],
+                                                password=self.credentials[1],
+                                                sock=sock,
+                                                timeout=self.timeout,
+                                                hostkey_verify=self.verify_host_key,
+                                                unknown_host_cb=self._known_host_cb(),
+                                                allow_agent=False,
+                                                look_for_keys=False,
+                                                device_params={'name': 'iosxe'})
+            except Exception as e:
+                raise CollectorUnavailable(f"NETCONF session failed: {e}") from e
+
+            return self._manager
+
+    def _get(self, switch, module: str) -> etree._Element:
+        reply = self._connect(switch).get(filter=('subtree', self.FILTERS[module]))
+        return reply.data_ele
+
+    def collect(self, switch, module: str) -> int:
+        data = self._get(switch, module)
+        if module == 'interface_status':
+            return self.parse_interfaces(switch, data)
+        return self.parse_cdp(switch, data)
+
+    @staticmethod
+    def _text(element: etree._Element, name: str) -> Optional[str]:
+        """Text of the first child called name, whatever its namespace"""
+        found = element.xpath(f"*[local-name()='{name}']")
+        return found[0].text if found else None
+
+    @staticmethod
+    def parse_interfaces(switch, data: etree._Element) -> int:
+        """Set show interface fields on the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :param data: <data> element of a Cisco-IOS-XE-interfaces-oper reply
+        :type data: lxml.etree._Element
+        :return: Number of interfaces
+        :rtype: int
+        """
+        text = IosXeNetconfCollector._text
+        entries = data.xpath("//*[local-name()='interfaces']/*[local-name()='interface']")
+        for entry in entries:
+            name = text(entry, 'name')
+            if name not in switch.interfaces:
+                switch.add_interface(Interface(name=name))
+
+            oper_status = text(entry, 'oper-status') or ''
+            mac = text(entry, 'phys-address')
+            speed = text(entry, 'speed')
+            statistics = entry.xpath("*[local-name()='statistics']")
+            stats: Dict[str, Optional[str]] = {}
+            if statistics:
+                for key in ('in-errors', 'in-crc-errors', 'out-errors',
+                            'in-unicast-pkts', 'out-unicast-pkts'):
+                    stats[key] = text(statistics[0], key)
+
+            fields = {'is_enabled': text(entry, 'admin-status') == 'if-state-up',
+                      'is_up': oper_status == 'if-oper-state-ready',
+                      'protocol_status': oper_status,
+                      'description': text(entry, 'description'),
+                      'mac_address': None if not mac else str(EUI(mac, dialect=mac_cisco)),
+                      'mtu': text(entry, 'mtu'),
+                      'bandwidth': None if speed is None else f"{int(speed) // 1000} Kbit",
+                      'input_packets': stats.get('in-unicast-pkts'),
+                      'output_packets': stats.get('out-unicast-pkts'),
+                      'input_errors': stats.get('in-errors'),
+                      'crc': stats.get('in-crc-errors'),
+                      'output_errors': stats.get('out-errors')}
+
+            interface = switch.interfaces[name]
+            for key, value in fields.items():
+                if value is not None:
+                    setattr(interface, key, value)
+
+        return len(entries)
+
+    @staticmethod
+    def parse_cdp(switch, data: etree._Element) -> int:
+        """Add CDP neighbors to the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :param data: <data> element of a Cisco-IOS-XE-cdp-oper reply
+        :type data: lxml.etree._Element
+        :return: Number of neighbors
+        :rtype: int
+        """
+        text = IosXeNetconfCollector._text
+        entries = data.xpath("//*[local-name()='cdp-neighbor-detail']")
+        for entry in entries:
+            address = text(entry, 'mgmt-address') or text(entry, 'ip-address') or ''
+            switch._add_neighbor(text(entry, 'local-intf-name'),
+                                 {'hostname': text(entry, 'device-name'),
+                                  'ip': _ip_or_none(address),
+                                  'platform': text(entry, 'platform-name') or '',
+                                  'remote_int': text(entry, 'port-id'),
+                                  'capabilities': text(entry, 'capability') or ''})
+
+        return len(entries)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._manager is not None:
+                try:
+                    self._manager.close_session()
+                except Exception:
+                    pass
+                self._manager = None
+
+
+def _snmp_value(value):
+    """Plain Python value of an SNMP variable: int for numbers, bytes for strings"""
+    if isinstance(value, univ.Integer):
+        return int(value)
+    if isinstance(value, univ.OctetString):
+        return value.asOctets()
+    return value.prettyPrint()
+
+
+def _snmp_text(value: Optional[bytes]) -> str:
+    return "" if value is None else value.decode(errors='replace').strip("\x00").strip()
+
+
+class SnmpCollector(StructuredCollector):
+    """
+    Read the MAC table, interfaces and neighbors with GETBULK walks of
+    Q-BRIDGE-MIB/BRIDGE-MIB, IF-MIB, CISCO-CDP-MIB and LLDP-MIB.
+    The tables a module needs are walked concurrently over UDP,
+    no CLI session is used. Needs pysnmp (pip install netwalk[snmp]).
+
+    Without Q-BRIDGE-MIB, BRIDGE-MIB is walked once per VLAN in the
+    Cisco way: community@vlan with SNMPv2c, context vlan-<id> with SNMPv3.
+    SNMP cannot go through a bastion.
+    """
+
+    name = 'snmp'
+    platforms = ('ios', 'nxos', 'nxos_ssh', 'eos', 'iosxr', 'junos')
+    modules = ('mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors')
+
+    IF_NAME = '1.3.6.1.2.1.31.1.1.1.1'
+    INTERFACE_OIDS = {'name': IF_NAME,
+                      'alias': '1.3.6.1.2.1.31.1.1.1.18',
+                      'admin_status': '1.3.6.1.2.1.2.2.1.7',
+                      'oper_status': '1.3.6.1.2.1.2.2.1.8',
+                      'mtu': '1.3.6.1.2.1.2.2.1.4',
+                      'high_speed': '1.3.6.1.2.1.31.1.1.1.15',
+                      'phys_address': '1.3.6.1.2.1.2.2.1.6',
+                      'in_errors': '1.3.6.1.2.1.2.2.1.14',
+                      'out_errors': '1.3.6.1.2.1.2.2.1.20',
+                      'in_packets': '1.3.6.1.2.1.31.1.1.1.7',
+                      'out_packets': '1.3.6.1.2.1.31.1.1.1.11',
+                      'fcs_errors': '1.3.6.1.2.1.10.7.2.1.3'}
+    Q_FDB_PORT = '1.3.6.1.2.1.17.7.1.2.2.1.2'
+    FDB_PORT = '1.3.6.1.2.1.17.4.3.1.2'
+    BASE_PORT_IFINDEX = '1.3.6.1.2.1.17.1.4.1.2'
+    CDP_OIDS = {'address_type': '1.3.6.1.4.1.9.9.23.1.2.1.1.3',
+                'address': '1.3.6.1.4.1.9.9.23.1.2.1.1.4',
+                'device_id': '1.3.6.1.4.1.9.9.23.1.2.1.1.6',
+                'device_port': '1.3.6.1.4.1.9.9.23.1.2.1.1.7',
+                'platform': '1.3.6.1.4.1.9.9.23.1.2.1.1.8',
+                'capabilities': '1.3.6.1.4.1.9.9.23.1.2.1.1.9'}
+    LLDP_OIDS = {'local_port_id': '1.0.8802.1.1.2.1.3.7.1.3',
+                 'local_port_desc': '1.0.8802.1.1.2.1.3.7.1.4',
+                 'port_id_subtype': '1.0.8802.1.1.2.1.4.1.1.6',
+                 'port_id': '1.0.8802.1.1.2.1.4.1.1.7',
+                 'port_desc': '1.0.8802.1.1.2.1.4.1.1.8',
+                 'sys_name': '1.0.8802.1.1.2.1.4.1.1.9',
+                 'sys_desc': '1.0.8802.1.1.2.1.4.1.1.10',
+                 'capabilities': '1.0.8802.1.1.2.1.4.1.1.12',
+                 'man_addr': '1.0.8802.1.1.2.1.4.2.1.3'}
+    #: cdpCacheCapabilities bits, named as in show cdp neighbors detail
+    CDP_CAPABILITIES = ((0x01, 'Router'), (0x02, 'Trans-Bridge'), (0x04, 'Source-Route-Bridge'),
+                        (0x08, 'Switch'), (0x10, 'Host'), (0x20, 'IGMP'), (0x40, 'Repeater'),
+                        (0x80, 'Phone'))
+    #: lldpRemSysCapEnabled bits in order, named by their show lldp neighbors codes
+    LLDP_CAPABILITIES = ('O', 'P', 'B', 'W', 'R', 'T', 'C', 'S')
+    OPER_STATUS = {1: 'up', 2: 'down', 3: 'testing', 4: 'unknown',
+                   5: 'dormant', 6: 'notPresent', 7: 'lowerLayerDown'}
+
+    def __init__(self,
+                 credentials: Optional[Tuple[str, str]] = None,
+                 modules: Optional[Iterable[str]] = None,
+                 community: str = 'public',
+                 port: int = 161,
+                 timeout: float = 2,
+                 retries: int = 1,
+                 max_repetitions: int = 25,
+                 username: Optional[str] = None,
+                 auth_key: Optional[str] = None,
+                 priv_key: Optional[str] = None):
+        """
+        Options are passed through scan_options['collector_options']['snmp'].
+
+        :param community: SNMPv2c community, defaults to 'public'
+        :type community: str, optional
+        :param port: SNMP port, defaults to 161
+        :type port: int, optional
+        :param timeout: Seconds to wait for each reply, defaults to 2
+        :type timeout: float, optional
+        :param retries: Times a request is sent again, defaults to 1
+        :type retries: int, optional
+        :param max_repetitions: Rows asked for in each GETBULK, defaults to 25
+        :type max_repetitions: int, optional
+        :param username: SNMPv3 user, used instead of community if set, defaults to None
+        :type username: str, optional
+        :param auth_key: SNMPv3 SHA authentication key, defaults to None
+        :type auth_key: str, optional
+        :param priv_key: SNMPv3 AES privacy key, defaults to None
+        :type priv_key: str, optional
+        """
+        super().__init__(credentials, modules)
+        self.community = community
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+        self.username = username
+        self._auth_key = auth_key
+        self._priv_key = priv_key
+        # {ifIndex: ifName} of the current scan, several modules need it
+        self._if_names: Optional[Dict[int, str]] = None
+        self._lock = threading.Lock()
+
+    def _auth(self, vlan: Optional[int] = None) -> tuple:
+        """Return (auth data, context) for the whole device or the bridge of a VLAN"""
+        if self.username is not None:
+            auth = UsmUserData(self.username, self._auth_key, self._priv_key,
+                               authProtocol=usmHMACSHAAuthProtocol,
+                               privProtocol=usmNoPrivProtocol if self._priv_key is None
+                               else usmAesCfb128Protocol)
+            return auth, ContextData() if vlan is None else ContextData(contextName=f"vlan-{vlan}")
+
+        community = self.community if vlan is None else f"{self.community}@{vlan}"
+        return CommunityData(community, mpModel=1), ContextData()
+
+    def walk(self, switch, tables: Dict[object, Tuple[str, Optional[int]]]) -> Dict[object, Dict[tuple, object]]:
+        """Walk several tables at the same time
+
+        :param switch: Switch to walk
+        :type switch: netwalk.Switch
+        :param tables: Dictionary of {key: (OID, VLAN or None)}
+        :type tables: dict
+        :return: Dictionary of {key: {index tuple: value}}, bytes for strings and int for numbers
+        :rtype: dict
+        """
+        if bulk_walk_cmd is None:
+            raise CollectorUnavailable("pysnmp is not installed")
+        if switch.bastion is not None:
+            raise CollectorUnavailable("SNMP cannot go through the bastion")
+
+        async def walk_table(engine, target, oid, vlan):
+            prefix = tuple(int(x) for x in oid.split('.'))
+            auth, context = self._auth(vlan)
+            table = {}
+            async for error_indication, error_status, _, var_binds in bulk_walk_cmd(
+                    engine, auth, target, context, 0, self.max_repetitions,
+                    ObjectType(ObjectIdentity(oid)),
+                    lexicographicMode=False, lookupMib=False):
+                if error_indication or error_status:
+                    raise CollectorUnavailable(
+                        f"Walk of {oid} failed: {error_indication or error_status.prettyPrint()}")
+
+                for name, value in var_binds:
+                    name = tuple(name)
+                    if name[:len(prefix)] != prefix or \
+                            isinstance(value, (NoSuchObject, NoSuchInstance, EndOfMibView)):
+                        continue
+                    table[name[len(prefix):]] = _snmp_value(value)
+
+            return table
+
+        async def walk_all():
+            engine = SnmpEngine()
+            try:
+                target = await UdpTransportTarget.create((str(switch.mgmt_address), self.port),
+                                                         timeout=self.timeout, retries=self.retries)
+                results = await asyncio.gather(*[walk_table(engine, target, oid, vlan)
+                                                 for oid, vlan in tables.values()])
+            finally:
+                engine.close_dispatcher()
+
+            return dict(zip(tables, results))
+
+        return asyncio.run(walk_all())
+
+    def _interface_names(self, switch) -> Dict[int, str]:
+        """{ifIndex: interface name}, walked once per scan"""
+        with self._lock:
+            if self._if_names is None:
+                names = self.walk(switch, {'name': (self.IF_NAME, None)})['name']
+                self._if_names = {index[0]: interface_name_expander(_snmp_text(value))
+                                  for index, value in names.items()}
+
+            return self._if_names
+
+    def collect(self, switch, module: str) -> int:
+        if module == 'mac_address':
+            return self.collect_mac_table(switch)
+        if module == 'interface_status':
+            return self.collect_interfaces(switch)
+        if module == 'cdp_neighbors':
+            return self.collect_cdp(switch)
+        return self.collect_lldp(switch)
+
+    def collect_interfaces(self, switch) -> int:
+        """Set show interface fields from IF-MIB on the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :return: Number of interfaces
+        :rtype: int
+        """
+        tables = self.walk(switch, {k: (v, None) for k, v in self.INTERFACE_OIDS.items()})
+        with self._lock:
+            self._if_names = {index[0]: interface_name_expander(_snmp_text(value))
+                              for index, value in tables['name'].items()}
+
+        count = 0
+        for if_index, name in self._if_names.items():
+            if name not in switch.interfaces:
+                # IF-MIB also lists Null0, stack ports and the like
+                if not re.match(switch.INTERFACE_TYPES, name):
+                    continue
+                switch.add_interface(Interface(name=name))
+
+            def get(key):
+                return tables[key].get((if_index,))
+
+            mac = get('phys_address')
+            speed = get('high_speed')
+            fields = {'is_enabled': get('admin_status') == 1,
+                      'is_up': get('oper_status') == 1,
+                      'protocol_status': self.OPER_STATUS.get(get('oper_status')),
+                      'description': None if get('alias') is None else _snmp_text(get('alias')),
+                      'mac_address': str(EUI(mac.hex(), dialect=mac_cisco)) if mac and len(mac) == 6 else None,
+                      'mtu': get('mtu'),
+                      'bandwidth': None if speed is None else f"{speed * 1000} Kbit",
+                      'input_packets': get('in_packets'),
+                      'output_packets': get('out_packets'),
+                      'input_errors': get('in_errors'),
+                      'crc': get('fcs_errors'),
+                      'output_errors': get('out_errors')}
+
+            interface = switch.interfaces[name]
+            for key, value in fields.items():
+                if value is not None:
+                    setattr(interface, key, value if isinstance(value, (bool, str)) else str(value))
+
+            count += 1
+
+        return count
+
+    def collect_mac_table(self, switch) -> int:
+        """Fill switch.mac_table from Q-BRIDGE-MIB, or from BRIDGE-MIB per VLAN
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :return: Number of MAC addresses
+        :rtype: int
+        """
+        if_names = self._interface_names(switch)
+        tables = self.walk(switch, {'fdb': (self.Q_FDB_PORT, None),
+                                    'ports': (self.BASE_PORT_IFINDEX, None)})
+
+        # Entries are (vlan, mac, bridge port, bridge port to ifIndex)
+        entries = []
+        for index, port in tables['fdb'].items():
+            entries.append((index[0], index[1:], port, tables['ports']))
+
+        if not entries:
+            vlans = sorted(switch.vlans) if switch.vlans else sorted(switch.get_active_vlans())
+            # 1002-1005 are the FDDI and Token Ring leftovers
+            vlans = [x for x in vlans if not 1002 <= x <= 1005]
+            walks = {}
+            for vlan in vlans:
+                walks[('fdb', vlan)] = (self.FDB_PORT, vlan)
+                walks[('ports', vlan)] = (self.BASE_PORT_IFINDEX, vlan)
+
+            tables = self.walk(switch, walks)
+            for vlan in vlans:
+                for index, port in tables[('fdb', vlan)].items():
+                    entries.append((vlan, index, port, tables[('ports', vlan)]))
+
+        switch.mac_table = {}
+        # some interfaces have diFFeRenT capitalization across outputs.
+        interfaces = {k.lower(): v for k, v in list(switch.interfaces.items())}
+        for intdata in interfaces.values():
+            intdata.mac_count = 0
+        for vlan, mac, port, ports in entries:
+            name = if_names.get(ports.get((port,)))
+            if name is None or name.lower() not in interfaces:
+                continue
+
+            switch.mac_table[EUI(":".join(f"{x:02x}" for x in mac))] = {
+                'interface': interfaces[name.lower()], 'vlan': vlan}
+
+        # Count macs per interface
+        for data in switch.mac_table.values():
+            data['interface'].mac_count += 1
+
+        return len(switch.mac_table)
+
+    @classmethod
+    def cdp_capabilities(cls, value: Optional[bytes]) -> str:
+        """Capabilities of a CDP neighbor as show cdp neighbors detail prints them, e.g. "Router Switch"
+
+        :param value: cdpCacheCapabilities, 4 bytes
+        :type value: bytes
+        :rtype: str
+        """
+        if not value:
+            return ""
+        bits = int.from_bytes(value, 'big')
+        return " ".join(name for bit, name in cls.CDP_CAPABILITIES if bits & bit)
+
+    @classmethod
+    def lldp_capabilities(cls, value: Optional[bytes]) -> str:
+        """Enabled capabilities of an LLDP neighbor as show lldp neighbors detail prints them, e.g. "B,R"
+
+        :param value: lldpRemSysCapEnabled, BITS starting from the most significant bit
+        :type value: bytes
+        :rtype: str
+        """
+        if not value:
+            return ""
+        return ",".join(code for i, code in enumerate(cls.LLDP_CAPABILITIES)
+                        if value[0] & (0x80 >> i))
+
+    def collect_cdp(self, switch) -> int:
+        """Add CDP neighbors from CISCO-CDP-MIB to the interfaces of switch
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :return: Number of neighbors
+        :rtype: int
+        """
+        if_names = self._interface_names(switch)
+        tables = self.walk(switch, {k: (v, None) for k, v in self.CDP_OIDS.items()})
+
+        for index, device_id in tables['device_id'].items():
+            address = tables['address'].get(index, b"")
+            ip = None
+            # Type 1 is IP
+            if tables['address_type'].get(index) == 1 and len(address) == 4:
+                ip = ipaddress.ip_address(address)
+
+            local_port = if_names.get(index[0])
+            if local_port is None:
+                continue
+
+            switch._add_neighbor(local_port,
+                                 {'hostname': _snmp_text(device_id),
+                                  'ip': ip,
+                                  'platform': _snmp_text(tables['platform'].get(index)),
+                                  'remote_int': _snmp_text(tables['device_port'].get(index)),
+                                  'capabilities': self.cdp_capabilities(tables['capabilities'].get(index))})
+
+        return len(tables['device_id'])
+
+    def collect_lldp(self, switch) -> int:
+        """Add LLDP neighbors from LLDP-MIB to the interfaces of switch.
+        Like the text parser, neighbors without name or IPv4 address are left out.
+
+        :param switch: Switch to fill
+        :type switch: netwalk.Switch
+        :return: Number of neighbors
+        :rtype: int
+        """
+        if_names = self._interface_names(switch)
+        tables = self.walk(switch, {k: (v, None) for k, v in self.LLDP_OIDS.items()})
+
+        # Index is time mark, local port, remote index, address subtype, length, address
+        addresses = {}
+        for index in tables['man_addr']:
+            if index[3] == 1 and index[4] == 4:
+                addresses.setdefault(index[1:3], ipaddress.ip_address(bytes(index[5:9])))
+
+        for index, sys_name in tables['sys_name'].items():
+            local_num = index[1]
+            address = addresses.get(index[1:3])
+            if address is None or not _snmp_text(sys_name):
+                continue
+
+            local_port = None
+            for key in ('local_port_id', 'local_port_desc'):
+                name = interface_name_expander(_snmp_text(tables[key].get((local_num,))))
+                if name in switch.interfaces:
+                    local_port = name
+                    break
+            else:
+                # Most devices number LLDP ports by ifIndex
+                local_port = if_names.get(local_num)
+
+            if local_port is None:
+                continue
+
+            # Subtype 5 is interface name, 7 locally assigned. Others, e.g. MAC, say nothing
+            if tables['port_id_subtype'].get(index) in (5, 7):
+                remote_int = _snmp_text(tables['port_id'].get(index))
+            else:
+                remote_int = _snmp_text(tables['port_desc'].get(index))
+
+            switch._add_neighbor(local_port,
+                                 {'hostname': _snmp_text(sys_name),
+                                  'ip': address,
+                                  'platform': _snmp_text(tables['sys_desc'].get(index)),
+                                  'remote_int': remote_int,
+                                  'capabilities': self.lldp_capabilities(tables['capabilities'].get(index))})
+
+        return len(tables['sys_name'])
+
+
+#: Collectors by name, see Switch.DEFAULT_COLLECTORS
+COLLECTORS = {NxosJsonCollector.name: NxosJsonCollector,
+              IosXeNetconfCollector.name: IosXeNetconfCollector,
+              SnmpCollector.name: SnmpCollector}
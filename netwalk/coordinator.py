@@ -0,0 +1,197 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import collections.abc
+import logging
+import threading
+import warnings
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+
+class DiscoveryCoordinator():
+    """
+    Own the discovery state of every device of a Fabric, keyed by management address.
+
+    States only change through transition(), which is atomic and refuses
+    moves not in TRANSITIONS, e.g. queueing a device already being connected to.
+    Readers get an immutable snapshot replaced on every change, so they never
+    take the lock nor see a half-made update.
+    """
+
+    logger: logging.Logger
+
+    QUEUED = "Queued"
+    CONNECTING = "Connecting"
+    COLLECTED = "Collected"
+    FAILED = "Failed"
+    TIMEOUT = "Timeout"
+    UNREACHABLE = "Unreachable"
+    SKIPPED = "Skipped"
+    DUPLICATE = "Duplicate"
+
+    #: {state: states it can move to}, None is a device never seen.
+    #: Finished states can be queued again, e.g. by Fabric.refresh()
+    TRANSITIONS = {
+        None: {QUEUED, CONNECTING, SKIPPED, UNREACHABLE, TIMEOUT},
+        QUEUED: {CONNECTING, UNREACHABLE, TIMEOUT, FAILED, DUPLICATE, SKIPPED},
+        CONNECTING: {COLLECTED, FAILED, TIMEOUT, DUPLICATE},
+        COLLECTED: {QUEUED, CONNECTING, DUPLICATE},
+        FAILED: {QUEUED, CONNECTING, DUPLICATE},
+        TIMEOUT: {QUEUED, CONNECTING, DUPLICATE},
+        UNREACHABLE: {QUEUED, CONNECTING},
+        SKIPPED: {QUEUED, CONNECTING},
+        DUPLICATE: {QUEUED},
+    }
+
+    def __init__(self, states: Optional[Dict[Any, str]] = None):
+        """
+        :param states: Initial {management address: state}, defaults to None
+        :type states: dict, optional
+        """
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._snapshot: Mapping[Any, str] = MappingProxyType(dict(states or {}))
+
+    def __getstate__(self):
+        return {'states': dict(self._snapshot)}
+
+    def __setstate__(self, state):
+        self.__init__(state['states'])
+
+    def snapshot(self) -> Mapping[Any, str]:
+        """
+        Current state of every device, a read-only mapping that never changes
+
+        :return: Mapping of {management address: state}
+        :rtype: types.MappingProxyType
+        """
+        return self._snapshot
+
+    def transition(self, key, state: str, expected: Optional[Iterable[Optional[str]]] = None) -> bool:
+        """
+        Move a device to a new state, if TRANSITIONS allow it from the current one.
+        Moving to the state the device is already in is allowed and changes nothing.
+
+        :param key: Management address of the device
+        :type key: ipaddress.ip_address
+        :param state: New state
+        :type state: str
+        :param expected: Only move if the current state is one of these, None meaning unknown, defaults to any
+        :type expected: list(str), optional
+        :return: True if the device is now in that state
+        :rtype: bool
+        """
+        assert state in self.TRANSITIONS, f"Unknown state, has to be any of {list(self.TRANSITIONS)}"
+
+        with self._lock:
+            current = self._snapshot.get(key)
+            if expected is not None and current not in expected:
+                return False
+
+            if current == state:
+                return True
+
+            if state not in self.TRANSITIONS[current]:
+                self.logger.debug("Not moving %s from %s to %s", key, current, state)
+                return False
+
+            states = dict(self._snapshot)
+            states[key] = state
+            self._snapshot = MappingProxyType(states)
+
+        return True
+
+    def load(self, states: Mapping[Any, str], clear: bool = True) -> None:
+        """
+        Set the state of devices without checking TRANSITIONS, e.g. to restore them
+
+        :param states: Dictionary of {management address: state}
+        :type states: dict
+        :param clear: Forget devices not in states, defaults to True
+        :type clear: bool, optional
+        """
+        for state in states.values():
+            assert state in self.TRANSITIONS, f"Unknown state, has to be any of {list(self.TRANSITIONS)}"
+
+        with self._lock:
+            new_states = {} if clear else dict(self._snapshot)
+            new_states.update(states)
+            self._snapshot = MappingProxyType(new_states)
+
+    def forget(self, key) -> None:
+        """
+        Drop a device, it can then move to any state allowed from None
+
+        :param key: Management address of the device
+        :type key: ipaddress.ip_address
+        """
+        with self._lock:
+            states = dict(self._snapshot)
+            del states[key]
+            self._snapshot = MappingProxyType(states)
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Number of devices in each state
+
+        :return: Dictionary of {state: count}
+        :rtype: dict
+        """
+        return dict(collections.Counter(self._snapshot.values()))
+
+
+class StatusSnapshot(collections.abc.MutableMapping):
+    """
+    Snapshot of a DiscoveryCoordinator returned by Fabric.discovery_status.
+
+    discovery_status used to be a plain dictionary, so writing to it still works:
+    changes go straight to the coordinator with a DeprecationWarning.
+    """
+
+    def __init__(self, coordinator: DiscoveryCoordinator):
+        self._coordinator = coordinator
+        self._snapshot = coordinator.snapshot()
+
+    def __getitem__(self, key) -> str:
+        return self._snapshot[key]
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __repr__(self) -> str:
+        return repr(dict(self._snapshot))
+
+    @staticmethod
+    def _warn() -> None:
+        warnings.warn("Changing Fabric.discovery_status is deprecated, use Fabric.coordinator.transition()",
+                      DeprecationWarning, stacklevel=3)
+
+    def __setitem__(self, key, state: str) -> None:
+        self._warn()
+        self._coordinator.load({key: state}, clear=False)
+        self._snapshot = self._coordinator.snapshot()
+
+    def __delitem__(self, key) -> None:
+        self._warn()
+        self._coordinator.forget(key)
+        self._snapshot = self._coordinator.snapshot()
@@ -16,19 +16,42 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import contextlib
+import copy
 import datetime
+import functools
 import ipaddress
 import logging
 import os
-from typing import Dict, List, Optional, Union
+import queue
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import napalm
+import paramiko
+import scp
 import textfsm
 from ciscoconfparse import CiscoConfParse
 from netaddr import EUI
 
+from netwalk.bastion import BastionPool
+from netwalk.cache import CapabilityCache
+from netwalk.collectors import COLLECTORS, StructuredCollector
 from netwalk.interface import Interface
 from netwalk.libs import interface_name_expander
+from netwalk.session import CommandMemo
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a Switch runs out of its time budget and its session is aborted"""
+
+
+class ModuleNotSupported(Exception):
+    """Raised by a scan module when the device does not know its command or the output cannot be parsed"""
 
 
 class Device():
@@ -40,6 +63,12 @@ class Device():
     fabric: 'Fabric'
     mgmt_address: Union[ipaddress.ip_address, str]
     facts: dict
+    #: NAPALM driver name, None if unknown
+    platform: Optional[str]
+    #: Where platform comes from: 'user', 'neighbor', 'cache', 'banner' or 'default'
+    platform_source: Optional[str]
+    #: Other management addresses and hostnames the same device was found as during discovery
+    aliases: Set[Union[ipaddress.IPv4Address, ipaddress.IPv6Address, str]]
 
     def __init__(self, mgmt_address, **kwargs) -> None:
         if isinstance(mgmt_address, str):
@@ -55,6 +84,12 @@ class Device():
         self.discovery_status = kwargs.get('discovery_status', None)
         self.fabric: 'Fabric' = kwargs.get('fabric', None)
         self.facts: dict = kwargs.get('facts', None)
+        self.platform: Optional[str] = kwargs.get('platform', None)
+        self.platform_source: Optional[str] = kwargs.get(
+            'platform_source', None if self.platform is None else 'user')
+        self.aliases = kwargs.get('aliases', set())
+        # Interfaces are added by the discovery thread while Fabric reads neighbors from another one
+        self._interfaces_lock = threading.RLock()
         if self.hostname is None:
             self.logger = logging.getLogger(__name__ + str(self.mgmt_address))
         else:
@@ -66,6 +101,15 @@ class Device():
             else:
                 self.fabric.devices[self.hostname] = self
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_interfaces_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._interfaces_lock = threading.RLock()
+
     def add_interface(self, intobject: Interface):
         """Add interface to device
 
@@ -73,20 +117,37 @@ class Device():
         :type intobject: netwalk.Interface
         """
         intobject.device = self
-        self.interfaces[intobject.name] = intobject
+        with self._interfaces_lock:
+            self.interfaces[intobject.name] = intobject
 
         if type(self) == Switch:
-            for _, v in self.interfaces.items():
+            for v in self.interface_list():
                 v.parse_config(second_pass=True)
 
+    def interface_list(self) -> List['Interface']:
+        """
+        Copy of the interfaces of the device, safe to walk while another thread adds to them
+
+        :return: List of Interfaces
+        :rtype: list(netwalk.Interface)
+        """
+        with self._interfaces_lock:
+            return list(self.interfaces.values())
+
     def promote_to_switch(self):
+        lock = self._interfaces_lock
         self.__class__ = Switch
         self.__init__(mgmt_address=self.mgmt_address,
                       hostname=self.hostname,
                       interfaces=self.interfaces,
                       discovery_status=self.discovery_status,
                       fabric=self.fabric,
-                      facts=self.facts)
+                      facts=self.facts,
+                      platform=self.platform,
+                      platform_source=self.platform_source,
+                      aliases=self.aliases)
+        # Another thread may be holding the old one
+        self._interfaces_lock = lock
 
 
 class Switch(Device):
@@ -100,6 +161,46 @@ class Switch(Device):
     INTERFACE_TYPES = r"([Pp]ort-channel|\w*Ethernet|\w*GigE|Vlan|Loopback)."
     INTERFACE_FILTER = r"^interface " + INTERFACE_TYPES
 
+    #: Modules _get_switch_data knows how to scan
+    SCAN_MODULES = ['mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors',
+                    'vtp', 'vlans', 'l3_int', 'local_admins', 'inventory']
+    NEIGHBOR_MODULES = ['cdp_neighbors', 'lldp_neighbors']
+    #: Modules still collected when an incremental scan finds the config unchanged
+    VOLATILE_MODULES = ['mac_address', 'interface_status']
+    #: Named sets of modules to scan. Each profile filters "show interfaces" on the device
+    #: and parses it with a TextFSM template that only has the Interface fields it populates
+    COLLECTION_PROFILES = {
+        'full': {'modules': SCAN_MODULES,
+                 'interface_filter': None,
+                 'interface_template': 'show_interface.textfsm'},
+        'port-usage': {'modules': ['mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors'],
+                       'interface_filter': 'line protocol|Last input|input errors|output errors',
+                       'interface_template': 'show_interface_port_usage.textfsm'},
+        'topology': {'modules': ['interface_status', 'cdp_neighbors', 'lldp_neighbors'],
+                     'interface_filter': 'line protocol',
+                     'interface_template': 'show_interface_status.textfsm'},
+    }
+    #: Modules that work on each NAPALM driver. netwalk's own parsers only know IOS output,
+    #: other drivers get the modules backed by NAPALM getters
+    PLATFORM_MODULES = {'ios': SCAN_MODULES}
+    NAPALM_MODULES = ['mac_address', 'vlans', 'l3_int', 'local_admins']
+    #: Structured collectors tried before the text parsers, see netwalk.collectors.COLLECTORS.
+    #: iosxe_netconf opens a NETCONF session and is only used if asked for in scan_options
+    DEFAULT_COLLECTORS = ['nxos_json']
+    #: Seconds to wait for the output of a single command, big ones could take ages
+    COMMAND_READ_TIMEOUT = 300
+    #: File the running config can be copied from over SCP or SFTP, per NAPALM driver
+    CONFIG_FILES = {'ios': 'system:running-config',
+                    'eos': 'system:/running-config'}
+    #: Short commands whose output changes with the running config, tried in order, per NAPALM driver
+    CONFIG_PROBES = {'ios': ["show configuration id",
+                             "show running-config | include ^! Last configuration change"]}
+    #: Seconds the boot time worked out from uptime may differ between scans of a device not reloaded
+    BOOT_TIME_TOLERANCE = 300
+    #: Lines NAPALM's get_config() leaves out, removed from copied configs too
+    CONFIG_HEADER = re.compile(r"^(Building configuration.*|Current configuration :.*|"
+                               r"! Last configuration change at.*|! NVRAM config last updated at.*)$", re.M)
+
     logger: logging.Logger
     hostname: str
     #: Dict of {name: Interface}
@@ -117,6 +218,39 @@ class Switch(Device):
     local_admins: Optional[Dict[str, dict]]
     timeout: int
     mac_table: dict
+    #: Seconds it took to open the last session
+    login_time: Optional[float]
+    #: Maximum seconds a single retrieve_data() may take, None for no limit
+    device_timeout: Optional[float]
+    #: Dictionary of {module: maximum seconds}, see SCAN_MODULES
+    module_timeouts: Dict[str, float]
+    #: time.monotonic() value after which retrieve_data() is aborted, None for no limit
+    deadline: Optional[float]
+    #: Outcome of each module in the last retrieve_data(). Dictionary of
+    #: {module: {'status': 'ok', 'failed', 'timeout', 'unsupported' or 'skipped', 'duration': seconds,
+    #: 'error': str or None, 'attempts': int, 'items': number of entries collected}}.
+    #: Modules a structured collector was tried on also have 'collector': its name or 'cli'
+    scan_results: Dict[str, dict]
+    #: How many more times failed modules are tried, on a new session if needed
+    module_retries: int
+    #: Skips modules this device or platform does not support, optional
+    capability_cache: Optional[CapabilityCache]
+    #: Collection profile used in the last scan, see COLLECTION_PROFILES
+    collection_profile: str
+    #: Send the show commands of all modules in one write instead of waiting for each prompt
+    batch_commands: bool
+    #: SSH sessions are tunnelled through this bastion, optional
+    bastion: Optional[BastionPool]
+    #: Attributes taken from the running config instead of their own command in the last scan.
+    #: Any of 'vlans', 'local_admins' and 'interfaces_ip'
+    config_derived: Set[str]
+    #: How the running config was read in the last scan:
+    #: {'method': 'scp', 'sftp' or 'cli', 'duration': seconds, 'size': characters}
+    config_fetch: Optional[dict]
+    #: Config change probe of the last incremental scan: {'output': str, 'boot_time': epoch}
+    config_probe: Optional[dict]
+    #: Whether the last incremental scan found the config changed, None if it could not tell or was not incremental
+    config_changed: Optional[bool]
 
     def __init__(self,
                  mgmt_address,
@@ -134,16 +268,56 @@ class Switch(Device):
         self.local_admins: Optional[Dict[str, dict]] = None
         self.timeout = 30
         self.mac_table = {}
-        self.platform = kwargs.get('platfomr', 'ios')
+        self.login_time = None
+        self.device_timeout = kwargs.get('device_timeout', None)
+        self.module_timeouts = kwargs.get('module_timeouts', {})
+        self.deadline = kwargs.get('deadline', None)
+        self.module_retries = kwargs.get('module_retries', 1)
+        self.scan_results = {}
+        self.capability_cache = kwargs.get('capability_cache', None)
+        self.config_derived = set()
+        self.config_fetch = None
+        self.config_probe = None
+        self.config_changed = None
+        self.collection_profile = 'full'
+        self.batch_commands = kwargs.get('batch_commands', True)
+        self.bastion = kwargs.get('bastion', None)
+        # Copies of this Switch running modules on their own sessions, see _run_modules_parallel
+        self._workers = []
+        # Structured collectors of the current scan, see DEFAULT_COLLECTORS
+        self._collectors: List[StructuredCollector] = []
+        self._deadline = None
+        # Deadline shared by every retrieve_data() inside time_budget()
+        self._budget_deadline = None
+        # Set when the session was closed under a running module
+        self._aborted = None
+        # Set when the whole retrieve_data() has to stop, until clear_abort()
+        self._cancelled = None
+        # Older versions only took the misspelled keyword
+        platform = kwargs.get('platform', kwargs.get('platfomr', None))
+        if platform is None:
+            self.platform = 'ios'
+            self.platform_source = 'default'
+        else:
+            self.platform = platform
+            self.platform_source = kwargs.get('platform_source', 'user')
 
         if self.config is not None:
             self._parse_config()
 
+    def __getstate__(self):
+        # NAPALM sessions cannot be pickled and are useless once closed anyway
+        state = super().__getstate__()
+        state.pop('session', None)
+        state['_collectors'] = []
+        return state
+
     def retrieve_data(self,
                       username: str,
                       password: str,
                       napalm_optional_args: dict = None,
-                      scan_options: dict = None):
+                      scan_options: dict = None,
+                      neighbors_callback: Optional[Callable[['Switch'], None]] = None):
         """
         One-stop function to get data from switch.
 
@@ -153,22 +327,155 @@ class Switch(Device):
         :type password: str
         :param napalm_optional_args: Refer to Napalm's documentation
         :type napalm_optional_args: dict
-        :param scan_options: Valid keys are 'whitelist' and 'blacklist'. Value must be a list of options to pass to _get_switch_data
+        :param scan_options: Valid keys are 'whitelist', 'blacklist' (lists of modules), 'from_config' (bool),
+            'profile' (str), 'max_sessions' (int), 'collectors' (list or dict), 'collector_options' (dict)
+            'config_transfer' (bool), 'incremental' (bool) and 'running_config' (bool), passed to _get_switch_data
         :type scan_options: dict(str, list(str))
+        :param neighbors_callback: Function called with this Switch as soon as CDP/LLDP neighbors are parsed, defaults to None
+        :type neighbors_callback: function, optional
+
+        Each scan module is isolated: if one fails or exceeds its entry in
+        module_timeouts, the others still run and only the failed ones are
+        retried, on a new session if the old one is gone. See scan_results.
+
+        When device_timeout or deadline are exceeded the session is closed,
+        data collected up to that point is kept and DeadlineExceeded is raised.
+        device_timeout counts from this call, or from entering time_budget() if
+        called inside it. After abort(), it raises straight away until clear_abort().
         """
 
         self.napalm_optional_args = {} if napalm_optional_args is None else napalm_optional_args
         scan_options = {} if scan_options is None else scan_options
 
-        self.connect(username, password, napalm_optional_args)
+        if self._cancelled is not None:
+            raise DeadlineExceeded(self._cancelled)
+
+        # Only what happened to the previous session
+        self._aborted = None
+        self._deadline = self._budget_deadline
+        if self._deadline is None:
+            self._deadline = self._new_deadline()
+
+        watchdog = None
+        if self._deadline is not None:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(
+                    f"No time left to connect to {self.mgmt_address}")
+
+            watchdog = threading.Timer(remaining, self.abort,
+                                       kwargs={'reason': "Device time budget exhausted"})
+            watchdog.daemon = True
+            watchdog.start()
+
         try:
-            self._get_switch_data(**scan_options)
-        except Exception as e:
-            self.session.close()
-            raise e
+            self.connect(username, password, napalm_optional_args)
+            try:
+                self._get_switch_data(neighbors_callback=neighbors_callback,
+                                      credentials=(username, password),
+                                      **scan_options)
+                self._retry_failed_modules(username, password)
+                self._record_capabilities()
+            except Exception as e:
+                self._close_session()
+                if self._cancelled is not None and not isinstance(e, DeadlineExceeded):
+                    raise DeadlineExceeded(self._cancelled) from e
+                raise e
 
-        else:
+            else:
+                self._close_session()
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            self._close_collectors()
+
+    def _new_deadline(self) -> Optional[float]:
+        """time.monotonic() value when device_timeout or deadline run out, whichever comes first"""
+        if self.device_timeout is None:
+            return self.deadline
+
+        device_deadline = time.monotonic() + self.device_timeout
+        return device_deadline if self.deadline is None else min(self.deadline, device_deadline)
+
+    @contextlib.contextmanager
+    def time_budget(self):
+        """
+        Share one device_timeout between every retrieve_data() called inside,
+        e.g. when trying several login methods one after the other
+        """
+        self._budget_deadline = self._new_deadline()
+        try:
+            yield
+        finally:
+            self._budget_deadline = None
+
+    def clear_abort(self) -> None:
+        """Let retrieve_data() run again after abort(). Call it before starting a new discovery"""
+        self._cancelled = None
+
+    def _close_collectors(self) -> None:
+        """Close the sessions structured collectors opened and forget them"""
+        for collector in self._collectors:
+            collector.close()
+
+        self._collectors = []
+
+    def _close_session(self):
+        """Close session, ignoring errors if it was aborted already"""
+        try:
             self.session.close()
+        except Exception:
+            if self._aborted is None and self._cancelled is None:
+                raise
+
+    def _session_alive(self) -> bool:
+        """Check whether the current session can still be used"""
+        if self._aborted is not None:
+            return False
+
+        try:
+            return self.session.is_alive().get('is_alive', False)
+        except Exception:
+            return False
+
+    def _retry_failed_modules(self, username: str, password: str) -> None:
+        """Run failed scan modules again, reconnecting if the session is gone
+
+        :param username: username
+        :type username: str
+        :param password: password
+        :type password: str
+        """
+        for _ in range(self.module_retries):
+            # Modules that timed out go last, they may take the session down again
+            failed = [module for module, result in self.scan_results.items()
+                      if result['status'] == 'failed']
+            failed += [module for module, result in self.scan_results.items()
+                       if result['status'] == 'timeout']
+            if not failed:
+                return
+
+            if not self._session_alive():
+                self.logger.info("Reconnecting to %s to retry %s",
+                                 self.mgmt_address, ", ".join(failed))
+                self._close_session()
+                self._aborted = None
+                try:
+                    self.connect(username, password)
+                except Exception as e:
+                    # Keep what was collected with the first session
+                    self.logger.error(
+                        "Could not reconnect to %s: %s", self.mgmt_address, e)
+                    self._aborted = str(e)
+                    return
+            else:
+                self.logger.info("Retrying %s on %s",
+                                 ", ".join(failed), self.mgmt_address)
+
+            # Start from fresh outputs, the stored ones may be what made the module fail
+            self._use_command_memo()
+            for module in failed:
+                self._run_scan_module(module)
 
     def connect(self, username: str, password: str, napalm_optional_args: dict = None) -> None:
         """Connect to device
@@ -185,14 +492,244 @@ class Switch(Device):
         if napalm_optional_args is not None:
             self.napalm_optional_args = napalm_optional_args
 
+        optional_args = self.napalm_optional_args
+        if self.bastion is not None:
+            optional_args = dict(optional_args or {})
+            if optional_args.get('transport', 'ssh') == 'ssh':
+                optional_args['sock'] = self.bastion.open_channel(str(self.mgmt_address),
+                                                                  optional_args.get('port', 22))
+            else:
+                self.logger.warning("Only SSH goes through the bastion, connecting to %s directly",
+                                    self.mgmt_address)
+
         self.session = driver(str(self.mgmt_address),
                               username=username,
                               password=password,
                               timeout=self.timeout,
-                              optional_args=self.napalm_optional_args)
+                              optional_args=optional_args)
 
         self.logger.info("Connecting to %s", self.mgmt_address)
+        start = time.monotonic()
         self.session.open()
+        self.login_time = time.monotonic() - start
+
+    def _use_command_memo(self) -> None:
+        """Serve repeated show commands on the current session from memory, starting empty"""
+        device = self.session.device
+        if isinstance(device, CommandMemo):
+            device.clear()
+        else:
+            self.session.device = CommandMemo(device)
+
+    def _send_command(self, command: str) -> str:
+        """Send a show command through the session, waiting as long as big outputs need
+
+        :param command: Command to send
+        :type command: str
+        :return: Command output
+        :rtype: str
+        """
+        return self.session.device.send_command(command, read_timeout=self.COMMAND_READ_TIMEOUT)
+
+    def abort(self, reason: str = "Aborted") -> None:
+        """Stop a running retrieve_data() by closing its session.
+        Whatever was collected so far is kept.
+
+        :param reason: Logged and passed to DeadlineExceeded, defaults to "Aborted"
+        :type reason: str, optional
+        """
+        self._cancelled = reason
+        self._close_connection(reason)
+        for worker in list(self._workers):
+            worker.abort(reason)
+
+    def _close_connection(self, reason: str) -> None:
+        """Close the connection under a running command so it fails straight away
+
+        :param reason: Logged and stored in scan_results
+        :type reason: str
+        """
+        self._aborted = reason
+        self.logger.warning("Aborting session to %s: %s",
+                            self.mgmt_address, reason)
+
+        device = getattr(getattr(self, 'session', None), 'device', None)
+        remote_conn = getattr(device, 'remote_conn', None)
+        try:
+            if remote_conn is not None:
+                remote_conn.close()
+        except (OSError, EOFError):
+            pass
+
+        # Make Netmiko fail on the next read instead of waiting for its own timeout
+        channel = getattr(device, 'channel', None)
+        if channel is not None:
+            channel.remote_conn = None
+
+    def capability_platform(self) -> Optional[str]:
+        """Platform identifier used by capability_cache, e.g. "ios:WS-C2960X-48FPD-L"
+
+        :return: Platform and model, None if facts are not known
+        :rtype: str
+        """
+        if not self.facts:
+            return None
+
+        return f"{self.platform}:{self.facts.get('model', '')}"
+
+    def _record_capabilities(self) -> None:
+        """Tell capability_cache which modules the device supports.
+        Failed and timed out modules say nothing about the device and are not recorded,
+        neither are empty results."""
+        if self.capability_cache is None or self.mgmt_address is None:
+            return
+
+        for module, result in self.scan_results.items():
+            if result['status'] not in ('ok', 'unsupported'):
+                continue
+
+            self.capability_cache.record(self.mgmt_address, self.capability_platform(),
+                                         module, result['status'] == 'ok')
+
+    def _out_of_time(self) -> bool:
+        """Check whether retrieve_data() has to stop"""
+        return self._cancelled is not None or (
+            self._deadline is not None and time.monotonic() >= self._deadline)
+
+    def _run_scan_module(self, module: str) -> None:
+        """Run a scan module within its time budget and record the outcome in scan_results.
+        Errors are logged and do not stop other modules. A watchdog closes
+        the session if the module takes too long.
+
+        :param module: One of SCAN_MODULES
+        :type module: str
+        """
+        if self._out_of_time():
+            raise DeadlineExceeded(
+                f"{self._cancelled or 'Out of time'}, {module} not collected")
+
+        result = self.scan_results.setdefault(
+            module, {'status': None, 'duration': 0.0, 'error': None, 'attempts': 0, 'items': 0})
+        result['attempts'] += 1
+
+        if self._aborted is not None:
+            # Session closed by an earlier module, will be retried on a new one
+            result.update(status='failed', duration=0.0, error=self._aborted)
+            return
+
+        budget = self.module_timeouts.get(module)
+        if self._deadline is not None:
+            remaining = self._deadline - time.monotonic()
+            budget = remaining if budget is None else min(budget, remaining)
+
+        watchdog = None
+        if budget is not None:
+            watchdog = threading.Timer(budget, self._close_connection,
+                                       kwargs={'reason': f"{module} took longer than {budget:.1f}s"})
+            watchdog.daemon = True
+            watchdog.start()
+
+        start = time.monotonic()
+        error = None
+        unsupported = None
+        items = None
+        try:
+            items = self._scan_functions()[module]()
+        except (ModuleNotSupported, NotImplementedError) as e:
+            unsupported = f"{type(e).__name__}: {e}"
+        except Exception as e:
+            if self._out_of_time():
+                raise DeadlineExceeded(self._cancelled or str(e)) from e
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+        result['duration'] = time.monotonic() - start
+        if self._aborted is not None:
+            # Output read before the session was closed may be truncated
+            if self._out_of_time():
+                raise DeadlineExceeded(self._cancelled or self._aborted)
+            result.update(status='timeout', error=self._aborted)
+        elif error is not None:
+            result.update(status='failed', error=error)
+        elif unsupported is not None:
+            self.logger.info("Scan module %s not supported on %s: %s",
+                             module, self.hostname, unsupported)
+            result.update(status='unsupported', error=unsupported)
+            return
+        else:
+            result.update(status='ok', error=None, items=items or 0)
+            return
+
+        self.logger.error("Scan module %s failed on %s: %s",
+                          module, self.hostname, result['error'])
+
+    def _scan_functions(self) -> Dict[str, Callable[[], Optional[int]]]:
+        """Return a dictionary of {module: function} for all SCAN_MODULES.
+        Each function returns how many entries it collected.
+        Modules a structured collector handles go through it first."""
+        functions = {'mac_address': self._get_mac_address_table,
+                'interface_status': self._parse_show_interface,
+                'cdp_neighbors': self._parse_cdp_neighbors,
+                'lldp_neighbors': self._parse_lldp_neighbors,
+                'vtp': self._get_vtp,
+                'vlans': self._get_vlans,
+                'l3_int': self._get_l3_int,
+                'local_admins': self._get_local_admins,
+                'inventory': self._get_inventory}
+
+        for module, function in functions.items():
+            collector = self._collector_for(module)
+            if collector is not None:
+                functions[module] = functools.partial(
+                    self._collect_structured, collector, module, function)
+
+        return functions
+
+    def _collector_for(self, module: str) -> Optional[StructuredCollector]:
+        """Return the first usable structured collector for a module, None if there is none.
+        Without a text parser for the platform, a collector that failed is tried again."""
+        has_parser = module in self.PLATFORM_MODULES.get(self.platform, [])
+        for collector in self._collectors:
+            if module in collector.modules and (collector.available or not has_parser):
+                return collector
+
+        return None
+
+    def _collect_structured(self, collector: StructuredCollector, module: str,
+                            text_parser: Callable[[], Optional[int]]) -> Optional[int]:
+        """Fill a module with a structured collector. If the device cannot answer it,
+        the collector is not used again in this scan and the text parser runs instead,
+        where the platform has one.
+
+        :param collector: Collector handling module
+        :type collector: netwalk.collectors.StructuredCollector
+        :param module: Scan module
+        :type module: str
+        :param text_parser: Function parsing the module from text output
+        :type text_parser: function
+        :return: Number of entries collected
+        :rtype: int
+        """
+        try:
+            items = collector.collect(self, module)
+        except Exception as e:
+            if self._aborted is not None or self._out_of_time():
+                raise
+
+            collector.available = False
+            if module not in self.PLATFORM_MODULES.get(self.platform, []):
+                # No text parser for this platform
+                raise
+
+            self.logger.warning("%s failed on %s, parsing text output instead: %s",
+                                collector.name, self.hostname, e)
+            self.scan_results[module]['collector'] = 'cli'
+            return text_parser()
+
+        self.scan_results[module]['collector'] = collector.name
+        return items
 
     def get_active_vlans(self):
         """Get active vlans from switch.
@@ -241,8 +778,11 @@ class Switch(Device):
         vlans.intersection_update(self.vlans_set)
         return vlans
 
-    def _parse_config(self):
+    def _parse_config(self, derive: bool = False):
         """Parse show run
+
+        :param derive: Also fill vlans, local_admins and interfaces_ip from it, defaults to False
+        :type derive: bool, optional
         """
         if isinstance(self.config, str):
             parsed_conf = CiscoConfParse(self.config.split("\n"))
@@ -259,12 +799,140 @@ class Switch(Device):
                     thisint.parse_config()
                     self.add_interface(thisint)
 
+            if derive:
+                self._derive_from_config(parsed_conf)
+
         else:
             TypeError("No interface loaded, cannot parse")
 
+    def _derive_from_config(self, parsed_conf: CiscoConfParse) -> None:
+        """Fill vlans, local_admins and interfaces_ip from the running config
+        where it holds everything their commands would return. See config_derived.
+
+        :param parsed_conf: Running config
+        :type parsed_conf: CiscoConfParse
+        """
+        self.config_derived = set()
+
+        # With VTP server or client, VLANs are in vlan.dat and not in the config
+        if parsed_conf.find_objects(r'^vtp mode (transparent|off)'):
+            self.vlans = self._vlans_from_config(parsed_conf)
+            self.vlans_set = set(self.vlans)
+            self.config_derived.add('vlans')
+
+        self.local_admins = self._users_from_config()
+        self.config_derived.add('local_admins')
+
+        interfaces_ip = self._interfaces_ip_from_config(parsed_conf)
+        if interfaces_ip is not None:
+            self.interfaces_ip = interfaces_ip
+            self.config_derived.add('interfaces_ip')
+
+    def _vlans_from_config(self, parsed_conf: CiscoConfParse) -> Dict[int, dict]:
+        """Return VLANs in the same format as NAPALM's get_vlans()"""
+        vlans = {1: {'name': 'default', 'interfaces': []}}
+        for vlan_obj in parsed_conf.find_objects(r'^vlan\s+[\d,\-]+\s*$'):
+            vlan_ids = []
+            for part in vlan_obj.text.split()[1].split(','):
+                if '-' in part:
+                    start, end = part.split('-')
+                    vlan_ids.extend(range(int(start), int(end) + 1))
+                else:
+                    vlan_ids.append(int(part))
+
+            name = None
+            for child in vlan_obj.children:
+                match = re.match(r'\s*name\s+(.+?)\s*$', child.text)
+                if match is not None:
+                    name = match.groups()[0]
+
+            for vlan_id in vlan_ids:
+                vlans[vlan_id] = {'name': name if name is not None else f"VLAN{vlan_id:04d}",
+                                  'interfaces': []}
+
+        for intf in self.interfaces.values():
+            if intf.mode == 'access' and not intf.routed_port and intf.native_vlan in vlans:
+                vlans[intf.native_vlan]['interfaces'].append(intf.name)
+
+        return vlans
+
+    def _users_from_config(self) -> Dict[str, dict]:
+        """Return local users in the same format as NAPALM's get_users()"""
+        username_regex = (r"^username\s+(?P<username>\S+)\s+(?:privilege\s+(?P<priv_level>\S+)"
+                          r"\s+)?(?:(password|secret) \d+\s+(?P<pwd_hash>\S+))?$")
+        pub_keychain_regex = (r"^\s+username\s+(?P<username>\S+)(?P<keys>(?:\n\s+key-hash\s+"
+                              r"(?P<hash_type>\S+)\s+(?P<hash>\S+)(?:\s+\S+)?)+)$")
+
+        users = {}
+        for match in re.finditer(username_regex, self.config, re.M):
+            users[match.group('username')] = {
+                'level': int(match.group('priv_level')) if match.group('priv_level') else 1,
+                'password': match.group('pwd_hash') if match.group('pwd_hash') else "",
+                'sshkeys': []}
+
+        for match in re.finditer(pub_keychain_regex, self.config, re.M):
+            if match.group('username') in users:
+                users[match.group('username')]['sshkeys'] = [
+                    x.strip()[9:] for x in match.group('keys').splitlines() if x]
+
+        return users
+
+    def _interfaces_ip_from_config(self, parsed_conf: CiscoConfParse) -> Optional[Dict[str, dict]]:
+        """Return interface addresses in the same format as NAPALM's get_interfaces_ip(),
+        None if some are only known at runtime (DHCP, SLAAC, EUI-64, unnumbered)
+        or are on interfaces INTERFACE_FILTER leaves out, e.g. Tunnel or Serial.
+        IPv6 link-local addresses are not included.
+
+        :param parsed_conf: Running config
+        :type parsed_conf: CiscoConfParse
+        """
+        runtime = re.compile(
+            r'^\s*(ip address (dhcp|negotiated)|ip unnumbered|ipv6 address (autoconfig|dhcp)'
+            r'|ipv6 address \S+ (eui-64|anycast|link-local))')
+        ipv6 = re.compile(r'^\s*ipv6 address ([0-9a-fA-F:]+)/(\d+)\s*$')
+        layer3 = re.compile(r'^\s*ip(v6)? address ')
+
+        for intf in parsed_conf.find_objects(r'^interface '):
+            if not re.match(self.INTERFACE_FILTER, intf.text) and \
+                    any(layer3.match(x.text) for x in intf.children):
+                self.logger.debug("Addresses on %s are not parsed, asking the device", intf.text)
+                return None
+
+        interfaces_ip = {}
+        for name, intf in self.interfaces.items():
+            addresses = {}
+            for address in intf.address.get('ipv4', {}):
+                addresses.setdefault('ipv4', {})[str(address.ip)] = {
+                    'prefix_length': address.network.prefixlen}
+
+            for line in intf.config or []:
+                if runtime.match(line):
+                    return None
+
+                match = ipv6.match(line)
+                if match is not None:
+                    address = ipaddress.ip_address(match.groups()[0])
+                    addresses.setdefault('ipv6', {})[str(address)] = {
+                        'prefix_length': int(match.groups()[1])}
+
+            if addresses:
+                interfaces_ip[name] = addresses
+
+        return interfaces_ip
+
     def _get_switch_data(self,
                          whitelist: Optional[List[str]] = None,
-                         blacklist: Optional[List[str]] = None):
+                         blacklist: Optional[List[str]] = None,
+                         neighbors_callback: Optional[Callable[['Switch'], None]] = None,
+                         from_config: bool = False,
+                         profile: str = 'full',
+                         max_sessions: int = 1,
+                         credentials: Optional[Tuple[str, str]] = None,
+                         collectors: Optional[Union[List[str], Dict[str, str]]] = None,
+                         collector_options: Optional[Dict[str, dict]] = None,
+                         config_transfer: bool = False,
+                         incremental: bool = False,
+                         running_config: bool = True):
         """
         Get data from switch.
         If no argument is passed, scan all modules
@@ -273,9 +941,37 @@ class Switch(Device):
         :type whitelist: list(str)
         :param blacklist: List of modules to exclude from scan, defaults to None
         :type blacklist: list(str)
+        :param neighbors_callback: Function called with this Switch once neighbors are known, defaults to None
+        :type neighbors_callback: function, optional
+        :param from_config: Take VLANs, local admins and L3 addresses from the running config
+            instead of asking for them separately, defaults to False
+        :type from_config: bool, optional
+        :param profile: One of COLLECTION_PROFILES, sets the default modules and how much of
+            "show interfaces" is collected, defaults to 'full'
+        :type profile: str, optional
+        :param max_sessions: Sessions to the device the modules after CDP/LLDP are spread over, defaults to 1
+        :type max_sessions: int, optional
+        :param credentials: (username, password) used to open the extra sessions, defaults to None
+        :type credentials: tuple(str, str), optional
+        :param collectors: Structured collectors to try before the text parsers, where the platform
+            supports them, defaults to DEFAULT_COLLECTORS. Either a list of collector names, used for
+            all their modules, or a dictionary of {module: collector name}
+        :type collectors: list(str) or dict(str, str), optional
+        :param collector_options: Dictionary of {collector name: keyword arguments}, e.g. the SNMP community, defaults to None
+        :type collector_options: dict(str, dict), optional
+        :param config_transfer: Copy the running config over SCP or SFTP where the platform allows it,
+            reading it through the CLI if that fails, defaults to False
+        :type config_transfer: bool, optional
+        :param incremental: Probe whether the config changed since the last incremental scan.
+            If not, keep the config and what was parsed from it and only run VOLATILE_MODULES, defaults to False
+        :type incremental: bool, optional
+        :param running_config: Read the running config. If False the config of the previous scan
+            is kept, unless there is none, defaults to True
+        :type running_config: bool, optional
 
         Either whitelist or blacklist can be passed.
         If both are passed, whitelist takes precedence over blacklist.
+        The blacklist removes modules from those of the profile.
 
         Valid values are:
         - 'mac_address'
@@ -288,28 +984,59 @@ class Switch(Device):
         - 'local_admins'
         - 'inventory'
 
-        Running config is ALWAYS returned
+        Running config is ALWAYS returned, unless an incremental scan finds it unchanged
+        or running_config is False on a Switch scanned before.
+        CDP and LLDP neighbors are collected right after the config so that
+        neighbors_callback can hand them out before the slower modules run.
         """
 
-        allscans = ['mac_address', 'interface_status',
-                    'cdp_neighbors', 'lldp_neighbors', 'vtp', 'vlans', 'l3_int', 'local_admins', 'inventory']
+        assert profile in self.COLLECTION_PROFILES, f"Unknown collection profile, has to be any of {list(self.COLLECTION_PROFILES)}"
+
+        allscans = list(self.SCAN_MODULES)
+        profilescans = list(self.COLLECTION_PROFILES[profile]['modules'])
         scan_to_perform = []
 
         if whitelist is not None:
             for i in whitelist:
-                assert i in allscans, "Parameter not recognised in scan list. has to be any of ['mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors', 'vtp', 'vlans', 'l3_int', 'local_admins', 'inventory']"
+                assert i in allscans, f"Parameter not recognised in scan list. has to be any of {allscans}"
 
             scan_to_perform = whitelist
 
         elif blacklist is not None:
-            scan_to_perform = allscans
+            scan_to_perform = profilescans
             for i in blacklist:
-                assert i in allscans, "Parameter not recognised in scan list. has to be any of ['mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors', 'vtp', 'vlans', 'l3_int', 'local_admins', 'inventory']"
-                scan_to_perform.remove(i)
+                assert i in allscans, f"Parameter not recognised in scan list. has to be any of {allscans}"
+                if i in scan_to_perform:
+                    scan_to_perform.remove(i)
 
         else:
-            scan_to_perform = allscans
+            scan_to_perform = profilescans
 
+        self.collection_profile = profile
+
+        if collectors is None:
+            collectors = self.DEFAULT_COLLECTORS
+        collector_options = {} if collector_options is None else collector_options
+
+        # {collector name: modules to use it for, None for all}
+        selected: Dict[str, Optional[List[str]]] = {}
+        if isinstance(collectors, dict):
+            for module, name in collectors.items():
+                assert module in allscans, f"Parameter not recognised in scan list. has to be any of {allscans}"
+                selected.setdefault(name, []).append(module)
+        else:
+            selected = {x: None for x in collectors}
+
+        for i in selected:
+            assert i in COLLECTORS, f"Unknown collector, has to be any of {list(COLLECTORS)}"
+
+        self._close_collectors()
+        self._collectors = [COLLECTORS[name](credentials, modules, **collector_options.get(name, {}))
+                            for name, modules in selected.items()
+                            if self.platform in COLLECTORS[name].platforms]
+
+        self.scan_results = {}
+        self._use_command_memo()
         self.facts = self.session.get_facts()
 
         try:
@@ -320,83 +1047,367 @@ class Switch(Device):
 
         self.init_time = datetime.datetime.now()
 
-        self.config = self.session.get_config(retrieve="running")['running']
+        unchanged = False
+        self.config_changed = None
+        if incremental:
+            probe = self._probe_config()
+            if probe is not None and self.config is not None and self.config_probe is not None:
+                unchanged = probe['output'] == self.config_probe['output'] and \
+                    abs(probe['boot_time'] - self.config_probe['boot_time']) < self.BOOT_TIME_TOLERANCE
+                self.config_changed = not unchanged
+
+            self.config_probe = probe
+
+        if unchanged:
+            self.logger.info("Config of %s unchanged, collecting %s only",
+                             self.hostname, ", ".join(self.VOLATILE_MODULES))
+            for module in [x for x in scan_to_perform if x not in self.VOLATILE_MODULES]:
+                scan_to_perform = [x for x in scan_to_perform if x != module]
+                self.scan_results[module] = {'status': 'skipped', 'duration': 0.0,
+                                             'error': "Config unchanged", 'attempts': 0, 'items': 0}
+        elif not running_config and self.config is not None:
+            self.logger.debug("Keeping previous running config of %s", self.hostname)
+        else:
+            self.config = self._get_running_config(transfer=config_transfer)
+
+            self.config_derived = set()
+            self._parse_config(derive=from_config)
+
+        supported = set(self.PLATFORM_MODULES.get(self.platform, self.NAPALM_MODULES))
+        for collector in self._collectors:
+            supported.update(collector.modules)
+
+        for module in [x for x in scan_to_perform if x not in supported]:
+            self.logger.info("Skipping %s on %s, not supported on %s",
+                             module, self.hostname, self.platform)
+            scan_to_perform = [x for x in scan_to_perform if x != module]
+            self.scan_results[module] = {'status': 'skipped', 'duration': 0.0,
+                                         'error': f"Not supported on {self.platform}",
+                                         'attempts': 0, 'items': 0}
+
+        if self.capability_cache is not None:
+            for module in self.capability_cache.modules_to_skip(self.mgmt_address,
+                                                                self.capability_platform()):
+                if module in scan_to_perform:
+                    self.logger.info("Skipping %s on %s, it is not supported",
+                                     module, self.hostname)
+                    scan_to_perform = [x for x in scan_to_perform if x != module]
+                    self.scan_results[module] = {'status': 'skipped', 'duration': 0.0,
+                                                 'error': None, 'attempts': 0, 'items': 0}
+
+        # Neighbors are batched apart so they can be handed out before the rest is read
+        self._prefetch([x for x in scan_to_perform if x in self.NEIGHBOR_MODULES])
+        for module in scan_to_perform:
+            if module in self.NEIGHBOR_MODULES:
+                self._run_scan_module(module)
+
+        if neighbors_callback is not None:
+            neighbors_callback(self)
+
+        remaining = [x for x in scan_to_perform if x not in self.NEIGHBOR_MODULES]
+        if max_sessions > 1 and len(remaining) > 1 and credentials is not None:
+            self._run_modules_parallel(remaining, max_sessions, credentials)
+            return
+
+        self._prefetch(remaining)
+        for module in remaining:
+            self._run_scan_module(module)
+
+    def _probe_config(self) -> Optional[dict]:
+        """Ask the device for something that changes whenever its running config does
+
+        :return: {'output': probe output, 'boot_time': epoch}, None if the platform has no probe
+        :rtype: dict
+        """
+        uptime = (self.facts or {}).get('uptime', -1)
+        for command in self.CONFIG_PROBES.get(self.platform, []):
+            output = self._send_command(command).strip()
+            if output.startswith("%") or "Invalid input" in output:
+                continue
 
-        self._parse_config()
+            return {'output': f"{command}\n{output}",
+                    'boot_time': time.time() - uptime if uptime >= 0 else 0}
 
-        if 'mac_address' in scan_to_perform:
-            # Get mac address table
-            self.mac_table = {}  # Clear before adding new data
-            mactable = self.session.get_mac_address_table()
+        return None
 
-            macdict = {EUI(x['mac']): x for x in mactable}
+    def _get_running_config(self, transfer: bool = False) -> str:
+        """Read the running config and record how in config_fetch.
 
-            for k, v in macdict.items():
-                if v['interface'] == '':
-                    continue
+        :param transfer: Try copying it over SCP, then SFTP, before asking the CLI, defaults to False
+        :type transfer: bool, optional
+        :return: Running config
+        :rtype: str
+        """
+        # Devices and platforms where copying failed before go straight to the CLI
+        skip = self.capability_cache is not None and 'config_transfer' in \
+            self.capability_cache.modules_to_skip(self.mgmt_address, self.capability_platform())
 
-                v['interface'] = interface_name_expander(v['interface'])
+        if transfer and not skip and self.platform in self.CONFIG_FILES:
+            start = time.monotonic()
+            try:
+                config, method = self._transfer_running_config()
+            except Exception as e:
+                self.logger.info("Could not copy running config of %s, reading it through the CLI: %s",
+                                 self.hostname, e)
+                success = False
+            else:
+                self.config_fetch = {'method': method,
+                                     'duration': time.monotonic() - start,
+                                     'size': len(config)}
+                success = True
+
+            if self.capability_cache is not None:
+                self.capability_cache.record(self.mgmt_address, self.capability_platform(),
+                                             'config_transfer', success)
+            if success:
+                return config
+
+        start = time.monotonic()
+        config = self.session.get_config(retrieve="running")['running']
+        self.config_fetch = {'method': 'cli',
+                             'duration': time.monotonic() - start,
+                             'size': len(config)}
+        return config
+
+    def _transfer_running_config(self) -> Tuple[str, str]:
+        """Copy the running config over a new channel of the current SSH connection,
+        with SCP or else SFTP.
+
+        :return: (config, 'scp' or 'sftp')
+        :rtype: tuple(str, str)
+        """
+        path = self.CONFIG_FILES[self.platform]
+        remote_conn = getattr(self.session.device, 'remote_conn', None)
+        if not isinstance(remote_conn, paramiko.Channel):
+            raise ValueError("Not an SSH session")
 
-                v.pop('mac')
-                v.pop('static')
-                v.pop('moves')
-                v.pop('last_move')
-                v.pop('active')
+        transport = remote_conn.get_transport()
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                local_path = os.path.join(tmpdir, "running-config")
+                # Device paths like system:running-config must not be quoted
+                with scp.SCPClient(transport, socket_timeout=self.timeout,
+                                   sanitize=lambda x: x) as client:
+                    client.get(path, local_path)
+
+                with open(local_path, 'r', encoding='utf-8', errors='replace') as infile:
+                    data = infile.read()
+            method = 'scp'
+        except Exception as e:
+            self.logger.debug("SCP of %s failed on %s, trying SFTP: %s", path, self.hostname, e)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            try:
+                sftp.get_channel().settimeout(self.timeout)
+                with sftp.open(path, 'r') as infile:
+                    data = infile.read().decode(errors='replace')
+            finally:
+                sftp.close()
+            method = 'sftp'
+
+        data = self.CONFIG_HEADER.sub("", data.replace("\r", ""))
+        return data.strip(), method
+
+    def _run_modules_parallel(self, modules: List[str], max_sessions: int, credentials: Tuple[str, str]) -> None:
+        """Run modules concurrently over this session and up to max_sessions - 1 new ones.
+        Each new session belongs to a shallow copy of this Switch, so interfaces
+        and scan_results are shared and other data is copied back when done.
+        A session that cannot be opened leaves its share to the others.
+
+        :param modules: Modules to run
+        :type modules: list(str)
+        :param max_sessions: Maximum sessions open at the same time, this one included
+        :type max_sessions: int
+        :param credentials: (username, password) for the new sessions
+        :type credentials: tuple(str, str)
+        """
+        pending = queue.Queue()
+        for module in modules:
+            pending.put(module)
 
+        workers = [self]
+        for _ in range(min(max_sessions, len(modules)) - 1):
+            worker = copy.copy(self)
+            # Workers fill the same interfaces, so they take the same lock
+            worker._interfaces_lock = self._interfaces_lock
+            worker.session = None
+            worker._workers = []
+            workers.append(worker)
+
+        before = dict(self.__dict__)
+
+        self._workers = workers[1:]
+
+        def drain(worker: Switch):
+            if worker is not self:
                 try:
-                    # some interfaces have diFFeRenT capitalization across outputs
-                    v['interface'] = {k.lower(): v for k, v in self.interfaces.items()}[
-                        v['interface'].lower()]
-                    self.mac_table[k] = v
-                except KeyError:
-                    # print("Interface {} not found".format(v['interface']))
-                    continue
+                    worker.connect(*credentials)
+                except Exception as e:
+                    self.logger.warning("Could not open another session to %s: %s",
+                                        self.mgmt_address, e)
+                    return
 
-            # Count macs per interface
-            for _, data in self.mac_table.items():
+            while True:
                 try:
-                    data['interface'].mac_count += 1
-                except KeyError:
-                    pass
+                    module = pending.get_nowait()
+                except queue.Empty:
+                    return
 
-        if 'interface_status' in scan_to_perform:
-            # Get interface status
-            self._parse_show_interface()
+                worker._run_scan_module(module)
 
-        if 'cdp_neighbors' in scan_to_perform:
-            self._parse_cdp_neighbors()
+        self.logger.info("Collecting %s from %s over %d sessions",
+                         ", ".join(modules), self.hostname, len(workers))
+        try:
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                futures = [executor.submit(drain, x) for x in workers]
+
+            for future in futures:
+                future.result()
+        finally:
+            for worker in self._workers:
+                if worker.session is not None:
+                    try:
+                        worker._close_session()
+                    except Exception as e:
+                        self.logger.warning("Could not close extra session to %s: %s",
+                                            self.mgmt_address, e)
+                # Only what the worker's modules replaced
+                for key, value in worker.__dict__.items():
+                    if key.startswith('_') or key in ('session', 'login_time'):
+                        continue
+                    if before.get(key) is not value:
+                        setattr(self, key, value)
+
+            self._workers = []
+
+    def _prefetch(self, modules: List[str]) -> None:
+        """Send the show commands of several modules in one go, see batch_commands.
+        Modules whose output could not be read this way send their own command.
+
+        :param modules: Modules about to be run
+        :type modules: list(str)
+        """
+        if not self.batch_commands or self._out_of_time() or self._aborted is not None:
+            return
+
+        device = self.session.device
+        if not isinstance(device, CommandMemo):
+            return
+
+        # Devices and platforms that dropped commands written in one go before get them one by one
+        if self.capability_cache is not None and 'batch_commands' in \
+                self.capability_cache.modules_to_skip(self.mgmt_address, self.capability_platform()):
+            return
+
+        commands = {'interface_status': self._show_interfaces_command(),
+                    'cdp_neighbors': "show cdp neighbors detail",
+                    'lldp_neighbors': "show lldp neighbors detail",
+                    'vtp': "show vtp status",
+                    'inventory': "show inventory"}
+
+        to_send = []
+        for module in modules:
+            collector = self._collector_for(module)
+            if collector is not None:
+                to_send += collector.commands(module)
+            elif module in commands:
+                to_send.append(commands[module])
+
+        stored = device.prefetch(to_send, read_timeout=self.COMMAND_READ_TIMEOUT)
+        if self.capability_cache is not None and (stored or device.prefetch_error is not None):
+            self.capability_cache.record(self.mgmt_address, self.capability_platform(),
+                                         'batch_commands', device.prefetch_error is None)
+
+    @staticmethod
+    def _check_supported(command: str, output: str) -> None:
+        """Raise ModuleNotSupported if the device does not know a command
+
+        :param command: Command sent
+        :type command: str
+        :param output: What the device answered
+        :type output: str
+        """
+        if "% Invalid input" in output:
+            raise ModuleNotSupported(f"Device does not know {command}")
+
+    def _get_mac_address_table(self):
+        """Get mac address table"""
+        self.mac_table = {}  # Clear before adding new data
+        mactable = self.session.get_mac_address_table()
+
+        macdict = {EUI(x['mac']): x for x in mactable}
+        # some interfaces have diFFeRenT capitalization across outputs.
+        # Copied first, interface_status may be adding some on another session
+        interfaces = {k.lower(): v for k, v in list(self.interfaces.items())}
+        # Counted again from scratch when refreshing
+        for intdata in interfaces.values():
+            intdata.mac_count = 0
+
+        for k, v in macdict.items():
+            if v['interface'] == '':
+                continue
 
-        if 'lldp_neighbors' in scan_to_perform:
-            self._parse_lldp_neighbors()
+            v['interface'] = interface_name_expander(v['interface'])
 
-        if 'vtp' in scan_to_perform:
-            # Get VTP status
-            command = "show vtp status"
-            result = self.session.cli([command])
+            v.pop('mac')
+            v.pop('static')
+            v.pop('moves')
+            v.pop('last_move')
+            v.pop('active')
 
-            self.vtp = result[command]
+            try:
+                v['interface'] = interfaces[v['interface'].lower()]
+                self.mac_table[k] = v
+            except KeyError:
+                # print("Interface {} not found".format(v['interface']))
+                continue
+
+        # Count macs per interface
+        for _, data in self.mac_table.items():
+            try:
+                data['interface'].mac_count += 1
+            except KeyError:
+                pass
+
+        return len(self.mac_table)
+
+    def _get_vtp(self):
+        """Get VTP status"""
+        command = "show vtp status"
+        result = self.session.cli([command])
 
-        if 'vlans' in scan_to_perform:
-            # Get VLANs
+        self.vtp = result[command]
+        self._check_supported(command, self.vtp)
+        return 1
+
+    def _get_vlans(self):
+        """Get VLANs"""
+        if 'vlans' not in self.config_derived:
             self.vlans = self.session.get_vlans()
-            self.vlans_set = set([int(k) for k, v in self.vlans.items()])
+        self.vlans_set = set([int(k) for k, v in self.vlans.items()])
+        return len(self.vlans)
 
-        if 'l3_int' in scan_to_perform:
-            # Get l3 interfaces
+    def _get_l3_int(self):
+        """Get l3 interfaces"""
+        if 'interfaces_ip' not in self.config_derived:
             self.interfaces_ip = self.session.get_interfaces_ip()
-            self.arp_table = self.session.get_arp_table()
+        self.arp_table = self.session.get_arp_table()
+        return len(self.interfaces_ip) + len(self.arp_table)
 
-        if 'local_admins' in scan_to_perform:
-            # Get local admins
+    def _get_local_admins(self):
+        """Get local admins"""
+        if 'local_admins' not in self.config_derived:
             self.local_admins = self.session.get_users()
+        return len(self.local_admins)
 
-        if 'inventory' in scan_to_perform:
-            # Get inventory
-            self.inventory = self._parse_inventory()
+    def _get_inventory(self):
+        """Get inventory"""
+        self.inventory = self._parse_inventory()
+        return len(self.inventory)
 
     def _parse_inventory(self):
         command = "show inventory"
         showinventory = self.session.cli([command])[command]
+        self._check_supported(command, showinventory)
 
         fsmpath = os.path.dirname(os.path.realpath(
             __file__)) + "/textfsm_templates/show_inventory.textfsm"
@@ -405,8 +1416,7 @@ class Switch(Device):
                 re_table = textfsm.TextFSM(fsmfile)
                 fsm_results = re_table.ParseTextToDicts(showinventory)
             except Exception as e:
-                self.logger.error("Textfsm parsing error %s", e)
-                return {}
+                raise ModuleNotSupported(f"Show inventory parsing failed: {e}") from e
 
         result = {}
         for i in fsm_results:
@@ -419,20 +1429,20 @@ class Switch(Device):
         return result
 
     def _parse_show_interface(self):
-        """Parse output of show inteface with greater data collection than napalm"""
-        self.session.device.write_channel("show interface")
-        self.session.device.write_channel("\n")
-        self.session.device.timeout = 30  # Could take ages...
-        showint = self.session.device.read_until_prompt(max_loops=3000)
+        """Parse output of show inteface with greater data collection than napalm.
+        The collection profile decides which lines are sent by the device and parsed."""
+        profile = self.COLLECTION_PROFILES[self.collection_profile]
+        command = self._show_interfaces_command()
+        showint = self._send_command(command)
+        self._check_supported(command, showint)
         fsmpath = os.path.dirname(os.path.realpath(
-            __file__)) + "/textfsm_templates/show_interface.textfsm"
+            __file__)) + "/textfsm_templates/" + profile['interface_template']
         with open(fsmpath, 'r') as fsmfile:
             try:
                 re_table = textfsm.TextFSM(fsmfile)
                 fsm_results = re_table.ParseTextToDicts(showint)
             except Exception as e:
-                self.logger.error("Show interface parsing failed %s", e)
-                return None
+                raise ModuleNotSupported(f"Show interface parsing failed: {e}") from e
 
         for intf in fsm_results:
             if intf['name'] in self.interfaces:
@@ -465,12 +1475,38 @@ class Switch(Device):
                 self.logger.info(
                     "Creating new interface %s not found previously", intf['name'])
 
+        return len(fsm_results)
+
+    def _show_interfaces_command(self) -> str:
+        """Return show interfaces, filtered for the collection profile"""
+        # Unfiltered it is the same command as NAPALM's get_interfaces() so the output is shared
+        command = "show interfaces"
+        interface_filter = self.COLLECTION_PROFILES[self.collection_profile]['interface_filter']
+        if interface_filter is not None:
+            command += f" | include {interface_filter}"
+
+        return command
+
+    def _add_neighbor(self, local_port: str, neigh_data: dict) -> None:
+        """Append a neighbor dict to an interface, adding the interface if the config does not have it
+
+        :param local_port: Name of the local interface
+        :type local_port: str
+        :param neigh_data: Neighbor dictionary
+        :type neigh_data: dict
+        """
+        if local_port not in self.interfaces:
+            # e.g. Serial or module ports only in show interfaces, which now runs later
+            self.add_interface(Interface(name=local_port))
+
+        local_int = self.interfaces[local_port]
+        if neigh_data not in local_int.neighbors:
+            local_int.neighbors.append(neigh_data)
+
     def _parse_cdp_neighbors(self):
         """Ask for and parse CDP neighbors"""
-        self.session.device.write_channel("show cdp neigh detail")
-        self.session.device.write_channel("\n")
-        self.session.device.timeout = 30  # Could take ages...
-        neighdetail = self.session.device.read_until_prompt(max_loops=3000)
+        neighdetail = self._send_command("show cdp neighbors detail")
+        self._check_supported("show cdp neighbors detail", neighdetail)
         fsmpath = os.path.dirname(os.path.realpath(
             __file__)) + "/textfsm_templates/show_cdp_neigh_detail.textfsm"
         with open(fsmpath, 'r') as fsmfile:
@@ -478,8 +1514,7 @@ class Switch(Device):
                 re_table = textfsm.TextFSM(fsmfile)
                 fsm_results = re_table.ParseTextToDicts(neighdetail)
             except Exception as e:
-                self.logger.error("Show cdp neighbor parsing failed %s", e)
-                return None
+                raise ModuleNotSupported(f"Show cdp neighbor parsing failed: {e}") from e
 
         for result in fsm_results:
             self.logger.debug("Found CDP neighbor %s IP %s local int %s, remote int %s",
@@ -494,17 +1529,18 @@ class Switch(Device):
             neigh_data = {'hostname': nei['dest_host'],
                           'ip': address,
                           'platform': nei['platform'],
-                          'remote_int': nei['remote_port']
+                          'remote_int': nei['remote_port'],
+                          'capabilities': nei['capabilities']
                           }
 
-            self.interfaces[nei['local_port']].neighbors.append(neigh_data)
+            self._add_neighbor(nei['local_port'], neigh_data)
+
+        return len(fsm_results)
 
     def _parse_lldp_neighbors(self):
         """Ask for and parse LLDP neighbors"""
-        self.session.device.write_channel("show lldp neigh detail")
-        self.session.device.write_channel("\n")
-        self.session.device.timeout = 30  # Could take ages...
-        neighdetail = self.session.device.read_until_prompt(max_loops=3000)
+        neighdetail = self._send_command("show lldp neighbors detail")
+        self._check_supported("show lldp neighbors detail", neighdetail)
 
         fsmpath = os.path.dirname(os.path.realpath(
             __file__)) + "/textfsm_templates/show_lldp_neigh_detail.textfsm"
@@ -513,8 +1549,7 @@ class Switch(Device):
                 re_table = textfsm.TextFSM(fsmfile)
                 fsm_results = re_table.ParseTextToDicts(neighdetail)
             except Exception as e:
-                self.logger.error("Show lldp neighbor parsing failed %s", e)
-                return None
+                raise ModuleNotSupported(f"Show lldp neighbor parsing failed: {e}") from e
 
         for result in fsm_results:
             self.logger.debug("Found LLDP neighbor %s IP %s local int %s, remote int %s",
@@ -537,11 +1572,13 @@ class Switch(Device):
             neigh_data = {'hostname': nei['neighbor'],
                           'ip': address,
                           'platform': nei['system_description'],
-                          'remote_int': nei['remote_port_id']
+                          'remote_int': nei['remote_port_id'],
+                          'capabilities': nei['capabilities']
                           }
 
-            self.interfaces[interface_name_expander(
-                nei['local_port'])].neighbors.append(neigh_data)
+            self._add_neighbor(interface_name_expander(nei['local_port']), neigh_data)
+
+        return len(fsm_results)
 
     def _cisco_time_to_dt(self, time: str) -> datetime.datetime:
         """Converts time from now to absolute, starting when Switch object was initialised
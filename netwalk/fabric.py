@@ -19,15 +19,27 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import concurrent.futures
 import ipaddress
 import logging
+import os
+import pickle
+import queue
+import statistics
+import time
 from datetime import datetime as dt
 from socket import timeout as socket_timeout
-from typing import Any, Dict
+from typing import Any, Dict, List, Mapping, Optional, Set, Union
 
 from napalm.base.exceptions import ConnectionException
 from netaddr import EUI
 
-from netwalk.device import Device, Switch
+from netwalk.bastion import BastionPool
+from netwalk.cache import CapabilityCache, ConnectionProfileCache
+from netwalk.coordinator import DiscoveryCoordinator, StatusSnapshot
+from netwalk.device import DeadlineExceeded, Device, Switch
 from netwalk.interface import Interface
+from netwalk.libs import (detect_platform, normalize_hostname, probe_tcp_ports,
+                          read_ssh_banners)
+from netwalk.registry import DeviceRegistry
+from netwalk.scope import ScopePolicy
 
 
 class Fabric():
@@ -39,27 +51,132 @@ class Fabric():
     #: A dictionary of {hostname: Switch}
     switches: Dict[str, Switch]
 
-    # TODO: Dict value can be either str or dt, fix
-    #: Dictionary of {hostname: status} where status can be "Queued", "Failed" or a datetime of when the discovery was completed.
-    #: It is set and used by init_from_seed_device()
-    discovery_status: Dict[str, Any]
+    #: Owns the discovery state of every device, see discovery_status
+    coordinator: DiscoveryCoordinator
 
     #: Calculated global mac address table across all switches in the fabric.
     #: Generated by _recalculate_macs().
     #: Dictionary of {netaddr.EUI (mac address object): attribute_dictionary}. Contains pointer to Interface object where the mac is.
     mac_table: Dict[EUI, dict]
 
-    def __init__(self):
-        """Init module"""
+    #: Differences found against the previous Fabric passed as warm_start to init_from_seed_device().
+    #: Dictionary of {'new': set of hostnames, 'vanished': set of hostnames}
+    warm_start_diff: Optional[Dict[str, Set[str]]]
+
+    #: Remembers which login method worked for each device, optional
+    connection_cache: Optional[ConnectionProfileCache]
+
+    #: Remembers which scan modules each device and platform does not support, optional
+    capability_cache: Optional[CapabilityCache]
+
+    #: Bastion every SSH session is tunnelled through, optional
+    bastion: Optional[BastionPool]
+
+    @property
+    def discovery_status(self) -> Mapping[Any, str]:
+        """
+        Dictionary of {management address: status}, status being one of
+        "Queued", "Connecting", "Collected", "Failed", "Timeout", "Unreachable",
+        "Skipped" or "Duplicate". It is a snapshot, later changes do not show in it.
+        Changing its items is deprecated, use coordinator.transition()
+        """
+        return StatusSnapshot(self.coordinator)
+
+    @discovery_status.setter
+    def discovery_status(self, value: Mapping[Any, str]) -> None:
+        self.coordinator.load(value)
+
+    @property
+    def devices(self) -> DeviceRegistry:
+        """Dictionary of {hostname: Device}, also indexed by other names, addresses, serial and MACs"""
+        return self._devices
+
+    @devices.setter
+    def devices(self, value: Dict[str, Device]) -> None:
+        self._devices = value if isinstance(value, DeviceRegistry) else DeviceRegistry(value)
+
+    def __setstate__(self, state):
+        # Snapshots taken before devices were indexed have a plain dictionary
+        if 'devices' in state:
+            state['_devices'] = DeviceRegistry(state.pop('devices'))
+        if 'discovery_status' in state:
+            state['coordinator'] = DiscoveryCoordinator(state.pop('discovery_status'))
+        state.setdefault('_pending_links', {})
+        state.setdefault('_discovering', set())
+        state.setdefault('_identified', set())
+        self.__dict__.update(state)
+
+    #: Seconds between checks for neighbors reported by running discoveries
+    NEIGHBOR_POLL_INTERVAL = 0.1
+    #: Completed discoveries needed before slow devices are hedged
+    HEDGE_MIN_SAMPLES = 10
+
+    def __init__(self,
+                 connection_cache: Optional[ConnectionProfileCache] = None,
+                 capability_cache: Optional[CapabilityCache] = None,
+                 bastion: Optional[BastionPool] = None):
+        """Init module
+
+        :param connection_cache: Cache of working login methods, defaults to None
+        :type connection_cache: netwalk.cache.ConnectionProfileCache, optional
+        :param capability_cache: Cache of scan modules to skip, defaults to None
+        :type capability_cache: netwalk.cache.CapabilityCache, optional
+        :param bastion: Bastion to reach the devices through, defaults to None
+        :type bastion: netwalk.bastion.BastionPool, optional
+        """
         self.logger = logging.getLogger(__name__)
         self.devices = {}
-        self.discovery_status = {}
+        self.coordinator = DiscoveryCoordinator()
         self.mac_table = {}
+        self.warm_start_diff = None
+        # {neighbor name as reported, its first 40 characters and short name: set of Interfaces}
+        # whose neighbor dictionaries point at a device not known or still being discovered
+        self._pending_links: Dict[str, Set[Interface]] = {}
+        # Devices whose discovery is running, their interfaces cannot be linked to yet
+        self._discovering: Set[Device] = set()
+        # Devices being discovered known not to be the same as any other, see _original_of()
+        self._identified: Set[Device] = set()
+        self.connection_cache = connection_cache
+        self.capability_cache = capability_cache
+        self.bastion = bastion
+
+    def save(self, path: Union[str, os.PathLike]) -> None:
+        """
+        Save a snapshot of the fabric to file
+
+        :param path: File to write to
+        :type path: str
+        """
+        with open(path, 'wb') as outfile:
+            pickle.dump(self, outfile)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> 'Fabric':
+        """
+        Load a fabric snapshot written by save()
+
+        :param path: File to read from
+        :type path: str
+        :return: Fabric object
+        :rtype: netwalk.Fabric
+        """
+        with open(path, 'rb') as infile:
+            fabric = pickle.load(infile)
+
+        if not isinstance(fabric, cls):
+            raise TypeError(f"{path} does not contain a Fabric snapshot")
+
+        return fabric
 
     def add_device(self,
                    switch: Switch,
                    credentials,
                    napalm_optional_args=None,
+                   neighbors_callback=None,
+                   device_timeout: Optional[float] = None,
+                   module_timeouts: Optional[Dict[str, float]] = None,
+                   deadline: Optional[float] = None,
+                   scan_options: Optional[dict] = None,
                    **kwargs):
         """
         Try to connect to, and if successful add to fabric, a new Device object
@@ -70,6 +187,16 @@ class Fabric():
         :type credentials: list(tuple(str,str))
         :param napalm_optional_args: Optional_args to pass to NAPALM, as many as you want
         :type napalm_optional_args: list(dict)
+        :param neighbors_callback: Passed to Switch.retrieve_data, called as soon as neighbors are parsed
+        :type neighbors_callback: function, optional
+        :param device_timeout: Maximum seconds to spend collecting data from the device, defaults to None
+        :type device_timeout: float, optional
+        :param module_timeouts: Dictionary of {scan module: maximum seconds}, defaults to None
+        :type module_timeouts: dict(str, float), optional
+        :param deadline: time.monotonic() value after which the device is abandoned, defaults to None
+        :type deadline: float, optional
+        :param scan_options: Passed to Switch.retrieve_data, defaults to None
+        :type scan_options: dict, optional
         """
 
         if napalm_optional_args is None:
@@ -77,27 +204,69 @@ class Fabric():
 
         assert isinstance(switch, Device)
 
-        self.discovery_status[switch.mgmt_address] = "Queued"
+        self.coordinator.transition(switch.mgmt_address, DiscoveryCoordinator.QUEUED)
         switch.promote_to_switch()
+        switch.device_timeout = device_timeout
+        switch.module_timeouts = {} if module_timeouts is None else module_timeouts
+        switch.deadline = deadline
+        if self.capability_cache is not None:
+            switch.capability_cache = self.capability_cache
+            cached = self.capability_cache.get_platform(switch.mgmt_address)
+            # It worked before, more reliable than a guess
+            if cached is not None and switch.platform_source in ('default', 'neighbor', 'banner'):
+                switch.platform = cached
+                switch.platform_source = 'cache'
+        if self.bastion is not None:
+            switch.bastion = self.bastion
 
         # Check if Switch is already in fabric.
         # Hostname is not enough because CDP stops at 40 characters and it might have been added
-        # with a cut-off hostname
-        if switch.hostname[:40] in self.devices:
+        # with a cut-off hostname. Other threads add devices too, check and insert at once
+        if self.devices.setdefault(switch.hostname[:40], switch) is not switch:
             return switch
-        else:
-            self.devices[switch.hostname[:40]] = switch
 
         self.logger.info("Creating switch %s", switch.mgmt_address)
-        connected = False
-        for optional_arg in napalm_optional_args:
-            if connected:
-                break
+        self._login(switch, credentials, napalm_optional_args, neighbors_callback, scan_options)
+        self.logger.info("Finished discovery of switch %s",
+                         switch.hostname)
+
+        return switch
+
+    def _login(self, switch: Switch, credentials, napalm_optional_args,
+               neighbors_callback=None, scan_options: Optional[dict] = None) -> None:
+        """
+        Try every login method on a Switch until one works and data is retrieved
 
-            for cred in credentials:
+        :param switch: Switch to log into
+        :type switch: netwalk.Switch
+        :param credentials: List of (username, password) tuples to try
+        :type credentials: list(tuple(str,str))
+        :param napalm_optional_args: Optional_args to pass to NAPALM
+        :type napalm_optional_args: list(dict)
+        :param neighbors_callback: Passed to Switch.retrieve_data
+        :type neighbors_callback: function, optional
+        :param scan_options: Passed to Switch.retrieve_data, defaults to None
+        :type scan_options: dict, optional
+        """
+        if self.connection_cache is not None:
+            attempts = self.connection_cache.order(switch.mgmt_address,
+                                                   credentials,
+                                                   napalm_optional_args)
+        else:
+            attempts = [(optional_arg, cred)
+                        for optional_arg in napalm_optional_args
+                        for cred in credentials]
+
+        self.coordinator.transition(switch.mgmt_address, DiscoveryCoordinator.CONNECTING)
+        connected = False
+        # device_timeout covers all login attempts together
+        with switch.time_budget():
+            for optional_arg, cred in attempts:
                 try:
                     switch.retrieve_data(cred[0], cred[1],
-                                         napalm_optional_args=optional_arg)
+                                         napalm_optional_args=optional_arg,
+                                         scan_options=scan_options,
+                                         neighbors_callback=neighbors_callback)
                     connected = True
                     self.logger.info(
                         "Connection to switch %s successful", switch.mgmt_address)
@@ -106,45 +275,134 @@ class Fabric():
                     self.logger.warning(
                         "Login failed, trying next method if available")
                     continue
+                except DeadlineExceeded as e:
+                    if switch.facts is None:
+                        raise
+
+                    self.logger.error(
+                        "%s ran out of time (%s), keeping partial data", switch.hostname, e)
+                    self.coordinator.transition(switch.mgmt_address, DiscoveryCoordinator.TIMEOUT)
+                    connected = True
+                    break
 
         if not connected:
             self.logger.error(
                 "Could not login with any of the specified methods")
+            if self.connection_cache is not None:
+                self.connection_cache.invalidate(switch.mgmt_address)
             raise ConnectionError(
                 "Could not log in with any of the specified methods")
 
-        self.logger.info("Finished discovery of switch %s",
-                         switch.hostname)
+        if self.connection_cache is not None:
+            self.connection_cache.record_success(switch.mgmt_address,
+                                                 optional_arg,
+                                                 cred,
+                                                 switch.login_time)
 
-        return switch
+        if self.capability_cache is not None and switch.mgmt_address is not None:
+            self.capability_cache.record_platform(switch.mgmt_address, switch.platform)
+
+        # Facts, addresses and MACs are known now
+        self.devices.reindex(switch)
+        # Unless it timed out or was dropped meanwhile
+        self.coordinator.transition(switch.mgmt_address, DiscoveryCoordinator.COLLECTED,
+                                    expected=[DiscoveryCoordinator.CONNECTING])
+
+        failed = [module for module, result in switch.scan_results.items()
+                  if result['status'] not in ('ok', 'skipped')]
+        if failed:
+            self.logger.warning("Could not collect %s from %s",
+                                ", ".join(failed), switch.hostname)
 
     def init_from_seed_device(self,
                               seed_hosts: str,
                               credentials: list,
                               napalm_optional_args=None,
                               parallel_threads=1,
-                              neigh_validator_callback=None):
+                              neigh_validator_callback=None,
+                              warm_start: Optional[Union['Fabric', str, os.PathLike]] = None,
+                              preflight_timeout: Optional[float] = None,
+                              device_timeout: Optional[float] = None,
+                              module_timeouts: Optional[Dict[str, float]] = None,
+                              deadline: Optional[float] = None,
+                              hedge: bool = False,
+                              scan_options: Optional[dict] = None,
+                              scope: Optional[ScopePolicy] = None):
         """
         Initialise entire fabric from a seed device.
 
+        Neighbors are queued for discovery as soon as a device has parsed
+        its CDP/LLDP tables, while it is still collecting the rest of its data.
+        Links between two devices are made as soon as both have completed.
+
+        If warm_start is passed, every Switch known to that Fabric is queued
+        straight away together with the seeds instead of waiting to be found
+        hop by hop. Differences are stored in warm_start_diff.
+
+        If preflight_timeout is set, the SSH/telnet ports of every device are
+        probed before logging in. Devices with no open port are marked
+        "Unreachable" and only login methods whose port is open are tried.
+
+        device_timeout and module_timeouts limit the time spent on each device,
+        deadline limits the whole discovery. Devices running out of time keep
+        whatever data was collected and are marked "Timeout".
+        With hedge=True, a device still running after the 95th percentile of
+        discovery times gets a second attempt on a new session and the
+        first one to finish wins.
+
+        Neighbors out of the scope policy, if any, are added to the fabric
+        without being discovered, like those neigh_validator_callback rejects.
+
         :param seed_hosts: List of IP or hostname of seed devices
         :type seed_hosts: str
         :param credentials: List of (username, password) tuples to try
         :type credentials: list
         :param napalm_optional_args: Optional_args to pass to NAPALM for telnet
         :type napalm_optional_args: list(dict(str, str)), optional
-        :param neigh_validator_callback: Function accepting a Device object. Return True if device should be actively discovered
+        :param neigh_validator_callback: Function accepting a hostname. Return True if device should be actively discovered
         :type neigh_validator_callback: function
+        :param warm_start: Previous Fabric or path to a snapshot written by Fabric.save(), defaults to None
+        :type warm_start: netwalk.Fabric or str, optional
+        :param preflight_timeout: Seconds to wait for TCP answers before logging in, defaults to None (no probe)
+        :type preflight_timeout: float, optional
+        :param device_timeout: Maximum seconds to spend collecting data from one device, defaults to None
+        :type device_timeout: float, optional
+        :param module_timeouts: Dictionary of {scan module: maximum seconds}, defaults to None
+        :type module_timeouts: dict(str, float), optional
+        :param deadline: Maximum seconds for the whole discovery, defaults to None
+        :type deadline: float, optional
+        :param hedge: Retry slow devices in parallel, defaults to False
+        :type hedge: bool, optional
+        :param scan_options: Passed to Switch.retrieve_data, e.g. {'from_config': True}, defaults to None
+        :type scan_options: dict, optional
+        :param scope: Which neighbors to discover, checked before neigh_validator_callback, defaults to all
+        :type scope: netwalk.ScopePolicy, optional
         """
 
         if napalm_optional_args is None:
             napalm_optional_args = [None]
 
+        if preflight_timeout is not None and self.bastion is not None:
+            self.logger.info("Devices are behind a bastion, skipping pre-flight probe")
+            preflight_timeout = None
+
+        previous = None
+        if warm_start is not None:
+            previous = warm_start if isinstance(
+                warm_start, Fabric) else Fabric.load(warm_start)
+            seed_hosts = self._warm_start_seeds(seed_hosts, previous)
+
         for i in seed_hosts:
-            if isinstance(i, Device):
-                self.discovery_status[i.mgmt_address] = "Queued"
-            else:
-                self.discovery_status[ipaddress.ip_address(i)] = "Queued"
+            self.coordinator.transition(i.mgmt_address if isinstance(i, Device) else ipaddress.ip_address(i),
+                                        DiscoveryCoordinator.QUEUED)
+
+        # Switches put themselves here from worker threads as soon as their
+        # neighbors are known, the loop below picks them up
+        neighbor_queue = queue.Queue()
+
+        if deadline is not None:
+            deadline = time.monotonic() + deadline
+        deadline_reached = False
 
         # We can use a with statement to ensure threads are cleaned up promptly
         with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_threads) as executor:
@@ -152,31 +410,205 @@ class Fabric():
             self.logger.debug("Adding seed hosts to loop")
 
             future_switch_data = {}
-            for i in seed_hosts:
-                if isinstance(i, Device):
-                    switch = i
+            future_optional_args = {}
+            # {Device: time.monotonic() when its discovery started}
+            started = {}
+            # Seconds taken by each completed discovery
+            durations = []
+            # {hedge future: (original future, hedge Switch)}
+            hedges = {}
+            # {mgmt address or normalized hostname: future} of discoveries not finished
+            queued = {}
+            # Devices found to be the same as another one, their discovery is dropped
+            merged = set()
+
+            def run(switch, optional_args):
+                started[switch] = time.monotonic()
+                return self.add_device(switch,
+                                       credentials,
+                                       optional_args,
+                                       neighbor_queue.put,
+                                       device_timeout,
+                                       module_timeouts,
+                                       deadline,
+                                       scan_options)
+
+            def submit(switches):
+                if deadline_reached:
+                    for switch in switches:
+                        self._give_up(switch)
+                    return
+
+                if preflight_timeout is None:
+                    reachable = [(switch, napalm_optional_args)
+                                 for switch in switches]
+                else:
+                    reachable = self._preflight(switches,
+                                                napalm_optional_args,
+                                                preflight_timeout)
+
+                for switch, optional_args in reachable:
+                    if isinstance(switch, Switch):
+                        # Aborted in an earlier discovery
+                        switch.clear_abort()
+                    self._discovering.add(switch)
+                    fut = executor.submit(run, switch, optional_args)
+                    future_switch_data[fut] = switch
+                    future_optional_args[fut] = optional_args
+                    for key in (switch.mgmt_address, normalize_hostname(switch.hostname)):
+                        if key is not None:
+                            queued.setdefault(key, fut)
+
+            def drop(duplicate, original, fut=None):
+                """Stop discovering a device that is the same as another one"""
+                merged.add(duplicate)
+                self._merge_alias(duplicate, original)
+                if fut is not None and fut.cancel():
+                    future_switch_data.pop(fut)
+                    future_optional_args.pop(fut)
                 else:
-                    switch = Device(i)
+                    duplicate.abort(f"Same device as {original.hostname}")
+
+            def identify(swobject):
+                """
+                Check a device that just logged in is not known under another name or address.
+                If it is, drop it and return False, otherwise drop its own duplicates
+                """
+                if swobject in self._identified:
+                    return True
+
+                original = self._original_of(swobject)
+                if original is not None:
+                    drop(swobject, original)
+                    return False
+
+                self._identified.add(swobject)
+                for other in self.devices.same_device(swobject):
+                    if other in self._discovering and other not in merged:
+                        drop(other, swobject)
+
+                for key in self.devices.identities(swobject):
+                    fut = queued.get(key)
+                    other = future_switch_data.get(fut)
+                    if other is not None and other is not swobject and other not in merged:
+                        drop(other, swobject, fut)
+
+                return True
+
+            def completed(swobject):
+                if not identify(swobject):
+                    return
+
+                swobject.discovery_status = dt.now()
+                self.logger.info(
+                    "Completed discovery of %s", swobject.hostname)
+
+                self._discovering.discard(swobject)
+                self._link_device(swobject)
 
-                key = executor.submit(
-                    self.add_device,
-                    switch,
-                    credentials,
-                    napalm_optional_args,
-                    discovery_status="Queued")
+                if previous is not None:
+                    self._compare_neighbors(swobject, previous)
 
-                value = i
+                # Neighbors have most likely been queued already through
+                # the callback, this catches devices that never called it
+                submit(self._evaluate_neighbors(
+                    swobject, neigh_validator_callback, scope))
 
-                future_switch_data[key] = value
+            submit([i if isinstance(i, Device) else Device(i)
+                    for i in seed_hosts])
 
             while future_switch_data:
-                self.logger.info(
-                    "Connecting to switches, %d to go", len(future_switch_data))
-                done, _ = concurrent.futures.wait(future_switch_data,
+                done, _ = concurrent.futures.wait(list(future_switch_data) + list(hedges),
+                                                  timeout=self.NEIGHBOR_POLL_INTERVAL,
                                                   return_when=concurrent.futures.FIRST_COMPLETED)
 
+                now = time.monotonic()
+                if deadline is not None and now >= deadline and not deadline_reached:
+                    self.logger.error(
+                        "Discovery deadline reached, abandoning queued devices")
+                    deadline_reached = True
+                    for fut, switch in list(future_switch_data.items()):
+                        if fut.cancel():
+                            future_switch_data.pop(fut)
+                            self._give_up(switch)
+
+                while True:
+                    try:
+                        swobject = neighbor_queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    # Facts are known by now, no point in collecting the rest from a duplicate
+                    if swobject not in merged and identify(swobject):
+                        submit(self._evaluate_neighbors(
+                            swobject, neigh_validator_callback, scope))
+
+                if hedge and len(durations) >= self.HEDGE_MIN_SAMPLES:
+                    slow_after = statistics.quantiles(durations, n=20)[-1]
+                    hedged = {v[0] for v in hedges.values()}
+                    for fut, switch in list(future_switch_data.items()):
+                        if fut in hedged or switch not in started or fut.done():
+                            continue
+
+                        if now - started[switch] > slow_after:
+                            self.logger.info("%s is slower than %.1fs, starting a second discovery",
+                                             switch.hostname, slow_after)
+                            hedge_switch = Switch(switch.mgmt_address,
+                                                  hostname=switch.hostname,
+                                                  platform=switch.platform,
+                                                  platform_source=switch.platform_source,
+                                                  device_timeout=device_timeout,
+                                                  module_timeouts=module_timeouts,
+                                                  deadline=deadline,
+                                                  capability_cache=self.capability_cache,
+                                                  bastion=self.bastion)
+                            hedge_fut = executor.submit(self._login,
+                                                        hedge_switch,
+                                                        credentials,
+                                                        future_optional_args[fut],
+                                                        None,
+                                                        scan_options)
+                            hedges[hedge_fut] = (fut, hedge_switch)
+
+                if done:
+                    self.logger.info(
+                        "Connecting to switches, %d to go", len(future_switch_data) - len(done))
+
                 for fut in done:
+                    if fut in hedges:
+                        original, hedge_switch = hedges.pop(fut)
+                        if original not in future_switch_data or fut.exception() is not None:
+                            continue
+
+                        switch = future_switch_data.pop(original)
+                        future_optional_args.pop(original)
+                        self._discovering.discard(switch)
+                        switch.abort("Second discovery finished first")
+                        self._replace_device(switch, hedge_switch)
+                        durations.append(now - started.pop(switch))
+                        completed(hedge_switch)
+                        continue
+
+                    if fut not in future_switch_data:
+                        # Already replaced by its hedge
+                        continue
+
                     hostname = future_switch_data.pop(fut)
+                    future_optional_args.pop(fut)
+                    if hostname in started:
+                        durations.append(now - started.pop(hostname))
+
+                    for hedge_fut, (original, hedge_switch) in list(hedges.items()):
+                        if original == fut:
+                            hedges.pop(hedge_fut)
+                            # Still waiting for a worker, or already logging in
+                            if not hedge_fut.cancel():
+                                hedge_switch.abort("First discovery finished first")
+
+                    if hostname in merged:
+                        # The coordinator kept the aborted discovery from changing its state
+                        continue
+
                     self.logger.debug("Got data for %s", hostname)
                     try:
                         swobject = None
@@ -187,96 +619,359 @@ class Fabric():
 
                         self.logger.error(
                             '%r generated an exception: %s', hostname, exc)
-                        self.discovery_status[hostname] = "Failed"
+                        self.coordinator.transition(
+                            hostname.mgmt_address if isinstance(hostname, Device) else hostname,
+                            DiscoveryCoordinator.TIMEOUT if isinstance(exc, DeadlineExceeded)
+                            else DiscoveryCoordinator.FAILED)
 
+                        self._discovering.discard(hostname)
                         if hostname == "":
                             # all hope is lost
                             continue
 
-                        for swdata in self.devices.values():
-                            if isinstance(hostname, Device):
-                                swobject = hostname
-                            else:
-                                try:
-                                    if ipaddress.ip_address(hostname) == swdata.mgmt_address:
-                                        swobject = swdata
-                                        break
-                                except ValueError:
-                                    # In case hostname is not an IP
-                                    pass
-
-                            if swdata.hostname == hostname:
-                                swobject = swdata
-                                break
+                        if isinstance(hostname, Device):
+                            swobject = hostname
+                        else:
+                            swobject = self.devices.by_address(hostname) or \
+                                self.devices.resolve(str(hostname))
+                            if swobject is None:
+                                continue
 
                         self.logger.info(
                             "Demote %s back to Device from Switch", swobject.hostname)
                         swobject.__class__ = Device
                         swobject.discovery_status = dt.now()
+                        self.devices.reindex(swobject)
+                        self._discovering.discard(swobject)
+                        self._link_device(swobject)
                     else:
-                        swobject.discovery_status = dt.now()
+                        completed(swobject)
+
+        if previous is not None:
+            self._compare_devices(previous)
+
+        if self.connection_cache is not None:
+            self.connection_cache.save()
+
+        if self.capability_cache is not None:
+            self.capability_cache.save()
+
+        self._identified = set()
+
+        # Links were resolved as devices completed
+        self.logger.info("Discovery complete, placing mac addresses")
+        self._recalculate_macs()
+
+    def _warm_start_seeds(self, seed_hosts, previous: 'Fabric') -> list:
+        """
+        Add every Switch of a previous Fabric to the list of seed hosts
+
+        :param seed_hosts: List of IP or Device objects
+        :type seed_hosts: list
+        :param previous: Previously discovered Fabric
+        :type previous: netwalk.Fabric
+        :return: Seed list including previously known switches
+        :rtype: list
+        """
+        previous_switches = {swdata.mgmt_address: swdata for swdata in previous.devices.values()
+                             if isinstance(swdata, Switch) and swdata.mgmt_address is not None}
+
+        seeds = []
+        for i in seed_hosts:
+            if isinstance(i, Device):
+                seeds.append(i)
+                previous_switches.pop(i.mgmt_address, None)
+                continue
+
+            # Reuse the known hostname so the device keeps its key in self.devices
+            swdata = previous_switches.pop(ipaddress.ip_address(i), None)
+            if swdata is None:
+                seeds.append(i)
+            else:
+                seeds.append(Device(swdata.mgmt_address,
+                             hostname=swdata.hostname))
+
+        for swdata in previous_switches.values():
+            self.logger.debug("Warm start, queueing %s", swdata.hostname)
+            seeds.append(Device(swdata.mgmt_address,
+                         hostname=swdata.hostname))
+
+        return seeds
+
+    def _compare_neighbors(self, swobject: Switch, previous: 'Fabric') -> None:
+        """
+        Log neighbors that appeared or disappeared since the previous discovery
+
+        :param swobject: Freshly discovered Switch
+        :type swobject: netwalk.Switch
+        :param previous: Previously discovered Fabric
+        :type previous: netwalk.Fabric
+        """
+        old_switch = previous.devices.resolve(swobject.hostname)
+        if not isinstance(old_switch, Switch):
+            return
+
+        def neighbor_names(device):
+            names = set()
+            for intdata in device.interfaces.values():
+                for nei in intdata.neighbors:
+                    if isinstance(nei, Interface):
+                        names.add(nei.device.hostname)
+                    else:
+                        names.add(nei['hostname'])
+            return names
+
+        old_neighbors = neighbor_names(old_switch)
+        new_neighbors = neighbor_names(swobject)
+
+        for hostname in new_neighbors - old_neighbors:
+            self.logger.info("New neighbor %s of %s",
+                             hostname, swobject.hostname)
+
+        for hostname in old_neighbors - new_neighbors:
+            self.logger.info("Neighbor %s of %s has vanished",
+                             hostname, swobject.hostname)
+
+    def _compare_devices(self, previous: 'Fabric') -> None:
+        """
+        Fill warm_start_diff with switches added or lost since the previous discovery
+
+        :param previous: Previously discovered Fabric
+        :type previous: netwalk.Fabric
+        """
+        old_switches = {v.hostname for v in previous.devices.values()
+                        if isinstance(v, Switch)}
+        new_switches = {v.hostname for v in self.devices.values()
+                        if isinstance(v, Switch)}
+
+        self.warm_start_diff = {'new': new_switches - old_switches,
+                                'vanished': old_switches - new_switches}
+
+        for hostname in self.warm_start_diff['vanished']:
+            self.logger.warning("Switch %s has vanished since last discovery", hostname)
+
+    def _original_of(self, swobject: Switch) -> Optional[Device]:
+        """
+        Device already logged into that is the same as a Switch which just logged in,
+        recognised by serial number, interface MAC or normalized hostname
+
+        :param swobject: Switch whose facts are known
+        :type swobject: netwalk.Switch
+        :return: The other Device, None if there is none
+        :rtype: netwalk.Device
+        """
+        for other in self.devices.same_device(swobject):
+            if other in self._identified or (isinstance(other, Switch) and other.facts is not None
+                                             and other not in self._discovering):
+                return other
+
+        return None
+
+    def _merge_alias(self, duplicate: Device, original: Device) -> None:
+        """
+        Make a Device found under another name or address an alias of the original one:
+        it is removed from self.devices and its names and address are added to original.aliases
+
+        :param duplicate: Device to drop
+        :type duplicate: netwalk.Device
+        :param original: Device to keep
+        :type original: netwalk.Device
+        """
+        self.logger.info("%s (%s) is the same device as %s, dropping it",
+                         duplicate.hostname, duplicate.mgmt_address, original.hostname)
+        self.coordinator.transition(duplicate.mgmt_address, DiscoveryCoordinator.DUPLICATE)
+        self._discovering.discard(duplicate)
+
+        keys = self.devices.keys_of(duplicate)
+        for key in keys:
+            del self.devices[key]
+
+        aliases = {str(x) for x in keys | {duplicate.hostname} if x is not None}
+        if duplicate.mgmt_address is not None:
+            aliases.add(duplicate.mgmt_address)
+        original.aliases = getattr(original, 'aliases', set()) | aliases
+        self.devices.reindex(original)
+
+        if original not in self._discovering:
+            # References to the alias can be linked now
+            self._link_pending(original)
+
+    def _give_up(self, device: Device) -> None:
+        """Add a device to the fabric without discovering it because time is up"""
+        self.logger.warning("Not discovering %s, out of time", device.hostname)
+        self.coordinator.transition(device.mgmt_address, DiscoveryCoordinator.TIMEOUT)
+        self._discovering.discard(device)
+        if device.hostname not in self.devices:
+            self.devices[device.hostname] = device
+            self._link_pending(device)
+
+    def _replace_device(self, old: Device, new: Device) -> None:
+        """Put a new object in place of an old one in self.devices"""
+        self.devices.replace(old, new)
+
+    @staticmethod
+    def _login_port(optional_arg: Optional[dict]) -> int:
+        """TCP port NAPALM will connect to with these optional args"""
+        optional_arg = {} if optional_arg is None else optional_arg
+        default = 23 if optional_arg.get('transport') == 'telnet' else 22
+        return int(optional_arg.get('port', default))
+
+    def _preflight(self, switches: list, napalm_optional_args: list, timeout: float) -> list:
+        """
+        Probe login ports of many devices at once, mark the ones not answering as "Unreachable"
+
+        :param switches: Devices to probe
+        :type switches: list(netwalk.Device)
+        :param napalm_optional_args: Optional_args that will be tried for each device
+        :type napalm_optional_args: list(dict)
+        :param timeout: Seconds to wait for answers
+        :type timeout: float
+        :return: List of (Device, optional args whose port is open)
+        :rtype: list(tuple(netwalk.Device, list(dict)))
+        """
+        if not switches:
+            return []
+
+        start = time.monotonic()
+        ports = {self._login_port(i) for i in napalm_optional_args}
+        open_ports = probe_tcp_ports({switch.mgmt_address for switch in switches
+                                      if switch.mgmt_address is not None},
+                                     ports, timeout)
+
+        # Devices of unknown platform answering on SSH tell it in their banner,
+        # read within what is left of the timeout
+        banners = {}
+        ssh_ports = {self._login_port(i) for i in napalm_optional_args
+                     if (i or {}).get('transport', 'ssh') == 'ssh'}
+        for port in ssh_ports:
+            unknown = {switch.mgmt_address for switch in switches
+                       if switch.platform_source in (None, 'default')
+                       and switch.mgmt_address not in banners
+                       and port in open_ports.get(switch.mgmt_address, set())}
+            remaining = timeout - (time.monotonic() - start)
+            if unknown and remaining > 0:
+                banners.update(read_ssh_banners(unknown, port, remaining))
+
+        reachable = []
+        for switch in switches:
+            platform = detect_platform(banners.get(switch.mgmt_address))
+            if platform is not None and switch.platform_source in (None, 'default'):
+                self.logger.debug("%s looks like %s from its SSH banner",
+                                  switch.mgmt_address, platform)
+                switch.platform = platform
+                switch.platform_source = 'banner'
+
+            available = open_ports.get(switch.mgmt_address, set())
+            optional_args = [i for i in napalm_optional_args
+                             if self._login_port(i) in available]
+
+            if optional_args:
+                reachable.append((switch, optional_args))
+                continue
+
+            self.logger.warning("%s is unreachable, not logging in",
+                                switch.mgmt_address)
+            self.coordinator.transition(switch.mgmt_address, DiscoveryCoordinator.UNREACHABLE)
+            switch.discovery_status = "Unreachable"
+            if switch.hostname not in self.devices:
+                self.devices[switch.hostname] = switch
+                self._link_pending(switch)
+
+        return reachable
+
+    def _is_new_neighbor(self, nei: dict) -> bool:
+        """Whether a neighbor record points at a device neither known nor queued"""
+        known = self.devices.resolve(nei['hostname'])
+        if known is None and nei['ip'] is not None:
+            known = self.devices.by_address(nei['ip'])
+
+        return known is None and nei['ip'] not in self.coordinator.snapshot()
+
+    def _evaluate_neighbors(self, swobject: Switch, neigh_validator_callback=None,
+                            scope: Optional[ScopePolicy] = None):
+        """
+        Check neighbors of a Switch and decide which ones to discover.
+        Neighbors out of scope or rejected by the callback are added to the fabric as plain Devices.
+
+        :param swobject: Switch whose neighbors have been parsed
+        :type swobject: netwalk.Switch
+        :param neigh_validator_callback: Function accepting a hostname. Return True if device should be actively discovered
+        :type neigh_validator_callback: function
+        :param scope: Policy of which neighbors to discover, defaults to None
+        :type scope: netwalk.ScopePolicy, optional
+        :return: List of new Devices to discover
+        :rtype: list(netwalk.Device)
+        """
+        # Check every new neighbor against the policy at once
+        in_scope = {}
+        if scope is not None:
+            candidates = [nei for intdata in swobject.interface_list()
+                          for nei in list(intdata.neighbors)
+                          if not isinstance(nei, Interface) and self._is_new_neighbor(nei)]
+            in_scope = {id(nei): verdict
+                        for nei, verdict in zip(candidates, scope.evaluate(candidates))}
+
+        # The device may still be collecting and adding interfaces, walk a copy
+        to_discover = []
+        for intdata in swobject.interface_list():
+            for nei in list(intdata.neighbors):
+                if isinstance(nei, Interface):
+                    continue
+
+                self.logger.debug(
+                    "Evaluating neighbour %s", nei['hostname'])
+                if self._is_new_neighbor(nei):
+
+                    scan = in_scope.get(id(nei), True)
+                    reason = "out of scope"
+                    if scan and neigh_validator_callback is not None:
+                        reason = "callback returned False"
+                        self.logger.debug(
+                            "Passing %s to callback function to check whether to scan", nei['hostname'])
+                        scan = neigh_validator_callback(
+                            nei['hostname'])
+
+                        self.logger.debug(
+                            "Callback function returned %s", scan)
+
+                    if scan:
                         self.logger.info(
-                            "Completed discovery of %s", swobject.hostname)
-                        # Check if it has cdp neighbors
-
-                        for _, intdata in swobject.interfaces.items():
-                            for nei in intdata.neighbors:
-                                self.logger.debug(
-                                    "Evaluating neighbour %s", nei['hostname'])
-                                if nei['hostname'] not in self.devices and nei['ip'] not in self.discovery_status:
-
-                                    scan = True
-                                    if neigh_validator_callback is not None:
-                                        if isinstance(nei, Device):
-                                            self.logger.debug(
-                                                "Passing %s to callback function to check whether to scan", nei.device.hostname)
-                                            scan = neigh_validator_callback(
-                                                nei.device.hostname)
-                                        else:
-                                            self.logger.debug(
-                                                "Passing %s to callback function to check whether to scan", nei['hostname'])
-                                            scan = neigh_validator_callback(
-                                                nei['hostname'])
-
-                                        self.logger.debug(
-                                            "Callback function returned %s", scan)
-
-                                    if scan:
-                                        self.logger.info(
-                                            "Queueing discover for %s", nei['hostname'])
-                                        self.discovery_status[nei['ip']
-                                                              ] = "Queued"
-
-                                        switch = Device(
-                                            nei['ip'], hostname=nei['hostname'])
-
-                                        future_switch_data[executor.submit(self.add_device,
-                                                                           switch,
-                                                                           credentials,
-                                                                           napalm_optional_args)] = switch
-                                    else:
-                                        # Add device to fabric without scanning it
-                                        self.discovery_status[nei['ip']
-                                                              ] = "Skipped"
-
-                                        if nei['hostname'] not in self.devices:
-                                            nei_dev = Device(nei['ip'], hostname=nei['hostname'], facts={
-                                                             'platform': nei['platform'], 'hostname': nei['hostname']})
-                                            self.devices[nei['hostname']
-                                                         ] = nei_dev
-
-                                        remote_int = Interface(
-                                            name=nei['remote_int'])
-                                        nei_dev.add_interface(remote_int)
-
-                                        self.logger.info(
-                                            "Skipping %s, callback returned False", nei['hostname'])
-                                else:
-                                    self.logger.debug(
-                                        "Skipping %s, already discovered", nei['hostname'])
-
-        self.logger.info("Discovery complete, crunching data")
-        self.refresh_global_information()
+                            "Queueing discover for %s", nei['hostname'])
+                        if not self.coordinator.transition(nei['ip'], DiscoveryCoordinator.QUEUED,
+                                                           expected=[None]):
+                            # Queued by someone else meanwhile
+                            continue
+
+                        platform = detect_platform(nei['platform'])
+                        to_discover.append(Device(
+                            nei['ip'], hostname=nei['hostname'], platform=platform,
+                            platform_source=None if platform is None else 'neighbor'))
+                    else:
+                        # Add device to fabric without scanning it
+                        self.coordinator.transition(nei['ip'], DiscoveryCoordinator.SKIPPED,
+                                                    expected=[None])
+
+                        nei_dev = self.devices.resolve(nei['hostname'])
+                        if nei_dev is None:
+                            nei_dev = Device(nei['ip'], hostname=nei['hostname'], facts={
+                                             'platform': nei['platform'], 'hostname': nei['hostname']})
+                            self.devices[nei['hostname']
+                                         ] = nei_dev
+
+                        if nei['remote_int'] not in nei_dev.interfaces:
+                            remote_int = Interface(
+                                name=nei['remote_int'])
+                            nei_dev.add_interface(remote_int)
+
+                        self._link_pending(nei_dev)
+
+                        self.logger.info(
+                            "Skipping %s, %s", nei['hostname'], reason)
+                else:
+                    self.logger.debug(
+                        "Skipping %s, already discovered", nei['hostname'])
+
+        return to_discover
 
     def refresh_global_information(self):
         """
@@ -287,62 +982,306 @@ class Fabric():
         self._recalculate_macs()
         self._find_links()
 
-    def _find_links(self):
+    def refresh(self,
+                credentials: list,
+                napalm_optional_args=None,
+                devices: Union[str, list] = 'all',
+                stale_after: Optional[float] = None,
+                parallel_threads=1,
+                scan_options: Optional[dict] = None) -> Dict[str, dict]:
         """
-        Join switches by CDP neighborship
+        Discover again some switches already in the fabric, updating them in place.
+        Links and the global mac table are fixed up for those switches only,
+        no new device is discovered.
+
+        devices selects what is polled:
+        - 'all': every Switch
+        - 'stale': switches discovered more than stale_after seconds ago
+        - 'changed': every Switch, as an incremental scan. Switches whose cheap
+          config probe shows no change only collect Switch.VOLATILE_MODULES
+        - a list of Switch objects, or names, addresses or serial numbers
+          the devices are known by
+
+        Neighbors are kept as they were if no neighbor module succeeds on a switch,
+        the mac table if mac_address does not succeed.
+
+        :param credentials: List of (username, password) tuples to try
+        :type credentials: list
+        :param napalm_optional_args: Optional_args to pass to NAPALM, defaults to None
+        :type napalm_optional_args: list(dict), optional
+        :param devices: Switches to poll, defaults to 'all'
+        :type devices: str or list, optional
+        :param stale_after: Seconds after which a discovery is stale, needed with devices='stale'
+        :type stale_after: float, optional
+        :param scan_options: Passed to Switch.retrieve_data, defaults to None
+        :type scan_options: dict, optional
+        :return: Dictionary of {hostname: changes}, see _refresh_changes().
+            Switches that could not be polled only have 'status', "Failed" or "Timeout"
+        :rtype: dict
         """
-        short_fabric = {k[:40]: v for k, v in self.devices.items()}
-        hostname_only_fabric = {}
+        if napalm_optional_args is None:
+            napalm_optional_args = [None]
+
+        scan_options = {} if scan_options is None else dict(scan_options)
+        if devices == 'changed':
+            scan_options['incremental'] = True
 
-        for k, v in self.devices.items():
-            if v.facts is not None:
-                hostname_only_fabric[v.facts['hostname']] = v
+        switches = self._refresh_selection(devices, stale_after)
+
+        before = {}
+        for swobject in switches:
+            self.coordinator.transition(swobject.mgmt_address, DiscoveryCoordinator.QUEUED)
+            swobject.clear_abort()
+            before[swobject] = {'neighbors': self._detach_neighbors(swobject),
+                                'mac_table': dict(swobject.mac_table)}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_threads) as executor:
+            future_switch = {executor.submit(self._login, swobject, credentials,
+                                             napalm_optional_args, None, scan_options): swobject
+                             for swobject in switches}
+            concurrent.futures.wait(future_switch)
+
+        # Peers are only touched once every worker is done
+        report = {}
+        refreshed = []
+        for fut, swobject in future_switch.items():
+            old = before[swobject]
+            try:
+                fut.result()
+            except Exception as exc:
+                self.logger.error('Refresh of %s failed: %s', swobject.hostname, exc)
+                status = "Timeout" if isinstance(exc, DeadlineExceeded) else "Failed"
+                self.coordinator.transition(swobject.mgmt_address, status)
+                self._restore_neighbors(old['neighbors'])
+                swobject.mac_table = old['mac_table']
+                report[swobject.hostname] = {'status': status}
+                continue
+
+            if self.coordinator.snapshot()[swobject.mgmt_address] != DiscoveryCoordinator.TIMEOUT:
+                swobject.discovery_status = dt.now()
+
+            results = swobject.scan_results
+            if not any(results.get(x, {}).get('status') == 'ok' for x in Switch.NEIGHBOR_MODULES):
+                self._restore_neighbors(old['neighbors'])
+            if results.get('mac_address', {}).get('status') != 'ok':
+                swobject.mac_table = old['mac_table']
+
+            refreshed.append((swobject, old))
+
+        if self.connection_cache is not None:
+            self.connection_cache.save()
+
+        if self.capability_cache is not None:
+            self.capability_cache.save()
+
+        self._recalculate_macs([x[0] for x in refreshed])
+        self._find_links([x[0] for x in refreshed])
+
+        for swobject, old in refreshed:
+            report[swobject.hostname] = self._refresh_changes(swobject, old)
+
+        return report
+
+    def _refresh_selection(self, devices: Union[str, list], stale_after: Optional[float]) -> List[Switch]:
+        """Switches refresh() has to poll"""
+        switches = [x for x in self.devices.values() if isinstance(x, Switch)]
+        if devices in ('all', 'changed'):
+            return switches
+
+        if devices == 'stale':
+            assert stale_after is not None, "stale_after is needed to find stale switches"
+            now = dt.now()
+            return [x for x in switches
+                    if not isinstance(x.discovery_status, dt)
+                    or (now - x.discovery_status).total_seconds() > stale_after]
+
+        selected = []
+        for i in devices:
+            if isinstance(i, Device):
+                swobject = i
             else:
-                hostname_only_fabric[k] = k
+                swobject = (self.devices.resolve(str(i))
+                            or self.devices.by_address(i)
+                            or self.devices.by_serial(str(i)))
+                if swobject is None:
+                    raise KeyError(f"No device in the fabric is known as {i}")
 
-        for swdata in self.devices.values():
-            for intfdata in swdata.interfaces.values():
-                if hasattr(intfdata, "neighbors"):
-                    for i in intfdata.neighbors:
-                        if isinstance(i, Interface):
-                            continue
+            assert isinstance(swobject, Switch), f"{swobject.hostname} has never been discovered"
+            # The same switch can be asked for under several names
+            if swobject not in selected:
+                selected.append(swobject)
 
-                        switch = i['hostname']
-                        port = i['remote_int']
+        return selected
 
-                        try:
-                            peer_device = self.devices[switch]
-                        except KeyError:
-                            try:
-                                peer_device = short_fabric[switch[:40]]
-                            except KeyError:
-                                try:
-                                    peer_device = hostname_only_fabric[switch]
-                                except KeyError:
-                                    self.logger.debug("Could not find link between %s %s and %s %s",
-                                                      intfdata.name, intfdata.device.facts['fqdn'], port, switch)
-                                    continue
+    @staticmethod
+    def _detach_neighbors(swobject: Switch) -> Dict[Interface, list]:
+        """
+        Empty the neighbors of every interface of a Switch, also removing it from its peers
 
-                        try:
-                            neigh_int = peer_device.interfaces[port]
-                        except KeyError:
-                            # missing interface, add it
-                            neigh_int = Interface(
-                                name=port, switch=peer_device)
-                            peer_device.add_interface(neigh_int)
+        :return: Dictionary of {Interface: previous neighbors}, for _restore_neighbors()
+        :rtype: dict
+        """
+        previous = {}
+        for intdata in swobject.interfaces.values():
+            previous[intdata] = list(intdata.neighbors)
+            for nei in intdata.neighbors:
+                if isinstance(nei, Interface) and intdata in nei.neighbors:
+                    nei.neighbors.remove(intdata)
+
+            intdata.neighbors = []
+
+        return previous
+
+    @staticmethod
+    def _restore_neighbors(previous: Dict[Interface, list]) -> None:
+        """Put back neighbors removed by _detach_neighbors()"""
+        for intdata, neighbors in previous.items():
+            # Links put back by a peer stay, half-parsed neighbors go
+            intdata.neighbors = [x for x in intdata.neighbors if isinstance(x, Interface)]
+            for nei in neighbors:
+                if isinstance(nei, Interface):
+                    intdata.add_neighbor(nei)
+                else:
+                    intdata.neighbors.append(nei)
+
+    @staticmethod
+    def _neighbor_names(neighbors: Dict[Interface, list]) -> Set[tuple]:
+        """Set of (local interface, neighbor hostname, neighbor interface)"""
+        names = set()
+        for intdata, neis in neighbors.items():
+            for nei in neis:
+                if isinstance(nei, Interface):
+                    names.add((intdata.name, nei.device.hostname, nei.name))
+                else:
+                    names.add((intdata.name, nei['hostname'], nei['remote_int']))
+        return names
 
-                        intfdata.neighbors.remove(i)
+    def _refresh_changes(self, swobject: Switch, old: dict) -> dict:
+        """
+        Compare a refreshed Switch with what it was before
+
+        :return: Dictionary with keys 'status' ("Completed" or "Timeout"), 'config_changed' (see Switch.config_changed),
+            'neighbors_added' and 'neighbors_removed' (sets of (local interface, neighbor hostname, neighbor interface)),
+            'macs_added', 'macs_removed' and 'macs_moved' (sets of EUI, as seen in the mac table of the Switch)
+        :rtype: dict
+        """
+        old_neighbors = self._neighbor_names(old['neighbors'])
+        new_neighbors = self._neighbor_names({x: x.neighbors for x in swobject.interfaces.values()})
+
+        old_macs = {mac: data['interface'].name for mac, data in old['mac_table'].items()}
+        new_macs = {mac: data['interface'].name for mac, data in swobject.mac_table.items()}
+
+        timeout = self.coordinator.snapshot().get(swobject.mgmt_address) == DiscoveryCoordinator.TIMEOUT
+        return {'status': "Timeout" if timeout else "Completed",
+                'config_changed': swobject.config_changed,
+                'neighbors_added': new_neighbors - old_neighbors,
+                'neighbors_removed': old_neighbors - new_neighbors,
+                'macs_added': set(new_macs) - set(old_macs),
+                'macs_removed': set(old_macs) - set(new_macs),
+                'macs_moved': {mac for mac in set(new_macs) & set(old_macs)
+                               if new_macs[mac] != old_macs[mac]}}
+
+    def config_fetch_summary(self) -> Dict[str, Dict[str, dict]]:
+        """
+        Compare how long reading the running config took per platform and method,
+        see Switch.config_fetch and scan_options['config_transfer']
+
+        :return: Dictionary of {platform: {method: {'devices': int, 'mean_duration': seconds, 'mean_size': characters}}}
+        :rtype: dict
+        """
+        samples: Dict[str, Dict[str, list]] = {}
+        for device in self.devices.values():
+            if getattr(device, 'config_fetch', None) is None:
+                continue
+
+            platform = device.capability_platform() or device.platform
+            samples.setdefault(platform, {}).setdefault(
+                device.config_fetch['method'], []).append(device.config_fetch)
+
+        return {platform: {method: {'devices': len(fetches),
+                                    'mean_duration': statistics.mean(x['duration'] for x in fetches),
+                                    'mean_size': statistics.mean(x['size'] for x in fetches)}
+                           for method, fetches in methods.items()}
+                for platform, methods in samples.items()}
+
+    def _find_links(self, devices: Optional[list] = None):
+        """
+        Join switches by CDP neighborship
 
-                        intfdata.add_neighbor(neigh_int)
+        :param devices: Only resolve neighbors reported by, or pending on, these devices, defaults to None (all)
+        :type devices: list(netwalk.Device), optional
+        """
+        for swdata in list(self.devices.values() if devices is None else devices):
+            self._link_device(swdata)
 
-                        self.logger.debug("Found link between %s %s and %s %s", intfdata.name,
-                                          intfdata.device.hostname, neigh_int.name, neigh_int.device.hostname)
+    def _link_device(self, swdata: Device) -> None:
+        """
+        Link the interfaces of a device whose discovery is over to their neighbors,
+        then the neighbors that were waiting for it.
+        Neighbors not known yet or still being discovered are kept pending.
 
-    def _recalculate_macs(self):
+        :param swdata: Device to link
+        :type swdata: netwalk.Device
+        """
+        for intfdata in list(swdata.interfaces.values()):
+            self._link_interface(intfdata)
+
+        self._link_pending(swdata)
+
+    def _link_pending(self, swdata: Device) -> None:
+        """Link the interfaces whose neighbor dictionaries might point at a device"""
+        waiting = set()
+        for name in self.devices.names(swdata):
+            waiting.update(self._pending_links.pop(name, set()))
+
+        for intfdata in waiting:
+            self._link_interface(intfdata)
+
+    def _link_interface(self, intfdata: Interface) -> None:
+        """Replace the neighbor dictionaries of an interface with the Interface they point at, if known"""
+        for i in list(intfdata.neighbors):
+            if isinstance(i, Interface):
+                continue
+
+            switch = i['hostname']
+            port = i['remote_int']
+
+            peer_device = self.devices.resolve(switch)
+            if peer_device is None or peer_device in self._discovering:
+                self.logger.debug("Could not find link between %s %s and %s %s yet",
+                                  intfdata.name, intfdata.device.hostname, port, switch)
+                name = normalize_hostname(switch)
+                for name in (name, name[:DeviceRegistry.PREFIX_LENGTH], name.split(".")[0]):
+                    self._pending_links.setdefault(name, set()).add(intfdata)
+                continue
+
+            try:
+                neigh_int = peer_device.interfaces[port]
+            except KeyError:
+                # missing interface, add it
+                neigh_int = Interface(
+                    name=port, switch=peer_device)
+                peer_device.add_interface(neigh_int)
+
+            intfdata.neighbors.remove(i)
+
+            intfdata.add_neighbor(neigh_int)
+
+            self.logger.debug("Found link between %s %s and %s %s", intfdata.name,
+                              intfdata.device.hostname, neigh_int.name, neigh_int.device.hostname)
+
+    def _recalculate_macs(self, devices: Optional[list] = None):
         """
         Refresh count macs per interface.
         Tries to guess where mac addresses are by assigning them to the interface with the lowest total mac count
+
+        :param devices: Only place again the macs seen by, or placed on, these switches, defaults to None (all)
+        :type devices: list(netwalk.Switch), optional
         """
+        if devices is not None:
+            self._recalculate_macs_of(devices)
+            return
+
         for swdata in self.devices.values():
             if isinstance(swdata, Switch):
                 for intdata in swdata.interfaces.values():
@@ -365,6 +1304,38 @@ class Fabric():
                     except KeyError:
                         self.mac_table[mac] = macdata
 
+    def _recalculate_macs_of(self, devices: list) -> None:
+        """Same as _recalculate_macs() for the macs seen by, or placed on, some switches only"""
+        devices = [x for x in devices if isinstance(x, Switch)]
+        affected = set()
+        for swdata in devices:
+            for intdata in swdata.interfaces.values():
+                intdata.mac_count = 0
+
+            for mac, data in swdata.mac_table.items():
+                affected.add(mac)
+                try:
+                    data['interface'].mac_count += 1
+                except KeyError:
+                    pass
+
+        affected.update(mac for mac, macdata in self.mac_table.items()
+                        if macdata['interface'].device in devices)
+
+        switches = [x for x in self.devices.values() if isinstance(x, Switch)]
+        for mac in affected:
+            self.mac_table.pop(mac, None)
+            for swdata in switches:
+                macdata = swdata.mac_table.get(mac)
+                if macdata is None:
+                    continue
+
+                try:
+                    if self.mac_table[mac]['interface'].mac_count > macdata['interface'].mac_count:
+                        self.mac_table[mac] = macdata
+                except KeyError:
+                    self.mac_table[mac] = macdata
+
     def find_paths(self, start_sw, end_sw):
         """
         Return a list of all interfaces from 'start' Switch to 'end' Switch
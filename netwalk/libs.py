@@ -1,5 +1,13 @@
 "Miscellaneous functions that can be useful across objects"
 
+import errno
+import ipaddress
+import re
+import selectors
+import socket
+import time
+from typing import Dict, Iterable, Optional, Set
+
 
 def interface_name_expander(name):
     mapping = {'Fa': 'FastEthernet',
@@ -13,3 +21,162 @@ def interface_name_expander(name):
             return name.replace(k, v)
 
     return name
+
+
+def probe_tcp_ports(addresses: Iterable, ports: Iterable[int] = (22, 23), timeout: float = 1.0) -> Dict[object, Set[int]]:
+    """
+    Check which TCP ports are open on many addresses at once.
+    All connections are started in parallel with non-blocking sockets,
+    so the whole sweep takes at most timeout seconds.
+
+    :param addresses: IP addresses to probe
+    :type addresses: list(ipaddress.ip_address)
+    :param ports: TCP ports to probe on each address, defaults to (22, 23)
+    :type ports: list(int)
+    :param timeout: Seconds to wait for answers, defaults to 1.0
+    :type timeout: float
+    :return: Dictionary of {address: set of open ports}
+    :rtype: dict
+    """
+    result = {address: set() for address in addresses}
+    selector = selectors.DefaultSelector()
+
+    for address in result:
+        family = socket.AF_INET6 if ipaddress.ip_address(
+            address).version == 6 else socket.AF_INET
+        for port in ports:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            err = sock.connect_ex((str(address), port))
+            if err == 0:
+                result[address].add(port)
+                sock.close()
+            elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                selector.register(sock, selectors.EVENT_WRITE, (address, port))
+            else:
+                sock.close()
+
+    deadline = time.monotonic() + timeout
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        for key, _ in selector.select(remaining):
+            address, port = key.data
+            if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                result[address].add(port)
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+
+    # Whatever did not answer in time is filtered
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+
+    selector.close()
+    return result
+
+
+# NAPALM driver for CDP platforms, LLDP system descriptions and SSH banners.
+# More specific first, IOS XR and NX-OS descriptions contain "Cisco IOS" too
+PLATFORM_PATTERNS = [('nxos_ssh', re.compile(r'NX-OS|Nexus|\bN[35679]K-', re.I)),
+                     ('iosxr', re.compile(r'IOS[ -]XR|\bASR9K|\bASR-9\d{3}|\bNCS-?\d|Cisco-2\.', re.I)),
+                     ('eos', re.compile(r'Arista|\bEOS\b', re.I)),
+                     ('junos', re.compile(r'Juniper|JUNOS', re.I)),
+                     ('ios', re.compile(r'Cisco IOS|IOS-XE|^cisco (WS-|C\d|CAT|ISR|ASR1|IE-)|Cisco-1\.', re.I))]
+
+
+def detect_platform(description: Optional[str]) -> Optional[str]:
+    """
+    Guess the NAPALM driver of a device from its CDP platform,
+    LLDP system description or SSH banner.
+
+    :param description: Text describing the device
+    :type description: str
+    :return: NAPALM driver name, None if unknown
+    :rtype: str
+    """
+    if not description:
+        return None
+
+    for platform, pattern in PLATFORM_PATTERNS:
+        if pattern.search(description):
+            return platform
+
+    return None
+
+
+def normalize_hostname(hostname: str) -> str:
+    """
+    Hostname in the form used to compare devices: lower case, without the
+    trailing dot and without the serial number NX-OS appends in CDP, e.g. "switch(FOX1234ABCD)"
+
+    :param hostname: Hostname as reported by the device or a neighbor
+    :type hostname: str
+    :return: Normalized hostname
+    :rtype: str
+    """
+    return re.sub(r"\(\w+\)$", "", str(hostname).strip()).rstrip(".").lower()
+
+
+def read_ssh_banners(addresses: Iterable, port: int = 22, timeout: float = 1.0) -> Dict[object, Optional[str]]:
+    """
+    Read the SSH identification string of many devices at once,
+    e.g. "SSH-2.0-Cisco-1.25". Like probe_tcp_ports, all connections
+    are made in parallel and the whole sweep takes at most timeout seconds.
+
+    :param addresses: IP addresses to read from
+    :type addresses: list(ipaddress.ip_address)
+    :param port: SSH port, defaults to 22
+    :type port: int
+    :param timeout: Seconds to wait for banners, defaults to 1.0
+    :type timeout: float
+    :return: Dictionary of {address: banner or None}
+    :rtype: dict
+    """
+    result = {address: None for address in addresses}
+    received = {}
+    selector = selectors.DefaultSelector()
+
+    for address in result:
+        family = socket.AF_INET6 if ipaddress.ip_address(
+            address).version == 6 else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex((str(address), port))
+        if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            selector.register(sock, selectors.EVENT_READ, address)
+            received[address] = b""
+        else:
+            sock.close()
+
+    deadline = time.monotonic() + timeout
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        for key, _ in selector.select(remaining):
+            address = key.data
+            try:
+                data = key.fileobj.recv(256)
+            except OSError:
+                data = b""
+
+            received[address] += data
+            # Servers may send other lines before the identification string
+            lines = received[address].split(b"\n")
+            banner = next((x for x in lines[:-1] if x.startswith(b"SSH-")), None)
+            if banner is not None or not data or len(received[address]) > 4096:
+                if banner is not None:
+                    result[address] = banner.decode(errors='replace').strip()
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+
+    selector.close()
+    return result
@@ -0,0 +1,356 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from netaddr import EUI
+from netaddr.core import AddrFormatError
+
+from netwalk.libs import normalize_hostname
+
+
+class DeviceRegistry(dict):
+    """
+    Dictionary of {hostname: Device} that also indexes every device by
+    its other names, management and interface addresses, serial number
+    and interface MAC addresses.
+
+    Names are compared normalized, see netwalk.libs.normalize_hostname().
+    Dictionary keys and Device.aliases count as names of a device too.
+
+    Devices are indexed when added. Call reindex() once a device has
+    learnt more about itself, e.g. its facts after logging in.
+    A key matching more than one device does not resolve to any.
+    """
+
+    #: Name indexes tried in order by resolve()
+    NAME_INDEXES = ['name', 'prefix', 'short']
+    #: Characters CDP keeps of a hostname
+    PREFIX_LENGTH = 40
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._lock = threading.RLock()
+        # {index: {key: [Device]}}
+        self._indexes: Dict[str, Dict[Any, List[Any]]] = {
+            x: {} for x in self.NAME_INDEXES + ['address', 'serial', 'mac']}
+        # {id(Device): [Device, {index: keys}, set of dict keys pointing at it]}
+        self._entries: Dict[int, list] = {}
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        # Items have to be set through __init__, pickle would set them before the indexes exist
+        return (self.__class__, (dict(self),))
+
+    @staticmethod
+    def _is_address(value: str) -> bool:
+        try:
+            ipaddress.ip_address(value)
+        except ValueError:
+            return False
+        return True
+
+    def _keys(self, device) -> Dict[str, Set[Any]]:
+        """Every key a device is found by, per index"""
+        entry = self._entries.get(id(device))
+        names = {str(x) for x in entry[2]} if entry is not None else set()
+        if device.hostname is not None:
+            names.add(str(device.hostname))
+        facts = device.facts or {}
+        for fact in ('hostname', 'fqdn'):
+            value = facts.get(fact)
+            if value and value != 'Unknown':
+                names.add(value.replace(".not set", ""))
+        names = {normalize_hostname(x) for x in names}
+
+        addresses = set()
+        if device.mgmt_address is not None:
+            addresses.add(device.mgmt_address)
+        for alias in getattr(device, 'aliases', None) or ():
+            if isinstance(alias, str) and not self._is_address(alias):
+                names.add(normalize_hostname(alias))
+            else:
+                addresses.add(ipaddress.ip_address(alias))
+        for families in (getattr(device, 'interfaces_ip', None) or {}).values():
+            for family in families.values():
+                for address in family:
+                    addresses.add(ipaddress.ip_address(address))
+
+        macs = set()
+        for intdata in device.interface_list():
+            for value in (getattr(intdata, 'mac_address', None), getattr(intdata, 'bia', None)):
+                if value:
+                    try:
+                        macs.add(EUI(value))
+                    except (AddrFormatError, TypeError, ValueError):
+                        pass
+
+        serial = facts.get('serial_number')
+        if serial in ('Unknown', ''):
+            serial = None
+        return {'name': names,
+                'prefix': {x[:self.PREFIX_LENGTH] for x in names},
+                'short': {x.split(".")[0] for x in names if not self._is_address(x)},
+                'address': addresses,
+                'serial': {serial} if serial else set(),
+                'mac': macs}
+
+    def _index(self, device) -> None:
+        entry = self._entries[id(device)]
+        for index, keys in entry[1].items():
+            for key in keys:
+                devices = self._indexes[index].get(key, [])
+                devices.remove(device)
+                if not devices:
+                    self._indexes[index].pop(key)
+
+        entry[1] = self._keys(device)
+        for index, keys in entry[1].items():
+            for key in keys:
+                self._indexes[index].setdefault(key, []).append(device)
+
+    def _add(self, key, device) -> None:
+        self._entries.setdefault(id(device), [device, {}, set()])[2].add(key)
+        self._index(device)
+
+    def _remove(self, key, device) -> None:
+        entry = self._entries[id(device)]
+        entry[2].discard(key)
+        if entry[2]:
+            self._index(device)
+            return
+
+        for index, keys in entry[1].items():
+            for key in keys:
+                devices = self._indexes[index][key]
+                devices.remove(device)
+                if not devices:
+                    self._indexes[index].pop(key)
+        self._entries.pop(id(device))
+
+    def __setitem__(self, key, device) -> None:
+        with self._lock:
+            old = self.get(key)
+            super().__setitem__(key, device)
+            if old is not None:
+                self._remove(key, old)
+            self._add(key, device)
+
+    def __delitem__(self, key) -> None:
+        with self._lock:
+            device = self[key]
+            super().__delitem__(key)
+            self._remove(key, device)
+
+    def pop(self, key, *args):
+        with self._lock:
+            if key not in self:
+                return super().pop(key, *args)
+            device = self[key]
+            del self[key]
+            return device
+
+    def popitem(self):
+        with self._lock:
+            key, device = super().popitem()
+            self._remove(key, device)
+            return key, device
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if key not in self:
+                self[key] = default
+            return self[key]
+
+    def update(self, *args, **kwargs) -> None:
+        with self._lock:
+            for key, device in dict(*args, **kwargs).items():
+                self[key] = device
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._entries = {}
+            self._indexes = {x: {} for x in self._indexes}
+
+    def reindex(self, device) -> None:
+        """
+        Index a device again after its names, addresses or facts changed.
+        Devices not in the registry are ignored.
+
+        :param device: Device to index
+        :type device: netwalk.Device
+        """
+        with self._lock:
+            if id(device) in self._entries:
+                self._index(device)
+
+    def keys_of(self, device) -> Set[Any]:
+        """
+        Dictionary keys a device is stored under
+
+        :param device: Device
+        :type device: netwalk.Device
+        :return: Set of keys, empty if the device is not in the registry
+        :rtype: set
+        """
+        with self._lock:
+            entry = self._entries.get(id(device))
+            return set() if entry is None else set(entry[2])
+
+    def replace(self, old, new) -> None:
+        """
+        Store a device under every key of another one, which is removed
+
+        :param old: Device to remove
+        :type old: netwalk.Device
+        :param new: Device to put in its place
+        :type new: netwalk.Device
+        """
+        with self._lock:
+            entry = self._entries.get(id(old))
+            if entry is None:
+                return
+
+            for key in list(entry[2]):
+                self[key] = new
+
+    def same_device(self, device) -> List[Any]:
+        """
+        Other devices sharing the serial number, an interface MAC or
+        a normalized hostname or FQDN with a device, which may not be in the registry.
+        Devices whose serial numbers are both known and differ are never the same
+
+        :param device: Device to compare
+        :type device: netwalk.Device
+        :return: List of Devices, serial number matches first
+        :rtype: list(netwalk.Device)
+        """
+        with self._lock:
+            keys = self._keys(device)
+            found = []
+            for index in ('serial', 'mac', 'name'):
+                for key in keys[index]:
+                    for other in self._indexes[index].get(key, []):
+                        serials = self._entries[id(other)][1]['serial']
+                        if keys['serial'] and serials and not keys['serial'] & serials:
+                            continue
+                        if other is not device and other not in found:
+                            found.append(other)
+
+        return found
+
+    def identities(self, device) -> Set[Any]:
+        """
+        Normalized hostnames and FQDN, management, alias and interface addresses of a device
+
+        :param device: Device, in the registry or not
+        :type device: netwalk.Device
+        :return: Set of names and ipaddress objects
+        :rtype: set
+        """
+        keys = self._keys(device)
+        return keys['name'] | keys['address']
+
+    def names(self, device) -> Set[str]:
+        """
+        Every name resolve() finds a device by: hostnames, FQDN,
+        their first 40 characters and their part before the domain
+
+        :param device: Device, in the registry or not
+        :type device: netwalk.Device
+        :return: Set of names
+        :rtype: set(str)
+        """
+        keys = self._keys(device)
+        return set().union(*(keys[x] for x in self.NAME_INDEXES))
+
+    def _lookup(self, index: str, key) -> Optional[Any]:
+        devices = self._indexes[index].get(key, [])
+        return devices[0] if len(devices) == 1 else None
+
+    def resolve(self, name: str) -> Optional[Any]:
+        """
+        Find a device by dictionary key, hostname, FQDN, first 40 characters
+        of its name as CDP shows them or name without domain, in this order
+
+        :param name: Name of the device
+        :type name: str
+        :return: Device, None if no single device matches
+        :rtype: netwalk.Device
+        """
+        with self._lock:
+            if name in self:
+                return self[name]
+
+            name = normalize_hostname(name)
+            for index, key in zip(self.NAME_INDEXES,
+                                  (name, name[:self.PREFIX_LENGTH], name.split(".")[0])):
+                device = self._lookup(index, key)
+                if device is not None:
+                    return device
+
+        return None
+
+    def by_address(self, address) -> Optional[Any]:
+        """
+        Find a device by management or interface address
+
+        :param address: IP address
+        :type address: ipaddress.ip_address or str
+        :return: Device, None if no single device matches
+        :rtype: netwalk.Device
+        """
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+
+        with self._lock:
+            return self._lookup('address', address)
+
+    def by_serial(self, serial: str) -> Optional[Any]:
+        """
+        Find a device by the serial number in its facts
+
+        :param serial: Serial number
+        :type serial: str
+        :return: Device, None if no single device matches
+        :rtype: netwalk.Device
+        """
+        with self._lock:
+            return self._lookup('serial', serial)
+
+    def by_mac(self, mac) -> Optional[Any]:
+        """
+        Find a device by the MAC or burnt-in address of one of its interfaces
+
+        :param mac: MAC address
+        :type mac: netaddr.EUI or str
+        :return: Device, None if no single device matches
+        :rtype: netwalk.Device
+        """
+        try:
+            mac = EUI(mac)
+        except (AddrFormatError, TypeError, ValueError):
+            return None
+
+        with self._lock:
+            return self._lookup('mac', mac)
@@ -0,0 +1,202 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime as dt
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from netwalk.device import Switch
+from netwalk.fabric import Fabric
+
+
+class PollScheduler():
+    """
+    Poll the switches of a Fabric over and over, each scan module at its own interval,
+    updating the Fabric in place through Fabric.refresh().
+
+    Modules of a switch due at the same time are collected in one session.
+    Each new due time is moved by up to jitter * interval at random so that
+    devices discovered together do not stay in lockstep.
+    """
+
+    logger: logging.Logger
+    #: Fabric whose switches are polled
+    fabric: Fabric
+    #: List of (username, password) tuples to try
+    credentials: list
+    #: Optional_args to pass to NAPALM
+    napalm_optional_args: Optional[list]
+    #: Dictionary of {module: seconds between polls}. Keys are Switch.SCAN_MODULES and 'config'
+    #: for the running config. Modules not listed are never polled
+    intervals: Dict[str, float]
+    #: Fraction of the interval a due time is moved by at random
+    jitter: float
+    #: Maximum switches polled at the same time
+    max_concurrent: int
+    #: Passed to Fabric.refresh(), whitelist and running_config are set for each poll
+    scan_options: dict
+    #: Function called with the report of Fabric.refresh() after each poll, optional
+    callback: Optional[Callable[[Dict[str, dict]], None]]
+    #: Dictionary of {Switch: {module: time.monotonic() value when it is due}}
+    schedule: Dict[Switch, Dict[str, float]]
+
+    #: Pseudo-module standing for the running config
+    CONFIG_MODULE = 'config'
+    DEFAULT_INTERVALS = {'mac_address': 300,
+                         'interface_status': 900,
+                         'cdp_neighbors': 3600,
+                         'lldp_neighbors': 3600,
+                         'config': 86400,
+                         'vtp': 86400,
+                         'vlans': 86400,
+                         'l3_int': 86400,
+                         'local_admins': 86400,
+                         'inventory': 86400}
+
+    def __init__(self,
+                 fabric: Fabric,
+                 credentials: list,
+                 napalm_optional_args: Optional[list] = None,
+                 intervals: Optional[Dict[str, float]] = None,
+                 jitter: float = 0.1,
+                 max_concurrent: int = 4,
+                 scan_options: Optional[dict] = None,
+                 callback: Optional[Callable[[Dict[str, dict]], None]] = None):
+        """
+        :param fabric: Fabric to keep up to date
+        :type fabric: netwalk.Fabric
+        :param credentials: List of (username, password) tuples to try
+        :type credentials: list(tuple(str,str))
+        :param napalm_optional_args: Optional_args to pass to NAPALM, defaults to None
+        :type napalm_optional_args: list(dict), optional
+        :param intervals: Dictionary of {module: seconds}, defaults to DEFAULT_INTERVALS
+        :type intervals: dict(str, float), optional
+        :param jitter: Fraction of the interval a due time is moved by at random, defaults to 0.1
+        :type jitter: float, optional
+        :param max_concurrent: Maximum switches polled at the same time, defaults to 4
+        :type max_concurrent: int, optional
+        :param scan_options: Passed to Fabric.refresh(), e.g. {'collectors': ['snmp']}, defaults to None
+        :type scan_options: dict, optional
+        :param callback: Function called with the report of each poll, defaults to None
+        :type callback: function, optional
+        """
+        self.logger = logging.getLogger(__name__)
+        self.intervals = dict(self.DEFAULT_INTERVALS) if intervals is None else dict(intervals)
+        for module in self.intervals:
+            assert module in Switch.SCAN_MODULES + [self.CONFIG_MODULE], \
+                f"Unknown module, has to be any of {Switch.SCAN_MODULES + [self.CONFIG_MODULE]}"
+
+        self.fabric = fabric
+        self.credentials = credentials
+        self.napalm_optional_args = napalm_optional_args
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self.scan_options = {} if scan_options is None else scan_options
+        self.callback = callback
+        self.schedule = {}
+        self._stop = threading.Event()
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _update_schedule(self, now: float) -> None:
+        """Add switches new to the fabric, drop the ones no longer in it"""
+        switches = [x for x in self.fabric.devices.values() if isinstance(x, Switch)]
+        for switch in set(self.schedule) - set(switches):
+            self.schedule.pop(switch)
+
+        for switch in switches:
+            if switch in self.schedule:
+                continue
+
+            # Data is as fresh as the last discovery, if known
+            age = None
+            if isinstance(switch.discovery_status, dt):
+                age = (dt.now() - switch.discovery_status).total_seconds()
+
+            self.schedule[switch] = {
+                module: now + random.uniform(0, interval * self.jitter) if age is None
+                else now + self._jittered(interval) - age
+                for module, interval in self.intervals.items()}
+
+    def next_due(self) -> Optional[float]:
+        """
+        time.monotonic() value when the next module is due
+
+        :return: Earliest due time, None if there is nothing to poll
+        :rtype: float
+        """
+        return min((due for modules in self.schedule.values() for due in modules.values()),
+                   default=None)
+
+    def poll_due(self, now: Optional[float] = None) -> Dict[str, dict]:
+        """
+        Poll every module that is due, switches due for the same modules together
+
+        :param now: time.monotonic() value to compare due times with, defaults to the current one
+        :type now: float, optional
+        :return: Merged reports of Fabric.refresh(), {hostname: changes}
+        :rtype: dict
+        """
+        now = time.monotonic() if now is None else now
+        self._update_schedule(now)
+
+        groups: Dict[FrozenSet[str], List[Switch]] = {}
+        for switch, modules in self.schedule.items():
+            due = frozenset(module for module, when in modules.items() if when <= now)
+            if due:
+                groups.setdefault(due, []).append(switch)
+
+        report = {}
+        for modules, switches in groups.items():
+            self.logger.info("Polling %s on %d switches",
+                             ", ".join(sorted(modules)), len(switches))
+            scan_options = dict(self.scan_options)
+            scan_options['whitelist'] = [x for x in Switch.SCAN_MODULES if x in modules]
+            scan_options['running_config'] = self.CONFIG_MODULE in modules
+            report.update(self.fabric.refresh(self.credentials,
+                                              self.napalm_optional_args,
+                                              devices=switches,
+                                              parallel_threads=self.max_concurrent,
+                                              scan_options=scan_options))
+
+            for switch in switches:
+                for module in modules:
+                    self.schedule[switch][module] = now + self._jittered(self.intervals[module])
+
+        if report and self.callback is not None:
+            self.callback(report)
+
+        return report
+
+    def run(self) -> None:
+        """Poll due modules until stop() is called"""
+        self._stop.clear()
+        while not self._stop.is_set():
+            self.poll_due()
+            next_due = self.next_due()
+            wait = min(self.intervals.values(), default=60) if next_due is None \
+                else next_due - time.monotonic()
+            self._stop.wait(max(wait, 0))
+
+    def stop(self) -> None:
+        """Make run() return once the poll in progress is finished"""
+        self._stop.set()
@@ -0,0 +1,268 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern
+
+from netwalk.libs import detect_platform, normalize_hostname
+
+
+class PrefixTrie():
+    """
+    Binary trie of IP prefixes, one per address family,
+    returning the value of the longest prefix containing an address
+    """
+
+    def __init__(self):
+        # Nodes are [child for bit 0, child for bit 1, (value,) or None]
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+
+    def insert(self, prefix, value: Any) -> None:
+        """
+        Add a prefix, replacing its value if already there
+
+        :param prefix: Network, e.g. "10.0.0.0/8"
+        :type prefix: str or ipaddress.ip_network
+        :param value: Value returned for addresses in the prefix
+        :type value: any
+        """
+        network = ipaddress.ip_network(prefix)
+        node = self._roots[network.version]
+        address = int(network.network_address)
+        for depth in range(network.prefixlen):
+            bit = (address >> (network.max_prefixlen - depth - 1)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+
+        node[2] = (value,)
+
+    def longest_match(self, address, default: Any = None) -> Any:
+        """
+        Value of the most specific prefix containing an address
+
+        :param address: IP address
+        :type address: str or ipaddress.ip_address
+        :param default: Returned if no prefix matches, defaults to None
+        :type default: any, optional
+        :return: Value of the matching prefix
+        :rtype: any
+        """
+        address = ipaddress.ip_address(address)
+        max_prefixlen = address.max_prefixlen
+        bits = int(address)
+        node = self._roots[address.version]
+        found = default
+        for depth in range(max_prefixlen + 1):
+            if node[2] is not None:
+                found = node[2][0]
+            if depth == max_prefixlen:
+                break
+            node = node[(bits >> (max_prefixlen - depth - 1)) & 1]
+            if node is None:
+                break
+
+        return found
+
+
+def _compile(patterns: Optional[Iterable[str]]) -> Optional[Pattern]:
+    """Join regular expressions into one case insensitive matcher"""
+    if patterns is None:
+        return None
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{x})" for x in patterns), re.IGNORECASE)
+
+
+class ScopePolicy():
+    """
+    Decide which neighbors init_from_seed_device() discovers, from the
+    neighbor records of CDP/LLDP: {'hostname', 'ip', 'platform', 'remote_int'}
+    and, when the neighbor advertises them, 'capabilities'.
+
+    A neighbor is in scope if it passes every filter that is set:
+
+    * allow_prefixes/deny_prefixes: the most specific prefix containing its
+      address decides. With allow_prefixes set, addresses in no prefix
+      and neighbors without an address are out of scope
+    * allow_hostnames/deny_hostnames: regular expressions searched in its normalized hostname
+    * platforms: regular expressions searched in the platform string it
+      reports or the NAPALM driver guessed from it, e.g. "ios" or "N9K";
+      deny_platforms the same, to leave matching ones out
+    * capabilities/deny_capabilities: LLDP capability codes, e.g. "R", "B", "W", "T".
+      CDP capabilities are translated to them, "Router" to "R", "Switch" to "B" and so on,
+      others such as "IGMP" are matched by name. Neighbors not advertising any pass these filters
+
+    Patterns are compiled once into a single matcher per filter and prefixes into a trie.
+
+    sites maps site names to dictionaries with 'prefixes', the subnets of the
+    site, and any of the filters above, which replace the global ones for
+    neighbors whose address is in the site.
+    """
+
+    #: LLDP code of each CDP capability
+    CDP_CAPABILITIES = {'ROUTER': 'R', 'TRANS-BRIDGE': 'B', 'SOURCE-ROUTE-BRIDGE': 'B', 'SWITCH': 'B',
+                        'HOST': 'S', 'REPEATER': 'P', 'PHONE': 'T'}
+
+    #: Filters a site can override
+    FILTERS = ['allow_prefixes', 'deny_prefixes', 'allow_hostnames', 'deny_hostnames',
+               'platforms', 'deny_platforms', 'capabilities', 'deny_capabilities']
+
+    def __init__(self,
+                 allow_prefixes: Optional[Iterable[str]] = None,
+                 deny_prefixes: Optional[Iterable[str]] = None,
+                 allow_hostnames: Optional[Iterable[str]] = None,
+                 deny_hostnames: Optional[Iterable[str]] = None,
+                 platforms: Optional[Iterable[str]] = None,
+                 deny_platforms: Optional[Iterable[str]] = None,
+                 capabilities: Optional[Iterable[str]] = None,
+                 deny_capabilities: Optional[Iterable[str]] = None,
+                 sites: Optional[Dict[str, dict]] = None):
+        """
+        :param allow_prefixes: Subnets to discover, defaults to all
+        :type allow_prefixes: list(str), optional
+        :param deny_prefixes: Subnets not to discover, defaults to None
+        :type deny_prefixes: list(str), optional
+        :param allow_hostnames: Regular expressions of hostnames to discover, defaults to all
+        :type allow_hostnames: list(str), optional
+        :param deny_hostnames: Regular expressions of hostnames not to discover, defaults to None
+        :type deny_hostnames: list(str), optional
+        :param platforms: Regular expressions of platforms or NAPALM drivers to discover, defaults to all
+        :type platforms: list(str), optional
+        :param deny_platforms: Regular expressions of platforms or NAPALM drivers not to discover, defaults to None
+        :type deny_platforms: list(str), optional
+        :param capabilities: LLDP capability codes or CDP capabilities of which neighbors need at least one, defaults to any
+        :type capabilities: list(str), optional
+        :param deny_capabilities: LLDP capability codes or CDP capabilities of neighbors not to discover, defaults to None
+        :type deny_capabilities: list(str), optional
+        :param sites: Dictionary of {site name: {'prefixes': list of subnets, filter: value}}, defaults to None
+        :type sites: dict, optional
+        """
+        self.settings = {'allow_prefixes': allow_prefixes,
+                         'deny_prefixes': deny_prefixes,
+                         'allow_hostnames': allow_hostnames,
+                         'deny_hostnames': deny_hostnames,
+                         'platforms': platforms,
+                         'deny_platforms': deny_platforms,
+                         'capabilities': capabilities,
+                         'deny_capabilities': deny_capabilities}
+
+        self._prefixes = None
+        if allow_prefixes is not None or deny_prefixes is not None:
+            self._prefixes = PrefixTrie()
+            for prefix in allow_prefixes or ():
+                self._prefixes.insert(prefix, True)
+            for prefix in deny_prefixes or ():
+                self._prefixes.insert(prefix, False)
+        # Addresses in no prefix are only in scope if nothing is explicitly allowed
+        self._default = allow_prefixes is None
+
+        self._allow_hostnames = _compile(allow_hostnames)
+        self._deny_hostnames = _compile(deny_hostnames)
+        self._platforms = _compile(platforms)
+        self._deny_platforms = _compile(deny_platforms)
+        self._capabilities = None if capabilities is None else self._capability_codes(" ".join(capabilities))
+        self._deny_capabilities = self._capability_codes(" ".join(deny_capabilities or ()))
+
+        self.sites: Dict[str, ScopePolicy] = {}
+        self._sites = PrefixTrie()
+        for name, site in (sites or {}).items():
+            overrides = dict(site)
+            prefixes = overrides.pop('prefixes')
+            for key in overrides:
+                assert key in self.FILTERS, f"Unknown filter, has to be any of {self.FILTERS}"
+            self.sites[name] = ScopePolicy(**{**self.settings, **overrides})
+            for prefix in prefixes:
+                self._sites.insert(prefix, name)
+
+    def site_of(self, address) -> Optional[str]:
+        """
+        Name of the site whose most specific prefix contains an address
+
+        :param address: IP address
+        :type address: ipaddress.ip_address or str
+        :return: Site name, None if in no site
+        :rtype: str
+        """
+        if address is None:
+            return None
+        return self._sites.longest_match(address)
+
+    @classmethod
+    def _capability_codes(cls, capabilities: str) -> set:
+        """LLDP codes of "B,R" or of CDP "Router Switch IGMP", unknown names kept as they are"""
+        codes = {x.upper() for x in re.split(r"[\s,]+", capabilities) if x}
+        return {cls.CDP_CAPABILITIES.get(x, x) for x in codes}
+
+    def _allows(self, neighbor: dict) -> bool:
+        """Check a neighbor against this policy, ignoring sites"""
+        address = neighbor.get('ip')
+        if self._prefixes is not None:
+            allowed = self._default if address is None \
+                else self._prefixes.longest_match(address, self._default)
+            if not allowed:
+                return False
+
+        hostname = normalize_hostname(neighbor.get('hostname') or "")
+        if self._allow_hostnames is not None and not self._allow_hostnames.search(hostname):
+            return False
+        if self._deny_hostnames is not None and self._deny_hostnames.search(hostname):
+            return False
+
+        if self._platforms is not None or self._deny_platforms is not None:
+            platform = neighbor.get('platform') or ""
+            names = [platform, detect_platform(platform) or ""]
+            if self._platforms is not None and not any(self._platforms.search(x) for x in names):
+                return False
+            if self._deny_platforms is not None and any(self._deny_platforms.search(x) for x in names):
+                return False
+
+        capabilities = neighbor.get('capabilities')
+        if capabilities:
+            codes = self._capability_codes(capabilities)
+            if self._capabilities is not None and not codes & self._capabilities:
+                return False
+            if codes & self._deny_capabilities:
+                return False
+
+        return True
+
+    def allows(self, neighbor: dict) -> bool:
+        """
+        Check whether a neighbor is in scope
+
+        :param neighbor: Neighbor record as found in Interface.neighbors
+        :type neighbor: dict
+        :return: True if the neighbor should be discovered
+        :rtype: bool
+        """
+        return self.evaluate([neighbor])[0]
+
+    def evaluate(self, neighbors: Iterable[dict]) -> List[bool]:
+        """
+        Check many neighbors at once, each against the policy of its site
+
+        :param neighbors: Neighbor records as found in Interface.neighbors
+        :type neighbors: list(dict)
+        :return: List of booleans in the same order, True if in scope
+        :rtype: list(bool)
+        """
+        return [self.sites.get(self.site_of(x.get('ip')), self)._allows(x)
+                for x in neighbors]
@@ -0,0 +1,214 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import re
+import time
+from typing import Dict, List, Optional
+
+
+class CommandMemo():
+    """
+    Wraps a Netmiko connection so that identical show commands
+    are sent to the device only once.
+
+    NAPALM getters and netwalk parsers both go through send_command(),
+    so installing it as the NAPALM driver's .device lets them share outputs.
+    Every other attribute is read from and written to the wrapped connection.
+    """
+
+    logger: logging.Logger
+    #: The Netmiko connection being wrapped
+    connection: object
+    #: Dictionary of {command: output}
+    outputs: Dict[str, str]
+    #: Number of commands served from memory
+    hits: int
+    #: Why the last prefetch() fell back to sending commands one by one, None if it did not
+    prefetch_error: Optional[str]
+
+    #: Seconds without anything new from the device before prefetch() gives up
+    IDLE_TIMEOUT = 5.0
+    #: Seconds the device has to stay quiet before a failed prefetch() is over
+    DRAIN_QUIET = 1.0
+
+    _OWN_ATTRIBUTES = ('logger', 'connection', 'outputs', 'hits', 'prefetch_error')
+
+    def __init__(self, connection):
+        object.__setattr__(self, 'logger', logging.getLogger(__name__))
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, 'outputs', {})
+        object.__setattr__(self, 'hits', 0)
+        object.__setattr__(self, 'prefetch_error', None)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        if name in self._OWN_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.connection, name, value)
+
+    @staticmethod
+    def _key(command) -> str:
+        return " ".join(str(command).split())
+
+    def send_command(self, command_string, *args, **kwargs):
+        """Return the stored output of a show command, or send it and store the output.
+        Anything that is not a show command is always sent.
+
+        Takes the same arguments as Netmiko's send_command()
+        """
+        key = self._key(command_string)
+        if not key.startswith("show "):
+            return self.connection.send_command(command_string, *args, **kwargs)
+
+        try:
+            output = self.outputs[key]
+        except KeyError:
+            output = self.connection.send_command(command_string, *args, **kwargs)
+            if isinstance(output, str):
+                self.outputs[key] = output
+            return output
+
+        self.hits += 1
+        self.logger.debug("Reusing output of %s", key)
+        return output
+
+    def clear(self) -> None:
+        """Forget all stored outputs"""
+        self.outputs = {}
+
+    def prefetch(self, commands: List[str], read_timeout: float = 10.0,
+                 idle_timeout: Optional[float] = None) -> List[str]:
+        """
+        Send several show commands in a single write and store their outputs,
+        splitting what comes back on the prompts between them.
+        If the device does not handle it, e.g. drops commands typed ahead,
+        nothing is stored, prefetch_error says why and the commands
+        will be sent one by one when asked for.
+
+        :param commands: Show commands to send
+        :type commands: list(str)
+        :param read_timeout: Seconds to wait for all outputs, defaults to 10.0
+        :type read_timeout: float, optional
+        :param idle_timeout: Seconds without anything new from the device before giving up,
+            defaults to IDLE_TIMEOUT
+        :type idle_timeout: float, optional
+        :return: Commands whose output was stored
+        :rtype: list(str)
+        """
+        self.prefetch_error = None
+        commands = [x for x in commands
+                    if self._key(x).startswith("show ") and self._key(x) not in self.outputs]
+        if len(commands) < 2:
+            return []
+
+        if idle_timeout is None:
+            idle_timeout = self.IDLE_TIMEOUT
+
+        try:
+            outputs = self._send_pipelined(commands, read_timeout, idle_timeout)
+        except Exception as e:
+            self.logger.info("Pipelined commands failed, sending them one by one: %s", e)
+            self.prefetch_error = f"{type(e).__name__}: {e}"
+            try:
+                self._drain(self.DRAIN_QUIET, read_timeout)
+            except Exception:
+                pass
+            return []
+
+        for command, output in zip(commands, outputs):
+            self.outputs[self._key(command)] = output
+
+        return commands
+
+    def _drain(self, quiet: float, limit: float) -> None:
+        """Throw away what the device still sends, e.g. late output of commands
+        it was slow to run, until it has been quiet for a while"""
+        connection = self.connection
+        now = time.monotonic()
+        deadline = now + limit
+        last_data = now
+        while now - last_data < quiet and now < deadline:
+            if connection.read_channel():
+                last_data = time.monotonic()
+            else:
+                time.sleep(0.05)
+            now = time.monotonic()
+
+        connection.clear_buffer()
+
+    def _send_pipelined(self, commands: List[str], read_timeout: float, idle_timeout: float) -> List[str]:
+        """Write all commands at once and return their outputs in order"""
+        connection = self.connection
+        prompt = re.compile(
+            r"^" + re.escape(connection.base_prompt) + r"[>#]", re.M)
+
+        connection.write_channel(connection.RETURN.join(commands) + connection.RETURN)
+
+        data = ""
+        # Prompts in data[:complete], which ends with a newline and is never scanned again
+        found = 0
+        complete = 0
+        deadline = time.monotonic() + read_timeout
+        last_data = time.monotonic()
+        while True:
+            # Only the last, unfinished line is scanned again after each chunk
+            prompts = found + len(prompt.findall(data, complete))
+            if prompts >= len(commands):
+                break
+
+            now = time.monotonic()
+            if now > deadline:
+                raise TimeoutError(
+                    f"Got {prompts} prompts out of {len(commands)}")
+            # A device that dropped the commands typed ahead sends nothing more
+            if now - last_data > idle_timeout:
+                raise TimeoutError(
+                    f"Nothing new for {idle_timeout:.1f}s after {prompts} prompts out of {len(commands)}")
+
+            chunk = connection.read_channel()
+            if chunk:
+                last_data = time.monotonic()
+                data += chunk.replace("\r", "")
+                end = data.rfind("\n", complete) + 1
+                if end > complete:
+                    found += len(prompt.findall(data, complete, end))
+                    complete = end
+            else:
+                time.sleep(0.05)
+
+        # What is left after the last prompt is not ours
+        parts = prompt.split(data)[:len(commands)]
+
+        outputs = []
+        for command, part in zip(commands, parts):
+            lines = part.split("\n")
+            if self._key(lines[0]) != self._key(command):
+                raise ValueError(f"Expected echo of {command}, got {lines[0]!r}")
+
+            # Echo of a later command inside this output means they got mixed up
+            for line in lines[1:]:
+                if self._key(line) in (self._key(x) for x in commands):
+                    raise ValueError(f"Output of {command} mixed with {line!r}")
+
+            outputs.append("\n".join(lines[1:]).strip("\n"))
+
+        return outputs
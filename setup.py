@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
 import setuptools
+
 with open("README.md", "r", encoding="utf-8") as fh:
     long_description = fh.read()
 
@@ -25,5 +26,8 @@ setuptools.setup(
         "ciscoconfparse==1.6.50",
         "napalm==4.0.0"
     ],
+    extras_require={
+        "snmp": ["pysnmp>=7.1"]
+    },
     include_package_data=True
 )
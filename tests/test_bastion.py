@@ -0,0 +1,199 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pickle
+import socket
+import threading
+import unittest
+from unittest import mock
+
+import paramiko
+
+from netwalk import BastionPool, Switch
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+
+
+class BastionInterface(paramiko.ServerInterface):
+    "Accepts user jump and any direct-tcpip channel"
+
+    def __init__(self, destinations):
+        self.destinations = destinations
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username, password) == ('jump', 'jump'):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations.append(destination)
+        return paramiko.OPEN_SUCCEEDED
+
+
+class FakeBastion():
+    "Local SSH server acting as a bastion, forwarded channels echo what they get"
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(10)
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        self.destinations = []
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(HOST_KEY)
+            transport.start_server(server=BastionInterface(self.destinations))
+            self.transports.append(transport)
+            threading.Thread(target=self._accept, args=(transport,), daemon=True).start()
+
+    @staticmethod
+    def _accept(transport):
+        while transport.is_active():
+            channel = transport.accept(0.1)
+            if channel is not None:
+                threading.Thread(target=FakeBastion._echo, args=(channel,), daemon=True).start()
+
+    @staticmethod
+    def _echo(channel):
+        while True:
+            data = channel.recv(1024)
+            if not data:
+                return
+            channel.sendall(data)
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class TestBastionPool(unittest.TestCase):
+    def setUp(self):
+        self.bastion = FakeBastion()
+        self.pool = BastionPool('127.0.0.1', 'jump', 'jump', port=self.bastion.port,
+                                max_connections=2, channels_per_connection=2,
+                                host_key_policy=paramiko.AutoAddPolicy())
+
+    def tearDown(self):
+        self.pool.close()
+        self.bastion.close()
+
+    def test_channels_share_connections(self):
+        channels = [self.pool.open_channel(f"10.0.0.{i}") for i in range(1, 4)]
+        assert self.pool.connections == 2
+        assert len(self.bastion.transports) == 2
+        assert self.bastion.destinations == [('10.0.0.1', 22), ('10.0.0.2', 22), ('10.0.0.3', 22)]
+
+        channels[2].sendall(b"hello")
+        assert channels[2].recv(5) == b"hello"
+
+        # Both connections are busy and none can be added, the least busy one is used
+        self.pool.open_channel("10.0.0.4")
+        assert self.pool.connections == 2
+
+    def test_closed_channels_free_connection(self):
+        for i in range(1, 3):
+            self.pool.open_channel(f"10.0.0.{i}").close()
+
+        self.pool.open_channel("10.0.0.3")
+        assert self.pool.connections == 1
+
+    def test_lost_connection_replaced(self):
+        self.pool.open_channel("10.0.0.1")
+        self.bastion.transports[0].close()
+        self.bastion.transports[0].join(2)
+
+        channel = self.pool.open_channel("10.0.0.2")
+        channel.sendall(b"hello")
+        assert channel.recv(5) == b"hello"
+        assert len(self.bastion.transports) == 2
+
+    def test_slow_channel_does_not_block_others(self):
+        open_channel = paramiko.Transport.open_channel
+        entered = threading.Event()
+        release = threading.Event()
+        opened = []
+
+        def slow_open_channel(transport, kind, dest_addr=None, *args, **kwargs):
+            if dest_addr == ('10.0.0.1', 22):
+                entered.set()
+                release.wait(5)
+            channel = open_channel(transport, kind, dest_addr, *args, **kwargs)
+            opened.append(dest_addr[0])
+            return channel
+
+        with mock.patch.object(paramiko.Transport, 'open_channel', slow_open_channel):
+            slow = threading.Thread(target=self.pool.open_channel, args=("10.0.0.1",))
+            slow.start()
+            assert entered.wait(5)
+
+            self.pool.open_channel("10.0.0.2")
+            release.set()
+            slow.join(5)
+
+        assert opened == ['10.0.0.2', '10.0.0.1']
+        # Both shared the first connection, the slow channel was counted while opening
+        assert self.pool.connections == 1
+        self.pool.open_channel("10.0.0.3")
+        assert self.pool.connections == 2
+
+    def test_failed_connect_released(self):
+        with mock.patch.object(self.pool, '_connect', side_effect=OSError("unreachable")):
+            with self.assertRaises(OSError):
+                self.pool.open_channel("10.0.0.1")
+
+        assert self.pool.connections == 0
+        self.pool.open_channel("10.0.0.2")
+        self.pool.open_channel("10.0.0.3")
+        assert self.pool.connections == 1
+        assert len(self.bastion.transports) == 1
+
+    def test_pickle_drops_connections_and_password(self):
+        self.pool.open_channel("10.0.0.1")
+        loaded = pickle.loads(pickle.dumps(self.pool))
+        assert loaded.connections == 0
+        assert loaded._password is None
+
+    def test_switch_connects_through_bastion(self):
+        driver = mock.MagicMock()
+        sw = Switch("10.0.0.1", bastion=self.pool)
+
+        with mock.patch('napalm.get_network_driver', return_value=driver):
+            sw.connect('user', 'pass', {'secret': 'en4ble'})
+
+        optional_args = driver.call_args.kwargs['optional_args']
+        assert isinstance(optional_args['sock'], paramiko.Channel)
+        assert optional_args['secret'] == 'en4ble'
+        assert sw.napalm_optional_args == {'secret': 'en4ble'}
+        assert self.bastion.destinations == [('10.0.0.1', 22)]
+
+
+if __name__ == '__main__':
+    unittest.main()
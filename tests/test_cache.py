@@ -0,0 +1,195 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from napalm.base.exceptions import ConnectionException
+
+from netwalk import CapabilityCache, ConnectionProfileCache, Fabric, Switch
+from netwalk.cache import FileCache
+
+CREDENTIALS = [('cisco', 'cisco'), ('admin', 'S3cr3t!')]
+OPTIONAL_ARGS = [{'secret': 'en4ble'}, {'transport': 'telnet', 'secret': 'en4ble'}]
+
+
+class TestConnectionProfileCache(unittest.TestCase):
+    def test_no_profile_keeps_order(self):
+        cache = ConnectionProfileCache()
+        attempts = cache.order('10.0.0.1', CREDENTIALS, OPTIONAL_ARGS)
+        assert attempts == [(OPTIONAL_ARGS[0], CREDENTIALS[0]),
+                            (OPTIONAL_ARGS[0], CREDENTIALS[1]),
+                            (OPTIONAL_ARGS[1], CREDENTIALS[0]),
+                            (OPTIONAL_ARGS[1], CREDENTIALS[1])]
+
+    def test_cached_profile_first(self):
+        cache = ConnectionProfileCache()
+        cache.record_success('10.0.0.1', OPTIONAL_ARGS[1], CREDENTIALS[1], 1.5)
+        attempts = cache.order('10.0.0.1', CREDENTIALS, OPTIONAL_ARGS)
+        assert attempts[0] == (OPTIONAL_ARGS[1], CREDENTIALS[1])
+        assert len(attempts) == 4
+
+    def test_subnet_and_site_fallback(self):
+        cache = ConnectionProfileCache(site='milan')
+        cache.record_success('10.0.0.1', OPTIONAL_ARGS[1], CREDENTIALS[1], 1.5)
+
+        assert cache.get('10.0.0.2')['transport'] == 'telnet'
+        assert cache.get('10.99.0.2')['transport'] == 'telnet'
+
+        other_site = ConnectionProfileCache(site='rome')
+        other_site.profiles = cache.profiles
+        assert other_site.get('10.99.0.2') is None
+
+    def test_ttl(self):
+        cache = ConnectionProfileCache(ttl=60)
+        cache.record_success('10.0.0.1', OPTIONAL_ARGS[1], CREDENTIALS[1], 1.5)
+        for profile in cache.profiles.values():
+            profile['timestamp'] -= 120
+
+        assert cache.get('10.0.0.1') is None
+
+    def test_invalidate(self):
+        cache = ConnectionProfileCache()
+        cache.record_success('10.0.0.1', OPTIONAL_ARGS[1], CREDENTIALS[1], 1.5)
+        cache.invalidate(ipaddress.ip_address('10.0.0.1'))
+        assert 'host:10.0.0.1' not in cache.profiles
+        assert 'subnet:10.0.0.0/24' in cache.profiles
+
+    def test_persistence_without_secrets(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "profiles.json")
+            cache = ConnectionProfileCache(path)
+            cache.record_success('10.0.0.1', OPTIONAL_ARGS[1], CREDENTIALS[1], 1.5)
+            cache.save()
+
+            with open(path, 'r', encoding='utf-8') as infile:
+                content = infile.read()
+
+            assert 'S3cr3t!' not in content
+            assert 'en4ble' not in content
+
+            loaded = ConnectionProfileCache(path)
+            attempts = loaded.order('10.0.0.1', CREDENTIALS, OPTIONAL_ARGS)
+            assert attempts[0] == (OPTIONAL_ARGS[1], CREDENTIALS[1])
+
+    def test_fabric_learns_and_reuses_profile(self):
+        tried = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            tried.append((napalm_optional_args, (username, password)))
+            if napalm_optional_args != OPTIONAL_ARGS[1] or password != 'S3cr3t!':
+                raise ConnectionException("Login failed")
+            sw.login_time = 0.1
+
+        cache = ConnectionProfileCache()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            Fabric(connection_cache=cache).add_device(
+                Switch('10.0.0.1'), CREDENTIALS, OPTIONAL_ARGS)
+            assert len(tried) == 4
+
+            tried.clear()
+            Fabric(connection_cache=cache).add_device(
+                Switch('10.0.0.1'), CREDENTIALS, OPTIONAL_ARGS)
+            assert tried == [(OPTIONAL_ARGS[1], CREDENTIALS[1])]
+
+
+class TestFileCache(unittest.TestCase):
+    def test_incomplete_subclass(self):
+        class NoLoad(FileCache):
+            def _to_dict(self):
+                return {}
+
+        with self.assertRaises(TypeError):
+            NoLoad()
+
+
+class TestCapabilityCache(unittest.TestCase):
+    def test_device_skip_and_reprobe(self):
+        cache = CapabilityCache(reprobe_interval=60, min_observations=2)
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+        cache.record('10.0.0.1', 'ios:C2960', 'inventory', True)
+        assert cache.modules_to_skip('10.0.0.1') == set()
+
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+        assert cache.modules_to_skip(ipaddress.ip_address('10.0.0.1')) == {'vtp'}
+        assert cache.modules_to_skip('10.0.0.2') == set()
+
+        cache.devices['10.0.0.1']['vtp']['timestamp'] -= 120
+        assert cache.modules_to_skip('10.0.0.1') == set()
+
+    def test_platform_skip_needs_agreement(self):
+        cache = CapabilityCache(platform_min_samples=2)
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+        assert cache.modules_to_skip('10.0.0.9', 'ios:C2960') == set()
+
+        cache.record('10.0.0.2', 'ios:C2960', 'vtp', False)
+        assert cache.modules_to_skip('10.0.0.9', 'ios:C2960') == {'vtp'}
+        assert cache.modules_to_skip('10.0.0.9', 'ios:C9300') == set()
+
+        cache.record('10.0.0.3', 'ios:C2960', 'vtp', True)
+        assert cache.modules_to_skip('10.0.0.9', 'ios:C2960') == set()
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "capabilities.json")
+            cache = CapabilityCache(path, min_observations=1)
+            cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+            cache.save()
+
+            assert CapabilityCache(path, min_observations=1).modules_to_skip('10.0.0.1') == {'vtp'}
+
+            # Files written before only unsupported results were counted
+            with open(path, 'w') as outfile:
+                json.dump({'devices': {'10.0.0.1': {'vtp': {'has_data': False, 'timestamp': 0}}},
+                           'platforms': {'ios:C2960': {'vtp': {'empty': 3, 'has_data': 0, 'timestamp': 0}}}},
+                          outfile)
+            cache = CapabilityCache(path, min_observations=1)
+            assert cache.devices == {'10.0.0.1': {}}
+            assert cache.platforms == {'ios:C2960': {}}
+
+    def test_only_unsupported_counted_in_a_row(self):
+        cache = CapabilityCache(min_observations=2, platform_min_samples=2)
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', True)
+        cache.record('10.0.0.1', 'ios:C2960', 'vtp', False)
+        assert cache.modules_to_skip('10.0.0.1') == set()
+
+        # Core modules are never skipped, not even platform-wide
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            for _ in range(2):
+                cache.record(address, 'ios:C9300', 'cdp_neighbors', False)
+        assert cache.modules_to_skip('10.0.0.1', 'ios:C9300') == set()
+
+    def test_platform_per_device(self):
+        cache = CapabilityCache(reprobe_interval=60)
+        assert cache.get_platform('10.0.0.1') is None
+
+        cache.record_platform(ipaddress.ip_address('10.0.0.1'), 'nxos_ssh')
+        assert cache.get_platform('10.0.0.1') == 'nxos_ssh'
+
+        cache.device_platforms['10.0.0.1']['timestamp'] -= 120
+        assert cache.get_platform('10.0.0.1') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
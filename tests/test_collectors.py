@@ -0,0 +1,399 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import paramiko
+from lxml import etree
+from netaddr import EUI
+
+from netwalk import Switch, collectors
+from netwalk.collectors import (IosXeNetconfCollector, NxosJsonCollector,
+                                StructuredCollector)
+from tests.test_switch import FakeSession, fake_connect
+
+try:
+    from pyasn1.codec.ber import decoder, encoder
+    from pysnmp.proto import api
+    SNMP = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+except ImportError:
+    SNMP = None
+
+PAYLOADS = os.path.join(os.path.dirname(os.path.realpath(__file__)), "payloads")
+
+
+def payload(name):
+    with open(os.path.join(PAYLOADS, name), 'r', encoding='utf-8') as infile:
+        return infile.read()
+
+
+def netconf_data(name):
+    "Return the <data> element of a recorded NETCONF reply"
+    reply = etree.fromstring(payload(name).encode())
+    return reply.find("{urn:ietf:params:xml:ns:netconf:base:1.0}data")
+
+
+class TestStructuredCollector(unittest.TestCase):
+    def test_incomplete_subclass(self):
+        class NoCollect(StructuredCollector):
+            modules = ('interface_status',)
+
+        with self.assertRaises(TypeError):
+            NoCollect()
+
+
+class TestNxosJsonCollector(unittest.TestCase):
+    def test_interfaces(self):
+        sw = Switch("10.0.0.10", platform='nxos_ssh')
+        items = NxosJsonCollector().parse_interfaces(
+            sw, json.loads(payload("nxos_show_interface.json")))
+
+        assert items == 4
+        eth11 = sw.interfaces['Ethernet1/1']
+        assert eth11.is_enabled and eth11.is_up
+        assert eth11.description == "uplink to core"
+        assert eth11.mtu == "9216"
+        assert eth11.bandwidth == "10000000 Kbit"
+        assert eth11.mac_address == "5254.0012.3401"
+        assert (eth11.input_errors, eth11.crc, eth11.output_errors) == ("3", "2", "1")
+
+        eth12 = sw.interfaces['Ethernet1/2']
+        assert not eth12.is_enabled and not eth12.is_up
+
+        vlan10 = sw.interfaces['Vlan10']
+        assert vlan10.is_up and vlan10.description == "users"
+        assert vlan10.mtu == "1500"
+
+    def test_neighbors(self):
+        sw = Switch("10.0.0.10", platform='nxos_ssh')
+        assert NxosJsonCollector.parse_cdp(
+            sw, json.loads(payload("nxos_show_cdp_neighbors_detail.json"))) == 1
+        assert sw.interfaces['Ethernet1/1'].neighbors == [
+            {'hostname': 'core1.example.com',
+             'ip': ipaddress.ip_address('10.0.0.1'),
+             'platform': 'N9K-C93180YC-EX',
+             'remote_int': 'Ethernet1/49',
+             'capabilities': 'router switch IGMP_cnd_filtering Supports-STP-Dispute'}]
+
+        NxosJsonCollector.parse_lldp(
+            sw, json.loads(payload("nxos_show_lldp_neighbors_detail.json")))
+        assert sw.interfaces['Ethernet1/3'].neighbors[0]['hostname'] == 'access1'
+        assert sw.interfaces['Ethernet1/3'].neighbors[0]['remote_int'] == 'GigabitEthernet0/1'
+        assert sw.interfaces['Ethernet1/3'].neighbors[0]['capabilities'] == 'B'
+        # No management address, left out like in the text parser
+        assert 'Ethernet1/4' not in sw.interfaces
+
+    def test_switch_uses_json(self):
+        session = FakeSession(outputs={
+            "show interface | json": payload("nxos_show_interface.json"),
+            "show cdp neighbors detail | json": payload("nxos_show_cdp_neighbors_detail.json"),
+            "show lldp neighbors detail | json": ""})
+        sw = Switch("10.0.0.10", platform='nxos_ssh')
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass')
+
+        assert sw.scan_results['interface_status']['status'] == 'ok'
+        assert sw.scan_results['interface_status']['collector'] == 'nxos_json'
+        assert sw.scan_results['cdp_neighbors']['items'] == 1
+        assert sw.scan_results['lldp_neighbors']['items'] == 0
+        assert sw.scan_results['inventory']['status'] == 'skipped'
+        assert sw.interfaces['Ethernet1/1'].neighbors[0]['hostname'] == 'core1.example.com'
+        assert "show cdp neighbors detail" not in session.commands
+
+    def test_no_json_support(self):
+        session = FakeSession(outputs={
+            "show interface | json": "% Invalid command at '^' marker."})
+        sw = Switch("10.0.0.10", platform='nxos_ssh')
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={'whitelist': ['interface_status']})
+
+        # No text parser for NX-OS to fall back to
+        assert sw.scan_results['interface_status']['status'] == 'failed'
+        assert 'did not return JSON' in sw.scan_results['interface_status']['error']
+
+
+class FakeReply():
+    def __init__(self, data_ele):
+        self.data_ele = data_ele
+
+
+class TestIosXeNetconfCollector(unittest.TestCase):
+    def test_interfaces(self):
+        sw = Switch("10.0.0.20")
+        items = IosXeNetconfCollector.parse_interfaces(
+            sw, netconf_data("iosxe_interfaces_oper.xml"))
+
+        assert items == 2
+        gi1 = sw.interfaces['GigabitEthernet1/0/1']
+        assert gi1.is_enabled and gi1.is_up
+        assert gi1.description == "server 1"
+        assert gi1.mac_address == "001e.7a12.3401"
+        assert gi1.bandwidth == "1000000 Kbit"
+        assert (gi1.input_errors, gi1.crc, gi1.output_errors) == ("4", "3", "0")
+        assert not sw.interfaces['GigabitEthernet1/0/2'].is_enabled
+
+    def test_switch_uses_netconf_and_falls_back(self):
+        replies = {'interface_status': netconf_data("iosxe_interfaces_oper.xml"),
+                   'cdp_neighbors': netconf_data("iosxe_cdp_oper.xml")}
+
+        def get(filter):
+            module = 'cdp_neighbors' if 'cdp' in filter[1] else 'interface_status'
+            return FakeReply(replies[module])
+
+        manager = mock.MagicMock()
+        manager.get.side_effect = get
+        options = {'whitelist': ['interface_status', 'cdp_neighbors'],
+                   'collectors': ['iosxe_netconf']}
+
+        session = FakeSession()
+        sw = Switch("10.0.0.20")
+        with mock.patch.object(Switch, 'connect', fake_connect(session)), \
+                mock.patch('ncclient.manager.connect', return_value=manager) as connect:
+            sw.retrieve_data('user', 'pass', scan_options=options)
+
+        assert connect.call_count == 1
+        assert connect.call_args.kwargs['username'] == 'user'
+        assert connect.call_args.kwargs['hostkey_verify'] is True
+        assert sw.scan_results['cdp_neighbors']['collector'] == 'iosxe_netconf'
+        assert sw.interfaces['GigabitEthernet1/0/1'].neighbors[0]['hostname'] == 'dist1.example.com'
+        assert sw.interfaces['GigabitEthernet1/0/1'].neighbors[0]['capabilities'] == 'router switch igmp'
+        assert "show interfaces" not in session.commands
+        manager.close_session.assert_called_once()
+
+        # No NETCONF on the device, text parsers are used for the whole scan
+        session = FakeSession()
+        sw = Switch("10.0.0.20")
+        with mock.patch.object(Switch, 'connect', fake_connect(session)), \
+                mock.patch('ncclient.manager.connect', side_effect=OSError("Connection refused")) as connect:
+            sw.retrieve_data('user', 'pass', scan_options=options)
+
+        # Neighbors run first, interfaces do not try NETCONF again
+        assert connect.call_count == 1
+        assert sw.scan_results['cdp_neighbors']['status'] == 'ok'
+        assert sw.scan_results['cdp_neighbors']['collector'] == 'cli'
+        assert sw.scan_results['interface_status']['status'] == 'ok'
+        assert "show interfaces" in session.commands
+        assert "show cdp neighbors detail" in session.commands
+
+    def test_host_key_verification(self):
+        key = paramiko.RSAKey.generate(1024)
+        fingerprint = ":".join(f"{x:02x}" for x in key.get_fingerprint())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'known_hosts')
+            with open(path, 'w', encoding='utf-8') as outfile:
+                outfile.write(f"[10.0.0.20]:830 {key.get_name()} {key.get_base64()}\n")
+
+            check = IosXeNetconfCollector(('user', 'pass'), known_hosts=path)._known_host_cb()
+            assert check('10.0.0.20', fingerprint)
+            assert not check('10.0.0.21', fingerprint)
+            assert not check('10.0.0.20', "00:" * 15 + "00")
+
+        assert not IosXeNetconfCollector(('user', 'pass'))._known_host_cb()('10.0.0.20', fingerprint)
+
+        # Turning verification off has to be asked for
+        manager = mock.MagicMock()
+        sw = Switch("10.0.0.20")
+        with mock.patch.object(Switch, 'connect', fake_connect(FakeSession())), \
+                mock.patch('ncclient.manager.connect', return_value=manager) as connect:
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['cdp_neighbors'],
+                'collectors': ['iosxe_netconf'],
+                'collector_options': {'iosxe_netconf': {'verify_host_key': False}}})
+
+        assert connect.call_args.kwargs['hostkey_verify'] is False
+
+
+class SnmpSimulator():
+    "Local SNMPv2c agent answering GETBULK from {community: {OID tuple: value}}"
+
+    def __init__(self, communities):
+        self.communities = {k: {tuple(int(x) for x in oid.split('.')): value
+                                for oid, value in v.items()}
+                            for k, v in communities.items()}
+        self.requests = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except OSError:
+                return
+
+            message, _ = decoder.decode(data, asn1Spec=SNMP.Message())
+            community = str(SNMP.apiMessage.get_community(message))
+            request = SNMP.apiMessage.get_pdu(message)
+            response_message = SNMP.apiMessage.get_response(message)
+            response = SNMP.apiMessage.get_pdu(response_message)
+
+            oids = self.communities.get(community, {})
+            repetitions = SNMP.apiBulkPDU.get_max_repetitions(request)
+            var_binds = []
+            for oid, _ in SNMP.apiBulkPDU.get_varbinds(request):
+                oid = tuple(oid)
+                self.requests.append((community, oid))
+                following = sorted(x for x in oids if x > oid)[:repetitions]
+                var_binds += [(x, oids[x]) for x in following]
+                if len(following) < repetitions:
+                    var_binds.append((following[-1] if following else oid, SNMP.EndOfMibView()))
+
+            SNMP.apiBulkPDU.set_varbinds(response, var_binds)
+            self.sock.sendto(encoder.encode(response_message), address)
+
+    def close(self):
+        self.sock.close()
+
+
+def snmp_agent():
+    "Simulated Cisco switch without Q-BRIDGE-MIB"
+    interfaces = {}
+    for index, name, admin, oper, alias in ((1, "Gi1/0/1", 1, 1, b"server 1"),
+                                           (2, "Gi1/0/2", 1, 2, b""),
+                                           (3, "Nu0", 1, 1, b"")):
+        interfaces.update({
+            f'1.3.6.1.2.1.31.1.1.1.1.{index}': SNMP.OctetString(name),
+            f'1.3.6.1.2.1.31.1.1.1.18.{index}': SNMP.OctetString(alias),
+            f'1.3.6.1.2.1.2.2.1.7.{index}': SNMP.Integer(admin),
+            f'1.3.6.1.2.1.2.2.1.8.{index}': SNMP.Integer(oper),
+            f'1.3.6.1.2.1.2.2.1.4.{index}': SNMP.Integer(1500),
+            f'1.3.6.1.2.1.31.1.1.1.15.{index}': SNMP.Gauge32(1000),
+            f'1.3.6.1.2.1.2.2.1.6.{index}': SNMP.OctetString(bytes([0, 0x1e, 0x7a, 0x12, 0x34, index])),
+            f'1.3.6.1.2.1.2.2.1.14.{index}': SNMP.Counter32(4),
+            f'1.3.6.1.2.1.2.2.1.20.{index}': SNMP.Counter32(0),
+            f'1.3.6.1.2.1.31.1.1.1.7.{index}': SNMP.Counter64(456789),
+            f'1.3.6.1.2.1.31.1.1.1.11.{index}': SNMP.Counter64(654321),
+            f'1.3.6.1.2.1.10.7.2.1.3.{index}': SNMP.Counter32(3)})
+
+    cdp = {'1.3.6.1.4.1.9.9.23.1.2.1.1.3.1.5': SNMP.Integer(1),
+           '1.3.6.1.4.1.9.9.23.1.2.1.1.4.1.5': SNMP.OctetString(bytes([10, 0, 0, 2])),
+           '1.3.6.1.4.1.9.9.23.1.2.1.1.6.1.5': SNMP.OctetString("dist1.example.com"),
+           '1.3.6.1.4.1.9.9.23.1.2.1.1.7.1.5': SNMP.OctetString("TenGigabitEthernet1/1/1"),
+           '1.3.6.1.4.1.9.9.23.1.2.1.1.8.1.5': SNMP.OctetString("cisco C9500-24Y4C"),
+           '1.3.6.1.4.1.9.9.23.1.2.1.1.9.1.5': SNMP.OctetString(bytes([0, 0, 0, 0x29]))}
+
+    lldp = {'1.0.8802.1.1.2.1.3.7.1.3.2': SNMP.OctetString("Gi1/0/2"),
+            '1.0.8802.1.1.2.1.4.1.1.6.0.2.3': SNMP.Integer(5),
+            '1.0.8802.1.1.2.1.4.1.1.7.0.2.3': SNMP.OctetString("Gi0"),
+            '1.0.8802.1.1.2.1.4.1.1.9.0.2.3': SNMP.OctetString("ap1"),
+            '1.0.8802.1.1.2.1.4.1.1.10.0.2.3': SNMP.OctetString("Cisco AP Software"),
+            '1.0.8802.1.1.2.1.4.1.1.12.0.2.3': SNMP.OctetString(bytes([0x10])),
+            '1.0.8802.1.1.2.1.4.2.1.3.0.2.3.1.4.10.0.0.30': SNMP.Integer(2)}
+
+    # BRIDGE-MIB is only there with the VLAN in the community
+    vlan10 = {'1.3.6.1.2.1.17.4.3.1.2.0.17.34.51.68.85': SNMP.Integer(1),
+              '1.3.6.1.2.1.17.1.4.1.2.1': SNMP.Integer(1)}
+
+    return SnmpSimulator({'public': {**interfaces, **cdp, **lldp},
+                          'public@10': vlan10})
+
+
+@unittest.skipIf(collectors.bulk_walk_cmd is None or SNMP is None, "pysnmp is not installed")
+class TestSnmpCollector(unittest.TestCase):
+    config = ("interface GigabitEthernet1/0/1\n"
+              " switchport mode access\n"
+              " switchport access vlan 10\n"
+              "!\n"
+              "interface GigabitEthernet1/0/2\n"
+              " switchport mode access\n"
+              "!\n")
+
+    def setUp(self):
+        self.agent = snmp_agent()
+
+    def tearDown(self):
+        self.agent.close()
+
+    def scan(self, options):
+        session = FakeSession(config=self.config)
+        sw = Switch("127.0.0.1")
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options=options)
+
+        return sw, session
+
+    def test_all_modules(self):
+        sw, session = self.scan({'whitelist': ['mac_address', 'interface_status',
+                                               'cdp_neighbors', 'lldp_neighbors'],
+                                 'collectors': ['snmp'],
+                                 'collector_options': {'snmp': {'port': self.agent.port}}})
+
+        for module in ('mac_address', 'interface_status', 'cdp_neighbors', 'lldp_neighbors'):
+            assert sw.scan_results[module]['status'] == 'ok'
+            assert sw.scan_results[module]['collector'] == 'snmp'
+        assert session.commands == ['get_facts', 'get_config']
+
+        gi1 = sw.interfaces['GigabitEthernet1/0/1']
+        assert gi1.is_enabled and gi1.is_up
+        assert gi1.description == "server 1"
+        assert gi1.mac_address == "001e.7a12.3401"
+        assert gi1.bandwidth == "1000000 Kbit"
+        assert (gi1.input_errors, gi1.crc, gi1.output_errors) == ("4", "3", "0")
+        assert not sw.interfaces['GigabitEthernet1/0/2'].is_up
+        assert 'Null0' not in sw.interfaces
+
+        assert sw.mac_table == {EUI('00:11:22:33:44:55'): {'interface': gi1, 'vlan': 10}}
+        assert gi1.mac_count == 1
+        assert ('public@10', (1, 3, 6, 1, 2, 1, 17, 4, 3, 1, 2)) in self.agent.requests
+
+        assert gi1.neighbors == [{'hostname': 'dist1.example.com',
+                                  'ip': ipaddress.ip_address('10.0.0.2'),
+                                  'platform': 'cisco C9500-24Y4C',
+                                  'remote_int': 'TenGigabitEthernet1/1/1',
+                                  'capabilities': 'Router Switch IGMP'}]
+        assert sw.interfaces['GigabitEthernet1/0/2'].neighbors == [
+            {'hostname': 'ap1',
+             'ip': ipaddress.ip_address('10.0.0.30'),
+             'platform': 'Cisco AP Software',
+             'remote_int': 'Gi0',
+             'capabilities': 'W'}]
+
+    def test_per_module(self):
+        sw, session = self.scan({'whitelist': ['mac_address', 'cdp_neighbors'],
+                                 'collectors': {'mac_address': 'snmp'},
+                                 'collector_options': {'snmp': {'port': self.agent.port}}})
+
+        assert sw.scan_results['mac_address']['collector'] == 'snmp'
+        assert 'collector' not in sw.scan_results['cdp_neighbors']
+        assert 'get_mac_address_table' not in session.commands
+        assert 'show cdp neighbors detail' in session.commands
+
+    def test_no_agent_falls_back(self):
+        self.agent.close()
+        sw, session = self.scan({'whitelist': ['mac_address'],
+                                 'collectors': ['snmp'],
+                                 'collector_options': {'snmp': {'port': self.agent.port,
+                                                                'timeout': 0.2,
+                                                                'retries': 0}}})
+
+        assert sw.scan_results['mac_address']['status'] == 'ok'
+        assert sw.scan_results['mac_address']['collector'] == 'cli'
+        assert 'get_mac_address_table' in session.commands
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import pickle
+import threading
+import unittest
+
+from netwalk import Fabric
+from netwalk.coordinator import DiscoveryCoordinator
+
+
+class TestDiscoveryCoordinator(unittest.TestCase):
+    def test_transitions(self):
+        c = DiscoveryCoordinator()
+        assert c.transition('a', c.QUEUED)
+        assert c.transition('a', c.QUEUED)
+        assert c.transition('a', c.CONNECTING)
+        # Cannot go back to waiting while connected
+        assert not c.transition('a', c.QUEUED)
+        assert c.transition('a', c.TIMEOUT)
+        assert not c.transition('a', c.COLLECTED)
+        assert c.snapshot()['a'] == c.TIMEOUT
+
+        assert not c.transition('b', c.COLLECTED)
+        assert 'b' not in c.snapshot()
+
+        with self.assertRaises(AssertionError):
+            c.transition('a', 'Done')
+
+    def test_expected(self):
+        c = DiscoveryCoordinator()
+        assert c.transition('a', c.QUEUED, expected=[None])
+        assert not c.transition('a', c.SKIPPED, expected=[None])
+        assert c.snapshot()['a'] == c.QUEUED
+
+    def test_snapshot_immutable(self):
+        c = DiscoveryCoordinator({'a': "Queued"})
+        snapshot = c.snapshot()
+        c.transition('a', c.CONNECTING)
+        c.transition('b', c.QUEUED)
+
+        assert snapshot == {'a': "Queued"}
+        assert c.snapshot() == {'a': "Connecting", 'b': "Queued"}
+        with self.assertRaises(TypeError):
+            snapshot['a'] = "Failed"
+
+        assert c.summary() == {'Connecting': 1, 'Queued': 1}
+
+    def test_queued_once(self):
+        c = DiscoveryCoordinator()
+        won = []
+        barrier = threading.Barrier(8)
+
+        def claim(i):
+            barrier.wait()
+            if c.transition('a', c.QUEUED, expected=[None]):
+                won.append(i)
+
+        threads = [threading.Thread(target=claim, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(won) == 1
+
+    def test_fabric_discovery_status_writable(self):
+        f = Fabric()
+        a, b = ipaddress.ip_address('1.1.1.1'), ipaddress.ip_address('2.2.2.2')
+        f.discovery_status = {a: "Failed"}
+        assert f.coordinator.snapshot() == {a: "Failed"}
+
+        status = f.discovery_status
+        with self.assertWarns(DeprecationWarning):
+            status[b] = "Unreachable"
+        assert status == {a: "Failed", b: "Unreachable"}
+        assert f.coordinator.transition(b, DiscoveryCoordinator.QUEUED)
+
+        with self.assertWarns(DeprecationWarning):
+            del f.discovery_status[a]
+        assert f.discovery_status == {b: "Queued"}
+
+        with self.assertRaises(AssertionError):
+            f.discovery_status = {a: "Done"}
+
+    def test_pickle(self):
+        f = Fabric()
+        f.coordinator.transition(ipaddress.ip_address('1.1.1.1'), DiscoveryCoordinator.UNREACHABLE)
+        g = pickle.loads(pickle.dumps(f))
+        assert g.discovery_status == {ipaddress.ip_address('1.1.1.1'): "Unreachable"}
+        assert g.coordinator.transition(ipaddress.ip_address('1.1.1.1'), DiscoveryCoordinator.QUEUED)
+
+        # Snapshots taken before the coordinator existed
+        state = dict(f.__dict__)
+        state.pop('coordinator')
+        state['discovery_status'] = {ipaddress.ip_address('2.2.2.2'): "Failed"}
+        h = Fabric.__new__(Fabric)
+        h.__setstate__(state)
+        assert h.discovery_status == {ipaddress.ip_address('2.2.2.2'): "Failed"}
+
+
+if __name__ == '__main__':
+    unittest.main()
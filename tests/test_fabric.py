@@ -16,8 +16,21 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
-from netwalk import Fabric, Switch, Interface
+from datetime import datetime as dt
+from unittest import mock
+
+from napalm.base.exceptions import ConnectionException
+from netaddr import EUI
+
+from netwalk import Fabric, Interface, Switch
+from netwalk.device import DeadlineExceeded, Device
 
 
 class TestFabricBase(unittest.TestCase):
@@ -330,6 +343,437 @@ class TestFabricBase(unittest.TestCase):
             'interface': c.interfaces['GigabitEthernet0/2']}
         assert c.interfaces['GigabitEthernet0/2'].mac_count == 1
 
+    def test_config_fetch_summary(self):
+        f = Fabric()
+        for name, method, duration in (('A', 'scp', 1.0), ('B', 'scp', 3.0), ('C', 'cli', 20.0)):
+            sw = Switch('1.1.1.1', hostname=name, facts={'model': 'C2960'})
+            sw.config_fetch = {'method': method, 'duration': duration, 'size': 1000}
+            f.devices[name] = sw
+        f.devices['D'] = Device('4.4.4.4', hostname='D')
+
+        assert f.config_fetch_summary() == {
+            'ios:C2960': {'scp': {'devices': 2, 'mean_duration': 2.0, 'mean_size': 1000},
+                          'cli': {'devices': 1, 'mean_duration': 20.0, 'mean_size': 1000}}}
+
+
+class TestFabricDiscovery(unittest.TestCase):
+    def test_neighbors_queued_before_device_completes(self):
+        """
+        A --- B
+        B must be queued while A is still collecting data
+        """
+        b_started = threading.Event()
+        b_started_before_a_finished = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+            if sw.hostname == 'A':
+                gi00 = Interface(name='GigabitEthernet0/0')
+                gi00.neighbors.append({'hostname': 'B',
+                                       'ip': ipaddress.ip_address('2.2.2.2'),
+                                       'platform': 'cisco WS-C2960',
+                                       'remote_int': 'GigabitEthernet0/0'})
+                sw.add_interface(gi00)
+                neighbors_callback(sw)
+                b_started_before_a_finished.append(b_started.wait(5))
+            else:
+                b_started.set()
+                sw.add_interface(Interface(name='GigabitEthernet0/0'))
+
+        f = Fabric()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            f.init_from_seed_device([Switch('1.1.1.1', hostname='A')],
+                                    [('user', 'pass')],
+                                    parallel_threads=2)
+
+        assert b_started_before_a_finished == [True]
+        assert isinstance(f.devices['B'], Switch)
+        assert f.devices['A'].interfaces['GigabitEthernet0/0'].neighbors == [
+            f.devices['B'].interfaces['GigabitEthernet0/0']]
+
+    def test_links_resolved_as_devices_complete(self):
+        """
+        A --- B --- C
+        A-B is linked by the time C is discovered, C-B once C completes
+        """
+        links_seen_by_c = []
+        f = Fabric()
+
+        def neighbor(hostname, address):
+            return {'hostname': hostname,
+                    'ip': ipaddress.ip_address(address),
+                    'platform': 'cisco WS-C2960',
+                    'remote_int': 'GigabitEthernet0/0'}
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+            gi00 = Interface(name='GigabitEthernet0/0')
+            sw.add_interface(gi00)
+            if sw.hostname == 'A':
+                gi00.neighbors.append(neighbor('B.example.com', '2.2.2.2'))
+            elif sw.hostname == 'B.example.com':
+                gi01 = Interface(name='GigabitEthernet0/1')
+                gi01.neighbors.append(neighbor('C', '3.3.3.3'))
+                sw.add_interface(gi01)
+                gi00.neighbors.append(neighbor('A', '1.1.1.1'))
+            else:
+                links_seen_by_c.append(list(f.devices['A'].interfaces['GigabitEthernet0/0'].neighbors))
+                gi00.neighbors.append({'hostname': 'B', 'ip': None, 'platform': 'cisco WS-C2960',
+                                       'remote_int': 'GigabitEthernet0/1'})
+
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data), \
+                mock.patch.object(Fabric, '_find_links') as find_links:
+            f.init_from_seed_device([Switch('1.1.1.1', hostname='A')],
+                                    [('user', 'pass')])
+
+        a, b, c = (f.devices[x] for x in ('A', 'B.example.com', 'C'))
+        assert links_seen_by_c == [[b.interfaces['GigabitEthernet0/0']]]
+        assert b.interfaces['GigabitEthernet0/1'].neighbors == [c.interfaces['GigabitEthernet0/0']]
+        assert c.interfaces['GigabitEthernet0/0'].neighbors == [b.interfaces['GigabitEthernet0/1']]
+        find_links.assert_not_called()
+
+    def test_duplicates_merged(self):
+        """
+        A G0/0 --- G0/0 B, reported as B at 2.2.2.2
+        A G0/1 --- G0/1 B, reported as b.example.com at 2.2.2.3, an SVI of B
+        A G0/2 --- G0/2 B, reported as core at 2.2.2.4, found by serial
+        """
+        logins = []
+
+        def neighbor(hostname, address, port):
+            return {'hostname': hostname,
+                    'ip': ipaddress.ip_address(address),
+                    'platform': 'cisco WS-C2960',
+                    'remote_int': port}
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            logins.append(str(sw.mgmt_address))
+            for port in ('GigabitEthernet0/0', 'GigabitEthernet0/1', 'GigabitEthernet0/2'):
+                sw.add_interface(Interface(name=port))
+
+            if sw.hostname == 'A':
+                sw.facts = {'hostname': 'A', 'fqdn': 'A', 'serial_number': 'FOC1'}
+                for port, (hostname, address) in zip(sw.interfaces, (('B', '2.2.2.2'),
+                                                                     ('b.example.com', '2.2.2.3'),
+                                                                     ('core', '2.2.2.4'))):
+                    sw.interfaces[port].neighbors.append(neighbor(hostname, address, port))
+            else:
+                sw.facts = {'hostname': 'B', 'fqdn': 'B.example.com', 'serial_number': 'FOC2'}
+                sw.interfaces_ip = {'Vlan10': {'ipv4': {'2.2.2.3': {'prefix_length': 24}}}}
+                if str(sw.mgmt_address) == '2.2.2.2':
+                    # Queued 2.2.2.3 is dropped once the facts are known
+                    neighbors_callback(sw)
+                    for _ in range(50):
+                        if f.discovery_status.get(ipaddress.ip_address('2.2.2.3')) == "Duplicate":
+                            break
+                        time.sleep(0.1)
+
+        f = Fabric()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            f.init_from_seed_device([Switch('1.1.1.1', hostname='A')],
+                                    [('user', 'pass')])
+
+        b = f.devices['B']
+        assert logins == ['1.1.1.1', '2.2.2.2', '2.2.2.4']
+        assert f.discovery_status[ipaddress.ip_address('2.2.2.3')] == "Duplicate"
+        assert f.discovery_status[ipaddress.ip_address('2.2.2.4')] == "Duplicate"
+        assert [x for x in f.devices.values() if isinstance(x, Switch)] == [f.devices['A'], b]
+        assert f.devices.resolve('core') is b
+        assert f.devices.by_address('2.2.2.4') is b
+        for port in ('GigabitEthernet0/0', 'GigabitEthernet0/1', 'GigabitEthernet0/2'):
+            assert f.devices['A'].interfaces[port].neighbors == [b.interfaces[port]]
+
+    def test_warm_start_queues_known_switches_at_once(self):
+        """
+        A --- B --- C
+        All three are logged into in parallel, C is gone
+        """
+        previous = Fabric()
+        for hostname, address in (('A', '1.1.1.1'), ('B', '2.2.2.2'), ('C', '3.3.3.3')):
+            Switch(address, hostname=hostname, fabric=previous)
+
+        everyone_in = threading.Barrier(3, timeout=5)
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            everyone_in.wait()
+            if sw.hostname == 'C':
+                raise ConnectionException("Gone")
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot = os.path.join(tmpdir, "fabric.bin")
+            previous.save(snapshot)
+
+            f = Fabric()
+            with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+                f.init_from_seed_device(['1.1.1.1'],
+                                        [('user', 'pass')],
+                                        parallel_threads=3,
+                                        warm_start=snapshot)
+
+        assert isinstance(f.devices['A'], Switch)
+        assert isinstance(f.devices['B'], Switch)
+        assert not isinstance(f.devices['C'], Switch)
+        assert f.warm_start_diff == {'new': set(), 'vanished': {'C'}}
+
+    def test_neighbor_platform_detected(self):
+        sw = Switch('1.1.1.1', hostname='A')
+        gi00 = Interface(name='GigabitEthernet0/0')
+        gi00.neighbors.append({'hostname': 'B',
+                               'ip': ipaddress.ip_address('2.2.2.2'),
+                               'platform': 'N9K-C93180YC-EX',
+                               'remote_int': 'Ethernet1/1'})
+        sw.add_interface(gi00)
+
+        new = Fabric()._evaluate_neighbors(sw)
+        assert new[0].platform == 'nxos_ssh'
+        assert new[0].platform_source == 'neighbor'
+
+        new[0].promote_to_switch()
+        assert isinstance(new[0], Switch)
+        assert new[0].platform == 'nxos_ssh'
+        assert new[0].platform_source == 'neighbor'
+
+    def test_preflight_skips_unreachable(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        ssh_port = listener.getsockname()[1]
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        telnet_port = sock.getsockname()[1]
+        sock.close()
+
+        optional_args = [{'transport': 'telnet', 'port': telnet_port},
+                         {'port': ssh_port}]
+        tried = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            tried.append((str(sw.mgmt_address), napalm_optional_args))
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+
+        f = Fabric()
+        start = time.monotonic()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            # 127.0.0.2 answers on neither port
+            f.init_from_seed_device(['127.0.0.1', '127.0.0.2'],
+                                    [('user', 'pass')],
+                                    optional_args,
+                                    parallel_threads=2,
+                                    preflight_timeout=0.5)
+        elapsed = time.monotonic() - start
+        listener.close()
+
+        # Without the probe 127.0.0.2 would take a full Switch.timeout per login method
+        assert elapsed < 1
+        assert tried == [('127.0.0.1', {'port': ssh_port})]
+        assert f.discovery_status[ipaddress.ip_address('127.0.0.2')] == "Unreachable"
+
+    def test_timeout_keeps_partial_switch(self):
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            sw.facts = {'hostname': 'A', 'fqdn': 'A'}
+            raise DeadlineExceeded("vtp took too long")
+
+        f = Fabric()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            f.init_from_seed_device(['1.1.1.1'], [('user', 'pass')])
+
+        assert isinstance(f.devices['1.1.1.1'], Switch)
+        assert f.discovery_status[ipaddress.ip_address('1.1.1.1')] == "Timeout"
+
+    def test_global_deadline(self):
+        release = threading.Event()
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            release.wait(5)
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+
+        f = Fabric()
+        start = time.monotonic()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            timer = threading.Timer(1, release.set)
+            timer.start()
+            f.init_from_seed_device(['1.1.1.1', '2.2.2.2'], [('user', 'pass')],
+                                    parallel_threads=1, deadline=0.3)
+        timer.cancel()
+
+        # The first device was running and got to finish, the second never started
+        assert time.monotonic() - start < 2
+        assert isinstance(f.devices['1.1.1.1'], Switch)
+        assert not isinstance(f.devices['2.2.2.2'], Switch)
+        assert f.discovery_status[ipaddress.ip_address('2.2.2.2')] == "Timeout"
+
+    def test_hedge_slow_device(self):
+        first_attempt = threading.Event()
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            if sw.hostname == '10.0.0.99' and not first_attempt.is_set():
+                # Stuck until aborted by the hedge
+                first_attempt.set()
+                sw._aborted = None
+                give_up = time.monotonic() + 5
+                while sw._aborted is None and time.monotonic() < give_up:
+                    time.sleep(0.01)
+                raise DeadlineExceeded(sw._aborted)
+
+            time.sleep(0.05)
+            sw.facts = {'hostname': sw.hostname, 'fqdn': sw.hostname}
+
+        f = Fabric()
+        f.HEDGE_MIN_SAMPLES = 3
+        seeds = ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.99']
+        start = time.monotonic()
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            f.init_from_seed_device(seeds, [('user', 'pass')],
+                                    parallel_threads=3, hedge=True)
+
+        assert time.monotonic() - start < 3
+        assert isinstance(f.devices['10.0.0.99'], Switch)
+        assert f.devices['10.0.0.99'].facts is not None
+
+    def test_neighbors_read_while_interfaces_grow(self):
+        f = Fabric()
+        sw = Switch('1.1.1.1', hostname='A', fabric=f, facts={'hostname': 'A', 'fqdn': 'A'})
+        for i in range(200):
+            sw.add_interface(Interface(name=f'GigabitEthernet0/{i}',
+                                       neighbors=[{'hostname': 'A', 'ip': None,
+                                                   'platform': '', 'remote_int': 'x'}]))
+
+        # The discovery thread keeps finding interfaces, e.g. SVIs, after calling back
+        stop = threading.Event()
+
+        def grow():
+            i = 0
+            while not stop.is_set():
+                sw.add_interface(Interface(name=f'Vlan{i}'))
+                i += 1
+
+        worker = threading.Thread(target=grow)
+        worker.start()
+        try:
+            give_up = time.monotonic() + 0.5
+            while time.monotonic() < give_up:
+                assert f._evaluate_neighbors(sw) == []
+                f.devices.reindex(sw)
+        finally:
+            stop.set()
+            worker.join()
+
+
+class TestFabricRefresh(unittest.TestCase):
+    def setUp(self):
+        """
+        A G0/0 --- G0/0 B
+        PC mac on A G0/1
+        """
+        self.pcmac = EUI("01:01:01:01:01:01")
+        self.f = Fabric()
+        for hostname, address in (('A', '1.1.1.1'), ('B', '2.2.2.2'), ('C', '3.3.3.3')):
+            sw = Switch(address, hostname=hostname, fabric=self.f,
+                        facts={'hostname': hostname, 'fqdn': hostname})
+            sw.add_interface(Interface(name='GigabitEthernet0/0'))
+            sw.add_interface(Interface(name='GigabitEthernet0/1'))
+            sw.discovery_status = dt.now()
+
+        a = self.f.devices['A']
+        a.interfaces['GigabitEthernet0/0'].neighbors.append({'hostname': 'B',
+                                                             'remote_int': 'GigabitEthernet0/0'})
+        a.mac_table = {self.pcmac: {'interface': a.interfaces['GigabitEthernet0/1']}}
+        self.f.refresh_global_information()
+
+    def test_moved_link_and_mac(self):
+        """
+        A G0/0 --- G0/0 C
+        PC mac on A G0/0
+        """
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            gi00 = sw.interfaces['GigabitEthernet0/0']
+            gi00.neighbors.append({'hostname': 'C', 'remote_int': 'GigabitEthernet0/0'})
+            sw.mac_table = {self.pcmac: {'interface': gi00}}
+            sw.scan_results = {'cdp_neighbors': {'status': 'ok'},
+                               'mac_address': {'status': 'ok'}}
+
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            report = self.f.refresh([('user', 'pass')], devices=['A'])
+
+        a, b, c = (self.f.devices[x] for x in 'ABC')
+        assert a.interfaces['GigabitEthernet0/0'].neighbors == [c.interfaces['GigabitEthernet0/0']]
+        assert c.interfaces['GigabitEthernet0/0'].neighbors == [a.interfaces['GigabitEthernet0/0']]
+        assert b.interfaces['GigabitEthernet0/0'].neighbors == []
+        assert self.f.mac_table[self.pcmac]['interface'] is a.interfaces['GigabitEthernet0/0']
+        assert report == {'A': {'status': 'Completed',
+                                'config_changed': None,
+                                'neighbors_added': {('GigabitEthernet0/0', 'C', 'GigabitEthernet0/0')},
+                                'neighbors_removed': {('GigabitEthernet0/0', 'B', 'GigabitEthernet0/0')},
+                                'macs_added': set(),
+                                'macs_removed': set(),
+                                'macs_moved': {self.pcmac}}}
+
+    def test_select_by_any_name(self):
+        c = self.f.devices['C']
+        c.facts = {'hostname': 'C', 'fqdn': 'C.example.com', 'serial_number': 'FOC1234'}
+        self.f.devices.reindex(c)
+        polled = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            polled.append(sw.hostname)
+            sw.scan_results = {}
+
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            self.f.refresh([('user', 'pass')], devices=['c.example.com', '2.2.2.2', 'FOC1234'])
+
+        assert sorted(polled) == ['B', 'C']
+
+        with self.assertRaises(KeyError):
+            self.f.refresh([('user', 'pass')], devices=['D'])
+
+    def test_changed_keeps_skipped_neighbors(self):
+        seen_options = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            seen_options.append(scan_options)
+            sw.config_changed = False
+            sw.mac_table = {}
+            sw.scan_results = {'cdp_neighbors': {'status': 'skipped'},
+                               'mac_address': {'status': 'ok'}}
+
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            report = self.f.refresh([('user', 'pass')], devices='changed')
+
+        a, b = self.f.devices['A'], self.f.devices['B']
+        assert all(x == {'incremental': True} for x in seen_options)
+        assert a.interfaces['GigabitEthernet0/0'].neighbors == [b.interfaces['GigabitEthernet0/0']]
+        assert b.interfaces['GigabitEthernet0/0'].neighbors == [a.interfaces['GigabitEthernet0/0']]
+        assert self.pcmac not in self.f.mac_table
+        assert report['A']['macs_removed'] == {self.pcmac}
+        assert report['A']['neighbors_removed'] == set()
+
+    def test_failed_switch_untouched(self):
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            raise ConnectionException("Gone")
+
+        self.f.devices['C'].discovery_status = dt(2000, 1, 1)
+        with mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data):
+            report = self.f.refresh([('user', 'pass')], devices='stale', stale_after=3600)
+
+        a, b = self.f.devices['A'], self.f.devices['B']
+        assert report == {'C': {'status': 'Failed'}}
+        assert a.interfaces['GigabitEthernet0/0'].neighbors == [b.interfaces['GigabitEthernet0/0']]
+        assert self.f.mac_table[self.pcmac]['interface'] is a.interfaces['GigabitEthernet0/1']
+
 
 if __name__ == '__main__':
     unittest.main()
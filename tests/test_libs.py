@@ -0,0 +1,110 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import socket
+import threading
+import unittest
+
+from netwalk.libs import (detect_platform, interface_name_expander,
+                          normalize_hostname, probe_tcp_ports,
+                          read_ssh_banners)
+
+
+def closed_port():
+    "Return a local port nobody is listening on"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestInterfaceNameExpander(unittest.TestCase):
+    def test_expand(self):
+        assert interface_name_expander("Gi1/0/1") == "GigabitEthernet1/0/1"
+        assert interface_name_expander("Vlan10") == "Vlan10"
+
+
+class TestProbeTcpPorts(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.open_port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_open_and_closed(self):
+        localhost = ipaddress.ip_address('127.0.0.1')
+        shut = closed_port()
+        result = probe_tcp_ports([localhost], [self.open_port, shut], 1)
+        assert result == {localhost: {self.open_port}}
+
+
+class TestDetectPlatform(unittest.TestCase):
+    def test_descriptions(self):
+        assert detect_platform("cisco WS-C2960X-48FPD-L") == 'ios'
+        assert detect_platform("N9K-C93180YC-EX") == 'nxos_ssh'
+        assert detect_platform("Cisco IOS XR Software, Version 7.3.2") == 'iosxr'
+        assert detect_platform("Arista Networks EOS version 4.28") == 'eos'
+        assert detect_platform("SSH-2.0-Cisco-1.25") == 'ios'
+        assert detect_platform("Cisco IP Phone 8845") is None
+        assert detect_platform(None) is None
+
+
+class TestNormalizeHostname(unittest.TestCase):
+    def test_normalize(self):
+        assert normalize_hostname(" Core-SW1.Example.com. ") == "core-sw1.example.com"
+        assert normalize_hostname("N9K-A(FDO21120U8S)") == "n9k-a"
+
+
+class TestReadSshBanners(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        self.conns = []
+
+        def serve():
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            conn.sendall(b"SSH-2.0-Cisco-1.25\r\n")
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def tearDown(self):
+        self.listener.close()
+        for conn in self.conns:
+            conn.close()
+
+    def test_banner_and_silent(self):
+        localhost = ipaddress.ip_address('127.0.0.1')
+        assert read_ssh_banners([localhost], self.port, 1) == {localhost: "SSH-2.0-Cisco-1.25"}
+
+        # Second connection is accepted by the kernel but nothing is sent
+        assert read_ssh_banners([localhost], self.port, 0.3) == {localhost: None}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import os
+import tempfile
+import unittest
+
+from netaddr import EUI
+
+from netwalk import Fabric, Interface, Switch
+from netwalk.registry import DeviceRegistry
+
+
+class TestDeviceRegistry(unittest.TestCase):
+    def setUp(self):
+        self.longname = "access-switch-with-a-very-long-name-01.example.com"
+        self.sw = Switch('1.1.1.1', hostname='A', facts={'hostname': 'A',
+                                                        'fqdn': 'A.example.com',
+                                                        'serial_number': 'FOC1234'})
+        self.sw.interfaces_ip = {'Vlan10': {'ipv4': {'10.0.10.1': {'prefix_length': 24}}}}
+        self.sw.add_interface(Interface(name='GigabitEthernet0/1', bia='aabb.cc00.0101'))
+        self.long = Switch('2.2.2.2', hostname=self.longname)
+        self.registry = DeviceRegistry({'A': self.sw, self.longname[:40]: self.long})
+
+    def test_names(self):
+        assert self.registry.resolve('A') is self.sw
+        assert self.registry.resolve('A.example.com') is self.sw
+        assert self.registry.resolve('A.other.domain') is self.sw
+        assert self.registry.resolve(self.longname) is self.long
+        assert self.registry.resolve(self.longname[:40]) is self.long
+        assert self.registry.resolve('B') is None
+
+    def test_ambiguous_short_name(self):
+        self.registry['A.other.domain'] = Switch('3.3.3.3', hostname='A.other.domain')
+
+        assert self.registry.resolve('A.example.com') is self.sw
+        assert self.registry.resolve('A.third.domain') is None
+
+    def test_names_of(self):
+        assert self.registry.names(self.long) == {self.longname, self.longname[:40],
+                                                  "access-switch-with-a-very-long-name-01"}
+        assert {'a', 'a.example.com'} <= self.registry.names(self.sw)
+
+    def test_addresses_serial_mac(self):
+        assert self.registry.by_address('1.1.1.1') is self.sw
+        assert self.registry.by_address(ipaddress.ip_address('10.0.10.1')) is self.sw
+        assert self.registry.by_address('not an address') is None
+        assert self.registry.by_serial('FOC1234') is self.sw
+        assert self.registry.by_mac(EUI('aa:bb:cc:00:01:01')) is self.sw
+
+    def test_reindex_and_remove(self):
+        self.long.facts = {'hostname': 'core', 'fqdn': 'core.example.com'}
+        assert self.registry.resolve('core') is None
+
+        self.registry.reindex(self.long)
+        assert self.registry.resolve('core') is self.long
+
+        self.registry.pop(self.longname[:40])
+        assert self.registry.resolve('core') is None
+        assert self.registry.by_address('2.2.2.2') is None
+
+    def test_replaced_device(self):
+        new = Switch('1.1.1.1', hostname='A')
+        self.registry['A'] = new
+
+        assert self.registry.by_address('1.1.1.1') is new
+        assert self.registry.by_serial('FOC1234') is None
+
+    def test_normalized_names(self):
+        assert self.registry.resolve('a.EXAMPLE.com.') is self.sw
+        assert self.registry.resolve('A(FOX1234ABCD)') is self.sw
+
+    def test_same_device(self):
+        by_serial = Switch('9.9.9.9', hostname='other', facts={'serial_number': 'FOC1234'})
+        by_name = Switch('9.9.9.9', hostname='a.example.com', facts={'serial_number': 'FOC9999'})
+        by_mac = Switch('9.9.9.9', hostname='other')
+        by_mac.add_interface(Interface(name='Vlan1', mac_address='aabb.cc00.0101'))
+
+        assert self.registry.same_device(by_serial) == [self.sw]
+        assert self.registry.same_device(by_name) == []
+        assert self.registry.same_device(by_mac) == [self.sw]
+
+    def test_aliases(self):
+        self.sw.aliases = {ipaddress.ip_address('10.0.20.1'), 'core-a'}
+        self.registry.reindex(self.sw)
+
+        assert self.registry.resolve('core-a.example.com') is self.sw
+        assert self.registry.by_address('10.0.20.1') is self.sw
+
+    def test_fabric_snapshot(self):
+        f = Fabric()
+        f.devices = {'A': self.sw}
+        assert isinstance(f.devices, DeviceRegistry)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "fabric.bin")
+            f.save(path)
+            loaded = Fabric.load(path)
+
+        assert loaded.devices.resolve('A.example.com') is loaded.devices['A']
+        assert loaded.devices.by_serial('FOC1234') is loaded.devices['A']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+import unittest
+from unittest import mock
+
+from netwalk import Fabric, PollScheduler, Switch
+
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.f = Fabric()
+        for hostname, address in (('A', '1.1.1.1'), ('B', '2.2.2.2')):
+            Switch(address, hostname=hostname, fabric=self.f,
+                   facts={'hostname': hostname, 'fqdn': hostname})
+
+        self.polls = []
+
+        def fake_retrieve_data(sw, username, password, napalm_optional_args=None,
+                               scan_options=None, neighbors_callback=None):
+            self.polls.append((sw.hostname, scan_options['whitelist'], scan_options['running_config']))
+            sw.scan_results = {x: {'status': 'ok'} for x in scan_options['whitelist']}
+
+        patcher = mock.patch.object(Switch, 'retrieve_data', fake_retrieve_data)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_modules_polled_at_their_interval(self):
+        reports = []
+        scheduler = PollScheduler(self.f, [('user', 'pass')],
+                                  intervals={'mac_address': 10, 'interface_status': 30, 'config': 100},
+                                  jitter=0, callback=reports.append)
+
+        scheduler.poll_due(1000)
+        assert sorted(self.polls) == [('A', ['mac_address', 'interface_status'], True),
+                                      ('B', ['mac_address', 'interface_status'], True)]
+
+        self.polls.clear()
+        assert scheduler.poll_due(1005) == {}
+        assert self.polls == []
+        assert scheduler.next_due() == 1010
+
+        scheduler.poll_due(1010)
+        assert sorted(self.polls) == [('A', ['mac_address'], False),
+                                      ('B', ['mac_address'], False)]
+
+        self.polls.clear()
+        scheduler.poll_due(1030)
+        assert sorted(self.polls) == [('A', ['mac_address', 'interface_status'], False),
+                                      ('B', ['mac_address', 'interface_status'], False)]
+        assert len(reports) == 3
+        assert set(reports[-1]) == {'A', 'B'}
+
+    def test_jitter_spreads_switches(self):
+        scheduler = PollScheduler(self.f, [('user', 'pass')],
+                                  intervals={'mac_address': 100}, jitter=0.5)
+        # First polls are spread over jitter * interval
+        scheduler.poll_due(0)
+        scheduler.poll_due(50)
+        assert len(self.polls) == 2
+
+        due = [x['mac_address'] for x in scheduler.schedule.values()]
+        assert all(100 <= x <= 200 for x in due)
+        assert due[0] != due[1]
+
+    def test_unknown_module(self):
+        with self.assertRaises(AssertionError):
+            PollScheduler(self.f, [('user', 'pass')], intervals={'arp': 60})
+
+    def test_run_until_stopped(self):
+        scheduler = PollScheduler(self.f, [('user', 'pass')],
+                                  intervals={'mac_address': 3600}, jitter=0)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        scheduler.stop()
+        thread.join(5)
+
+        assert not thread.is_alive()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ipaddress
+import unittest
+
+from netwalk import Fabric, Interface, ScopePolicy, Switch
+from netwalk.scope import PrefixTrie
+
+
+def neighbor(hostname, ip, platform="cisco WS-C2960X-48FPD-L", capabilities=None):
+    nei = {'hostname': hostname,
+           'ip': None if ip is None else ipaddress.ip_address(ip),
+           'platform': platform,
+           'remote_int': 'GigabitEthernet0/1'}
+    if capabilities is not None:
+        nei['capabilities'] = capabilities
+    return nei
+
+
+class TestPrefixTrie(unittest.TestCase):
+    def test_longest_match(self):
+        trie = PrefixTrie()
+        trie.insert('10.0.0.0/8', 'a')
+        trie.insert('10.1.0.0/16', 'b')
+        trie.insert('10.1.2.3/32', 'c')
+        trie.insert('2001:db8::/32', 'v6')
+
+        assert trie.longest_match('10.2.0.1') == 'a'
+        assert trie.longest_match('10.1.0.1') == 'b'
+        assert trie.longest_match(ipaddress.ip_address('10.1.2.3')) == 'c'
+        assert trie.longest_match('192.168.0.1') is None
+        assert trie.longest_match('192.168.0.1', 'x') == 'x'
+        assert trie.longest_match('2001:db8::1') == 'v6'
+
+    def test_default_route(self):
+        trie = PrefixTrie()
+        trie.insert('0.0.0.0/0', False)
+        assert trie.longest_match('8.8.8.8') is False
+        assert trie.longest_match('::1') is None
+
+
+class TestScopePolicy(unittest.TestCase):
+    def test_prefixes(self):
+        policy = ScopePolicy(allow_prefixes=['10.0.0.0/8'], deny_prefixes=['10.9.0.0/16'])
+        assert policy.evaluate([neighbor('a', '10.1.1.1'),
+                                neighbor('b', '10.9.1.1'),
+                                neighbor('c', '192.168.1.1'),
+                                neighbor('d', None)]) == [True, False, False, False]
+
+        policy = ScopePolicy(deny_prefixes=['10.9.0.0/16'])
+        assert policy.allows(neighbor('c', '192.168.1.1'))
+        assert policy.allows(neighbor('d', None))
+        assert not policy.allows(neighbor('b', '10.9.1.1'))
+
+    def test_hostnames(self):
+        policy = ScopePolicy(allow_hostnames=[r'^sw-', r'^core'], deny_hostnames=[r'^.{4}ap', 'axis'])
+        assert policy.allows(neighbor('SW-floor1.example.com', '10.0.0.1'))
+        assert policy.allows(neighbor('core1(FOX1234ABCD)', '10.0.0.2'))
+        assert not policy.allows(neighbor('sw-xap01', '10.0.0.3'))
+        assert not policy.allows(neighbor('sw-axis-cam', '10.0.0.4'))
+        assert not policy.allows(neighbor('router1', '10.0.0.5'))
+
+    def test_platforms_and_capabilities(self):
+        policy = ScopePolicy(platforms=['^ios$', '^nxos'], deny_platforms=['AIR-'])
+        assert policy.allows(neighbor('a', '10.0.0.1'))
+        assert policy.allows(neighbor('b', '10.0.0.2', "N9K-C93180YC-EX"))
+        assert not policy.allows(neighbor('c', '10.0.0.3', "cisco AIR-AP2802I-E-K9"))
+        assert not policy.allows(neighbor('d', '10.0.0.4', "Polycom"))
+
+        policy = ScopePolicy(capabilities=['B', 'R'], deny_capabilities=['w'])
+        assert policy.allows(neighbor('a', '10.0.0.1', capabilities="B,R"))
+        assert not policy.allows(neighbor('b', '10.0.0.2', capabilities="T"))
+        assert not policy.allows(neighbor('c', '10.0.0.3', capabilities="B,W"))
+        # Not advertised
+        assert policy.allows(neighbor('d', '10.0.0.4'))
+        # CDP names
+        assert policy.allows(neighbor('e', '10.0.0.5', capabilities="Switch IGMP"))
+        assert not policy.allows(neighbor('f', '10.0.0.6', capabilities="Host Phone"))
+
+        policy = ScopePolicy(deny_capabilities=['Phone', 'IGMP'])
+        assert not policy.allows(neighbor('a', '10.0.0.1', capabilities="B,T"))
+        assert not policy.allows(neighbor('b', '10.0.0.2', capabilities="Switch IGMP"))
+        assert policy.allows(neighbor('c', '10.0.0.3', capabilities="Router"))
+
+    def test_sites(self):
+        policy = ScopePolicy(deny_hostnames=['^lab'],
+                             sites={'milan': {'prefixes': ['10.1.0.0/16'],
+                                              'deny_hostnames': ['^ap']},
+                                    'milan-dc': {'prefixes': ['10.1.100.0/24']}})
+        assert policy.site_of('10.1.2.3') == 'milan'
+        assert policy.site_of('10.1.100.3') == 'milan-dc'
+        assert policy.site_of('10.2.0.1') is None
+
+        assert policy.evaluate([neighbor('lab1', '10.1.2.3'),
+                                neighbor('ap1', '10.1.2.4'),
+                                neighbor('lab2', '10.1.100.3'),
+                                neighbor('ap2', '10.2.0.1'),
+                                neighbor('lab3', '10.2.0.2')]) == [True, False, False, True, False]
+
+        with self.assertRaises(AssertionError):
+            ScopePolicy(sites={'x': {'prefixes': [], 'hostnames': ['a']}})
+
+
+class TestFabricScope(unittest.TestCase):
+    def test_out_of_scope_not_queued(self):
+        f = Fabric()
+        sw = Switch('10.0.0.1', hostname='sw1', fabric=f)
+        sw.interfaces = {}
+        for i, nei in enumerate([neighbor('sw2', '10.0.0.2'),
+                                 neighbor('ap1', '10.0.0.3', "cisco AIR-AP2802I-E-K9"),
+                                 neighbor('sw3', '192.168.0.1')]):
+            sw.add_interface(Interface(name=f'GigabitEthernet0/{i}', neighbors=[nei]))
+
+        checked = []
+
+        def callback(hostname):
+            checked.append(hostname)
+            return True
+
+        to_discover = f._evaluate_neighbors(
+            sw, callback, ScopePolicy(allow_prefixes=['10.0.0.0/8'], deny_platforms=['AIR-']))
+
+        assert [x.hostname for x in to_discover] == ['sw2']
+        assert checked == ['sw2']
+        assert f.discovery_status[ipaddress.ip_address('10.0.0.2')] == "Queued"
+        assert f.discovery_status[ipaddress.ip_address('10.0.0.3')] == "Skipped"
+        assert f.discovery_status[ipaddress.ip_address('192.168.0.1')] == "Skipped"
+        assert 'ap1' in f.devices and 'sw3' in f.devices
+
+
+if __name__ == '__main__':
+    unittest.main()
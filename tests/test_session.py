@@ -0,0 +1,206 @@
+"""
+netwalk
+Copyright (C) 2021 NTT Ltd
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import unittest
+from unittest import mock
+
+from netwalk import CapabilityCache, Interface, Switch
+from netwalk.session import CommandMemo
+
+SHOW_INTERFACES = """GigabitEthernet0/1 is up, line protocol is up (connected)
+  Hardware is Gigabit Ethernet, address is aaaa.aaaa.aaaa (bia aaaa.aaaa.aaaa)
+  Description: uplink
+"""
+
+
+class FakeNetmiko():
+    "Stands in for a Netmiko connection, counts what is sent"
+
+    def __init__(self):
+        self.sent = []
+        self.timeout = 10
+
+    def send_command(self, command_string, **kwargs):
+        self.sent.append(command_string)
+        if command_string == "show interfaces":
+            return SHOW_INTERFACES
+        return f"output of {command_string}"
+
+
+class FakePipelinedNetmiko(FakeNetmiko):
+    "Answers commands written in one go, echoing each one after the prompt like IOS"
+
+    base_prompt = "sw1"
+    RETURN = "\n"
+
+    def __init__(self, echo=True):
+        super().__init__()
+        self.echo = echo
+        self.buffer = []
+        self.writes = []
+
+    def write_channel(self, data):
+        self.writes.append(data)
+        for command in data.splitlines():
+            echo = command if self.echo else ""
+            self.buffer.append(f"{echo}\r\noutput of {command}\r\nsw1#")
+
+    def read_channel(self):
+        return self.buffer.pop(0) if self.buffer else ""
+
+    def clear_buffer(self):
+        self.buffer = []
+
+
+class FakeDroppingNetmiko(FakePipelinedNetmiko):
+    "Only runs the first of the commands written in one go, then sends a stray line late"
+
+    def __init__(self, late_after=0.4):
+        super().__init__()
+        self.late_after = late_after
+        self.late = None
+
+    def write_channel(self, data):
+        super().write_channel(data.splitlines()[0])
+        self.writes[-1] = data
+        self.late = time.monotonic() + self.late_after
+
+    def read_channel(self):
+        if self.late is not None and time.monotonic() >= self.late:
+            self.late = None
+            self.buffer.append("stray output\r\nsw1#")
+        return super().read_channel()
+
+
+class FakeDriver():
+    "Stands in for a NAPALM driver whose getters use .device"
+
+    def __init__(self, device=None):
+        self.device = device or FakeNetmiko()
+
+    def get_interfaces(self):
+        return self.device.send_command("show interfaces")
+
+
+class TestCommandMemo(unittest.TestCase):
+    def test_show_commands_sent_once(self):
+        memo = CommandMemo(FakeNetmiko())
+        assert memo.send_command("show version") == "output of show version"
+        assert memo.send_command("show  version") == "output of show version"
+        assert memo.connection.sent == ["show version"]
+        assert memo.hits == 1
+
+    def test_other_commands_always_sent(self):
+        memo = CommandMemo(FakeNetmiko())
+        memo.send_command("terminal length 0")
+        memo.send_command("terminal length 0")
+        assert memo.connection.sent == ["terminal length 0"] * 2
+
+    def test_clear(self):
+        memo = CommandMemo(FakeNetmiko())
+        memo.send_command("show version")
+        memo.clear()
+        memo.send_command("show version")
+        assert memo.connection.sent == ["show version"] * 2
+
+    def test_attributes_forwarded(self):
+        connection = FakeNetmiko()
+        memo = CommandMemo(connection)
+        memo.timeout = 30
+        assert connection.timeout == 30
+        assert memo.sent is connection.sent
+
+    def test_prefetch(self):
+        memo = CommandMemo(FakePipelinedNetmiko())
+        commands = ["show cdp neighbors detail", "show vtp status", "show inventory"]
+        assert memo.prefetch(commands) == commands
+        assert len(memo.connection.writes) == 1
+
+        assert memo.send_command("show vtp status") == "output of show vtp status"
+        assert memo.connection.sent == []
+
+    def test_prefetch_small_chunks(self):
+        connection = FakePipelinedNetmiko()
+        memo = CommandMemo(connection)
+        write_channel = connection.write_channel
+
+        def write_split(data):
+            # Prompts and line ends arrive cut in two
+            write_channel(data)
+            text = "".join(connection.buffer)
+            connection.buffer = [text[i:i + 3] for i in range(0, len(text), 3)]
+
+        connection.write_channel = write_split
+        commands = ["show vtp status", "show inventory"]
+        assert memo.prefetch(commands) == commands
+        assert memo.send_command("show inventory") == "output of show inventory"
+        assert connection.sent == []
+
+    def test_prefetch_fallback(self):
+        memo = CommandMemo(FakePipelinedNetmiko(echo=False))
+        assert memo.prefetch(["show vtp status", "show inventory"]) == []
+        assert memo.outputs == {}
+
+        assert memo.send_command("show inventory") == "output of show inventory"
+        assert memo.connection.sent == ["show inventory"]
+
+    def test_prefetch_gives_up_when_device_stalls(self):
+        memo = CommandMemo(FakeDroppingNetmiko())
+        start = time.monotonic()
+        assert memo.prefetch(["show vtp status", "show inventory"],
+                             read_timeout=300, idle_timeout=0.2) == []
+        assert time.monotonic() - start < 3
+        assert memo.prefetch_error.startswith("TimeoutError")
+        assert memo.outputs == {}
+
+        # Late output was drained and does not end up in the next answers
+        assert memo.connection.late is None
+        assert memo.connection.buffer == []
+        assert memo.send_command("show inventory") == "output of show inventory"
+
+    def test_switch_remembers_stalled_prefetch(self):
+        sw = Switch("192.168.1.1", facts={'model': 'WS-C2960X-48FPD-L'})
+        sw.session = FakeDriver(FakeDroppingNetmiko(late_after=0))
+        sw._use_command_memo()
+        sw.capability_cache = CapabilityCache(min_observations=1)
+
+        with mock.patch.object(CommandMemo, 'IDLE_TIMEOUT', 0.2):
+            sw._prefetch(['vtp', 'inventory'])
+            assert len(sw.session.device.connection.writes) == 1
+            assert 'batch_commands' in sw.capability_cache.modules_to_skip(
+                sw.mgmt_address, sw.capability_platform())
+
+            # Next scans send the commands one by one straight away
+            sw._prefetch(['vtp', 'inventory'])
+            assert len(sw.session.device.connection.writes) == 1
+
+    def test_switch_shares_output_with_napalm(self):
+        sw = Switch("192.168.1.1")
+        sw.add_interface(Interface(name='GigabitEthernet0/1'))
+        sw.session = FakeDriver()
+        sw._use_command_memo()
+
+        sw.session.get_interfaces()
+        assert sw._parse_show_interface() == 1
+        assert sw.session.device.connection.sent == ["show interfaces"]
+        assert sw.interfaces['GigabitEthernet0/1'].description == "uplink"
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,13 +16,115 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import unittest
 import ipaddress
-from netwalk import Switch
-from netwalk import Interface
+import pickle
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+import paramiko
+
+from netwalk import CapabilityCache, Interface, Switch
+from netwalk.device import DeadlineExceeded
+
+
+class FakeConnection():
+    "Stands in for a Netmiko connection"
+
+    def __init__(self, session=None):
+        self.closed = threading.Event()
+        self.remote_conn = self
+        self.channel = None
+        self.session = session
+
+    def close(self):
+        self.closed.set()
+
+    def send_command(self, command_string, **kwargs):
+        self.session._wait(command_string)
+        return self.session.outputs.get(command_string, '')
+
+
+class FakeSession():
+    "Stands in for a NAPALM driver, commands listed in hang block until the session is aborted"
+
+    def __init__(self, hang=(), fail=(), config="interface GigabitEthernet0/1\n switchport mode access\n!\n",
+                 outputs=None):
+        self.device = FakeConnection(self)
+        self.config = config
+        self.outputs = {} if outputs is None else outputs
+        self.hang = hang
+        self.fail = list(fail)
+        self.commands = []
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_alive(self):
+        return {'is_alive': not self.device.closed.is_set()}
+
+    def _wait(self, command):
+        self.commands.append(command)
+        if command in self.hang:
+            self.device.closed.wait(5)
+            raise OSError("Socket closed")
+        if command in self.fail:
+            self.fail.remove(command)
+            raise ValueError(f"{command} failed")
+
+    def get_facts(self):
+        self._wait('get_facts')
+        return {'hostname': 'sw1', 'fqdn': 'sw1.example.com'}
+
+    def get_config(self, retrieve):
+        self._wait('get_config')
+        return {'running': self.config}
+
+    def get_mac_address_table(self):
+        self._wait('get_mac_address_table')
+        return [{'mac': 'aa:aa:aa:aa:aa:aa', 'interface': 'Gi0/1', 'vlan': 1, 'static': False,
+                 'active': True, 'moves': 0, 'last_move': 0.0}]
+
+    def get_vlans(self):
+        self._wait('get_vlans')
+        return {1: {'name': 'default', 'interfaces': []}}
+
+    def cli(self, commands):
+        self._wait(commands[0])
+        return {commands[0]: self.outputs.get(commands[0], '')}
+
+
+def fake_connect(session):
+    "Return a Switch.connect replacement that installs session"
+    def connect(sw, username, password, napalm_optional_args=None):
+        session.device = FakeConnection(session)
+        sw.session = session
+        sw.login_time = 0
+    return connect
 
 
 class TestSwitchBasic(unittest.TestCase):
+    def test_interfaces_lock_per_device(self):
+        sw1 = Switch("192.168.1.1")
+        sw2 = Switch("192.168.1.2")
+        assert sw1._interfaces_lock is not sw2._interfaces_lock
+
+        # Holding one device's lock does not block another thread on a different device
+        with sw1._interfaces_lock:
+            thread = threading.Thread(target=sw2.add_interface, args=(Interface(name="GigabitEthernet0/1"),))
+            thread.start()
+            thread.join(2)
+            assert not thread.is_alive()
+
+        loaded = pickle.loads(pickle.dumps(sw1))
+        loaded.add_interface(Interface(name="GigabitEthernet0/2"))
+        assert loaded._interfaces_lock is not sw1._interfaces_lock
+
     def test_base_switch(self):
         config = ("interface GigabitEthernet0/1\n"
                   " switchport mode access\n"
@@ -54,5 +156,474 @@ class TestSwitchBasic(unittest.TestCase):
         assert vlans == {1, 2, 3, 4, 5, 999, 111}
 
 
+class TestSwitchDeadlines(unittest.TestCase):
+    def test_module_timeout_keeps_other_modules(self):
+        session = FakeSession(hang=['show vtp status'])
+        sw = Switch("192.168.1.1", module_timeouts={'vtp': 0.2})
+
+        start = time.monotonic()
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['mac_address', 'vtp', 'vlans']})
+
+        # vtp hangs twice, vlans runs on the second session
+        assert time.monotonic() - start < 2
+        assert sw.hostname == 'sw1.example.com'
+        assert len(sw.mac_table) == 1
+        assert sw.scan_results['mac_address']['status'] == 'ok'
+        assert sw.scan_results['vtp']['status'] == 'timeout'
+        assert sw.scan_results['vtp']['attempts'] == 2
+        assert sw.scan_results['vlans']['status'] == 'ok'
+        assert sw.vlans_set == {1}
+
+    def test_device_timeout_covers_config(self):
+        session = FakeSession(hang=['get_config'])
+        sw = Switch("192.168.1.1", device_timeout=0.2)
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            with self.assertRaises(DeadlineExceeded):
+                sw.retrieve_data('user', 'pass')
+
+        assert sw.facts is not None
+        assert sw.scan_results == {}
+
+    def test_budget_shared_by_login_attempts(self):
+        sw = Switch("192.168.1.1", device_timeout=0.3)
+        attempts = []
+
+        def refused(sw, *args, **kwargs):
+            attempts.append(time.monotonic())
+            time.sleep(0.2)
+            raise ConnectionRefusedError
+
+        with mock.patch.object(Switch, 'connect', refused):
+            with self.assertRaises(DeadlineExceeded):
+                with sw.time_budget():
+                    for _ in range(5):
+                        try:
+                            sw.retrieve_data('user', 'pass')
+                        except ConnectionRefusedError:
+                            continue
+
+        assert len(attempts) == 2
+
+    def test_abort_before_start(self):
+        session = FakeSession()
+        sw = Switch("192.168.1.1")
+        sw.abort("Not needed anymore")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            with self.assertRaises(DeadlineExceeded):
+                sw.retrieve_data('user', 'pass')
+            assert sw.facts is None
+
+            sw.clear_abort()
+            sw.retrieve_data('user', 'pass', scan_options={'whitelist': ['mac_address']})
+
+        assert sw.facts is not None
+
+
+class TestSwitchFaultIsolation(unittest.TestCase):
+    def test_failed_module_is_retried_alone(self):
+        session = FakeSession(fail=['show inventory'])
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['mac_address', 'inventory']})
+
+        assert session.commands.count('get_mac_address_table') == 1
+        assert session.commands.count('show inventory') == 2
+        assert sw.scan_results['inventory']['status'] == 'ok'
+        assert sw.scan_results['inventory']['attempts'] == 2
+        assert len(sw.mac_table) == 1
+
+    def test_failed_module_does_not_stop_others(self):
+        session = FakeSession(fail=['show vtp status', 'show vtp status'])
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['vtp', 'mac_address']})
+
+        assert sw.scan_results['vtp']['status'] == 'failed'
+        assert 'ValueError' in sw.scan_results['vtp']['error']
+        assert sw.scan_results['mac_address']['status'] == 'ok'
+
+
+    def test_neighbor_on_interface_not_in_config(self):
+        cdp = """-------------------------
+Device ID: router1.example.com
+Entry address(es):
+  IP address: 10.0.0.2
+Platform: cisco ISR4331/K9,  Capabilities: Router Switch IGMP
+Interface: Serial0/1/0,  Port ID (outgoing port): Serial0/1/0
+Holdtime : 170 sec
+
+Version :
+Cisco IOS XE Software, Version 16.09.04
+
+"""
+        session = FakeSession(outputs={'show cdp neighbors detail': cdp})
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={'whitelist': ['cdp_neighbors']})
+
+        assert sw.scan_results['cdp_neighbors']['status'] == 'ok'
+        assert sw.interfaces['Serial0/1/0'].device is sw
+        assert sw.interfaces['Serial0/1/0'].neighbors[0]['hostname'] == 'router1.example.com'
+        assert sw.interfaces['Serial0/1/0'].neighbors[0]['capabilities'] == 'Router Switch IGMP'
+
+
+class TestSwitchCapabilities(unittest.TestCase):
+    def test_unsupported_module_skipped(self):
+        cache = CapabilityCache(min_observations=2)
+        options = {'whitelist': ['mac_address', 'inventory', 'vtp']}
+        outputs = {'show vtp status': "% Invalid input detected at '^' marker."}
+
+        for _ in range(2):
+            # Empty inventory and failed MAC table say nothing about the device
+            session = FakeSession(outputs=outputs, fail=['get_mac_address_table'] * 2)
+            sw = Switch("192.168.1.1", capability_cache=cache)
+            with mock.patch.object(Switch, 'connect', fake_connect(session)):
+                sw.retrieve_data('user', 'pass', scan_options=options)
+
+            assert sw.scan_results['vtp']['status'] == 'unsupported'
+            assert sw.scan_results['inventory'] == {'status': 'ok', 'duration': mock.ANY, 'error': None,
+                                                    'attempts': 1, 'items': 0}
+            assert sw.scan_results['mac_address']['status'] == 'failed'
+
+        session = FakeSession(outputs=outputs)
+        sw = Switch("192.168.1.1", capability_cache=cache)
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options=options)
+
+        assert 'show vtp status' not in session.commands
+        assert 'show inventory' in session.commands
+        assert 'get_mac_address_table' in session.commands
+        assert sw.scan_results['vtp']['status'] == 'skipped'
+
+
+class TestSwitchPlatform(unittest.TestCase):
+    def test_platform_argument(self):
+        assert Switch("192.168.1.1").platform == 'ios'
+        assert Switch("192.168.1.1").platform_source == 'default'
+        assert Switch("192.168.1.1", platform='nxos_ssh').platform_source == 'user'
+        # Misspelled argument of earlier versions still works
+        assert Switch("192.168.1.1", platfomr='eos').platform == 'eos'
+
+    def test_non_ios_runs_napalm_modules_only(self):
+        session = FakeSession()
+        sw = Switch("192.168.1.1", platform='nxos_ssh')
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass',
+                             scan_options={'whitelist': ['mac_address', 'inventory']})
+
+        assert 'show inventory' not in session.commands
+        assert sw.scan_results['mac_address']['status'] == 'ok'
+        assert sw.scan_results['inventory']['status'] == 'skipped'
+        assert 'nxos_ssh' in sw.scan_results['inventory']['error']
+
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+
+
+class ScpServer(paramiko.ServerInterface):
+    "Serves files over SCP to anyone, no SFTP"
+
+    def __init__(self, files):
+        self.files = files
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._send, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def _send(self, channel, command):
+        path = command.split()[-1]
+        channel.recv(1)
+        if path not in self.files:
+            channel.sendall(f"\x01scp: {path}: No such file\n".encode())
+            channel.send_exit_status(1)
+        else:
+            data = self.files[path].encode()
+            channel.sendall(f"C0644 {len(data)} running-config\n".encode())
+            channel.recv(1)
+            channel.sendall(data + b"\x00")
+            channel.recv(1)
+            channel.send_exit_status(0)
+        channel.close()
+
+
+class FakeSshDevice():
+    "Local SSH server and a client connected to it, like the one under a Netmiko session"
+
+    def __init__(self, files):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.transports = []
+        threading.Thread(target=self._listen, args=(files,), daemon=True).start()
+
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect('127.0.0.1', port=self.sock.getsockname()[1], username='user',
+                            password='pass', allow_agent=False, look_for_keys=False)
+        self.channel = self.client.get_transport().open_session()
+
+    def _listen(self, files):
+        conn, _ = self.sock.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(HOST_KEY)
+        transport.start_server(server=ScpServer(files))
+        self.transports.append(transport)
+
+    def close(self):
+        self.client.close()
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class TestSwitchConfigTransfer(unittest.TestCase):
+    config = "hostname sw1\n!\ninterface GigabitEthernet0/1\n switchport mode access\n!\nend"
+
+    def scan(self, files, cache=None):
+        device = FakeSshDevice(files)
+        self.addCleanup(device.close)
+        session = FakeSession(config="interface GigabitEthernet0/2\n!\n")
+
+        def connect(sw, username, password, napalm_optional_args=None):
+            fake_connect(session)(sw, username, password)
+            session.device.remote_conn = device.channel
+
+        sw = Switch("192.168.1.1", capability_cache=cache)
+        with mock.patch.object(Switch, 'connect', connect):
+            sw.retrieve_data('user', 'pass', scan_options={'whitelist': [],
+                                                           'config_transfer': True})
+
+        return sw, session
+
+    def test_scp(self):
+        header = "Building configuration...\r\n\r\nCurrent configuration : 84 bytes\r\n!\r\n"
+        sw, session = self.scan({'system:running-config': header + self.config.replace("\n", "\r\n")})
+
+        assert sw.config == "!\nhostname sw1\n!\ninterface GigabitEthernet0/1\n switchport mode access\n!\nend"
+        assert 'GigabitEthernet0/1' in sw.interfaces
+        assert 'get_config' not in session.commands
+        assert sw.config_fetch['method'] == 'scp'
+        assert sw.config_fetch['size'] == len(sw.config)
+
+    def test_cli_fallback_remembered(self):
+        cache = CapabilityCache(min_observations=1)
+        sw, session = self.scan({}, cache)
+
+        assert 'get_config' in session.commands
+        assert 'GigabitEthernet0/2' in sw.interfaces
+        assert sw.config_fetch['method'] == 'cli'
+        assert cache.modules_to_skip('192.168.1.1') == {'config_transfer'}
+
+        with mock.patch.object(Switch, '_transfer_running_config') as transfer:
+            sw, session = self.scan({}, cache)
+        transfer.assert_not_called()
+        assert sw.config_fetch['method'] == 'cli'
+
+
+class TestSwitchIncremental(unittest.TestCase):
+    def scan(self, sw, probe):
+        session = FakeSession(outputs={
+            "show configuration id": "% Invalid input detected at '^' marker.",
+            "show running-config | include ^! Last configuration change": probe})
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={'incremental': True})
+
+        return session
+
+    def test_unchanged_config_skipped(self):
+        sw = Switch("192.168.1.1")
+        probe = "! Last configuration change at 10:00:00 UTC Mon Oct 5 2026 by admin"
+        session = self.scan(sw, probe)
+        assert 'get_config' in session.commands
+        assert sw.config_changed is None
+        assert sw.config_probe['output'].endswith(probe)
+
+        session = self.scan(sw, probe)
+        assert 'get_config' not in session.commands
+        assert 'show vtp status' not in session.commands
+        assert sw.config_changed is False
+        assert sw.scan_results['vtp'] == {'status': 'skipped', 'duration': 0.0, 'error': "Config unchanged",
+                                          'attempts': 0, 'items': 0}
+        assert sw.scan_results['mac_address']['status'] == 'ok'
+        assert 'show interfaces' in session.commands
+        # Counted again, not added to the previous count
+        assert sw.interfaces['GigabitEthernet0/1'].mac_count == 1
+
+        session = self.scan(sw, probe.replace("10:00:00", "11:30:00"))
+        assert 'get_config' in session.commands
+        assert 'show vtp status' in session.commands
+        assert sw.config_changed is True
+
+
+class TestSwitchConfigDerived(unittest.TestCase):
+    config = """username admin privilege 15 secret 9 $9$abcdef
+username guest password 7 0822455D0A16
+vtp mode transparent
+vlan 10
+ name USERS
+vlan 20-21
+interface GigabitEthernet0/1
+ switchport access vlan 10
+ switchport mode access
+!
+interface Vlan10
+ ip address 10.0.10.1 255.255.255.0
+ ipv6 address 2001:DB8::1/64
+!
+"""
+
+    def test_derived_from_config(self):
+        session = FakeSession(config=self.config)
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['vlans', 'local_admins'], 'from_config': True})
+
+        assert 'get_vlans' not in session.commands
+        assert sw.config_derived == {'vlans', 'local_admins', 'interfaces_ip'}
+        assert sw.vlans[10] == {'name': 'USERS', 'interfaces': ['GigabitEthernet0/1']}
+        assert sw.vlans[21]['name'] == 'VLAN0021'
+        assert sw.vlans_set == {1, 10, 20, 21}
+        assert sw.local_admins['admin'] == {'level': 15, 'password': '$9$abcdef', 'sshkeys': []}
+        assert sw.local_admins['guest']['level'] == 1
+        assert sw.interfaces_ip == {'Vlan10': {'ipv4': {'10.0.10.1': {'prefix_length': 24}},
+                                               'ipv6': {'2001:db8::1': {'prefix_length': 64}}}}
+
+    def test_vtp_server_asks_for_vlans(self):
+        config = self.config.replace("vtp mode transparent\n", "").replace(
+            " ip address 10.0.10.1", " ip address dhcp\n ip address 10.0.10.1")
+        session = FakeSession(config=config)
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['vlans'], 'from_config': True})
+
+        assert 'get_vlans' in session.commands
+        assert sw.config_derived == {'local_admins'}
+
+
+    def test_addresses_known_at_runtime(self):
+        eui64 = self.config.replace(" ipv6 address 2001:DB8::1/64", " ipv6 address 2001:DB8::/64 eui-64")
+        tunnel = self.config + "interface Tunnel0\n ip address 10.0.99.1 255.255.255.252\n!\n"
+
+        for config in (eui64, tunnel):
+            session = FakeSession(config=config)
+            sw = Switch("192.168.1.1")
+
+            with mock.patch.object(Switch, 'connect', fake_connect(session)):
+                sw.retrieve_data('user', 'pass', scan_options={
+                    'whitelist': ['vlans'], 'from_config': True})
+
+            assert sw.config_derived == {'vlans', 'local_admins'}
+            assert sw.interfaces_ip == {}
+
+
+class TestSwitchProfiles(unittest.TestCase):
+    def test_port_usage_profile(self):
+        command = "show interfaces | include line protocol|Last input|input errors|output errors"
+        output = """GigabitEthernet0/1 is up, line protocol is up (connected)
+  Last input 00:00:01, output never, output hang never
+     12 input errors, 3 CRC, 0 frame, 0 overrun, 0 ignored
+     0 output errors, 0 collisions, 1 interface resets
+"""
+        session = FakeSession(outputs={command: output})
+        sw = Switch("192.168.1.1")
+
+        with mock.patch.object(Switch, 'connect', fake_connect(session)):
+            sw.retrieve_data('user', 'pass', scan_options={'profile': 'port-usage'})
+
+        assert sw.collection_profile == 'port-usage'
+        assert set(sw.scan_results) == {'mac_address', 'interface_status',
+                                        'cdp_neighbors', 'lldp_neighbors'}
+        assert command in session.commands
+        intf = sw.interfaces['GigabitEthernet0/1']
+        assert intf.input_errors == '12'
+        assert intf.crc == '3'
+        assert intf.is_up
+        assert intf.mtu is None
+
+    def test_unknown_profile(self):
+        sw = Switch("192.168.1.1")
+        sw.session = FakeSession()
+        with self.assertRaises(AssertionError):
+            sw._get_switch_data(profile='everything')
+
+
+class BarrierSession(FakeSession):
+    "CLI commands wait for each other, they only succeed if sent at the same time"
+
+    def __init__(self, barrier, **kwargs):
+        super().__init__(**kwargs)
+        self.barrier = barrier
+
+    def cli(self, commands):
+        self.barrier.wait()
+        return super().cli(commands)
+
+
+class TestSwitchParallelSessions(unittest.TestCase):
+    outputs = {'show vtp status': 'VTP Operating Mode : Transparent',
+               'show inventory': ''}
+
+    def test_modules_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2)
+        sessions = []
+
+        def connect(sw, username, password, napalm_optional_args=None):
+            sw.session = BarrierSession(barrier, outputs=self.outputs)
+            sw.login_time = 0
+            sessions.append(sw.session)
+
+        sw = Switch("192.168.1.1")
+        with mock.patch.object(Switch, 'connect', connect):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['vtp', 'inventory'], 'max_sessions': 2})
+
+        assert len(sessions) == 2
+        assert sw.scan_results['vtp']['status'] == 'ok'
+        assert sw.scan_results['inventory']['status'] == 'ok'
+        assert sw.vtp == 'VTP Operating Mode : Transparent'
+        assert sw.session is sessions[0]
+
+    def test_extra_session_refused(self):
+        sessions = []
+
+        def connect(sw, username, password, napalm_optional_args=None):
+            if sessions:
+                raise ConnectionRefusedError("Too many sessions")
+            sw.session = FakeSession(outputs=self.outputs)
+            sw.login_time = 0
+            sessions.append(sw.session)
+
+        sw = Switch("192.168.1.1")
+        with mock.patch.object(Switch, 'connect', connect):
+            sw.retrieve_data('user', 'pass', scan_options={
+                'whitelist': ['vtp', 'inventory', 'mac_address'], 'max_sessions': 3})
+
+        assert sessions[0].commands.count('show vtp status') == 1
+        assert all(x['status'] == 'ok' for x in sw.scan_results.values())
+        assert len(sw.mac_table) == 1
+
+
 if __name__ == '__main__':
     unittest.main()